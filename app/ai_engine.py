@@ -1,8 +1,37 @@
 import os
-from openai import OpenAI
+import re
+import json
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from chunking import chunk_text, count_tokens
+from field_memo import apply_memo
+from file_parser import compact_user_data
+from form_rules import apply_rules
+from retrieval import PassageIndex
+from llm_cache import cache_enabled, cache_key, get_cache
+from llm_client import EXPECTED_COMPLETION_TOKENS, LLMError, chat_completion, chat_completion_stream
+from resources import lazy_module
+from telemetry import propagate, span
 load_dotenv()
 
+jsonschema = lazy_module("jsonschema")
+
+OPENAI_MODEL = "gpt-4"
+OPENAI_TEMPERATURE = 0.1
+SYSTEM_PROMPT = "You are an expert tax professional and CPA with deep knowledge of IRS regulations and tax law."
+
+# Upper bound on simultaneous model calls made by fill_pdf_form / suggest_deductions.
+LLM_MAX_CONCURRENCY = int(os.getenv("WISECPA_LLM_CONCURRENCY", "4"))
+# Token budget of document text per suggest_deductions prompt.
+DEDUCTION_CHUNK_TOKENS = int(os.getenv("WISECPA_DEDUCTION_CHUNK_TOKENS", "3000"))
+FILL_BATCH_SIZE = 50
+# Follow-up prompts for fields whose answer failed validation, per batch.
+FILL_REPAIR_ATTEMPTS = int(os.getenv("WISECPA_FILL_REPAIR_ATTEMPTS", "1"))
+# fill_pdf_form sends user data whole below this size; above it, only retrieved passages.
+RETRIEVAL_MIN_TOKENS = int(os.getenv("WISECPA_RETRIEVAL_MIN_TOKENS", "1500"))
+RETRIEVAL_CONTEXT_TOKENS = int(os.getenv("WISECPA_RETRIEVAL_CONTEXT_TOKENS", "1500"))
+
 # def run_mistral(prompt: str) -> str:
 #     """Call Ollama with Mistral and return the output."""
 #     try:
@@ -18,26 +47,104 @@ load_dotenv()
 #     except Exception as e:
 #         return f"❌ Error running model: {e}"
 
-def run_openai(prompt: str) -> str:
-    """Call OpenAI GPT-4 and return the output."""
-    try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are an expert tax professional and CPA with deep knowledge of IRS regulations and tax law."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1  
-        )        
-        result = response.choices[0].message.content.strip()
-        return result
-        
-    except Exception as e:
-        return f"❌ Error running model: {e}"
-
-def suggest_deductions(document_text: str) -> str:
-    prompt = f"""
+def run_openai(prompt: str, use_cache: bool = True) -> str:
+    """
+    Call OpenAI GPT-4 and return the output.
+    Successful answers are served from / stored in the on-disk LLM cache unless
+    ``use_cache`` is False or WISECPA_LLM_CACHE=0. Failures raise LLMError
+    (see llm_client) rather than returning error text.
+    """
+    cache = get_cache() if use_cache and cache_enabled() else None
+    key = cache_key(OPENAI_MODEL, OPENAI_TEMPERATURE, SYSTEM_PROMPT, prompt)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    response = chat_completion(
+        [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        model=OPENAI_MODEL,
+        temperature=OPENAI_TEMPERATURE
+    )
+    result = (response.choices[0].message.content or "").strip()
+
+    if cache is not None:
+        cache.put(key, result)
+    return result
+
+def stream_openai(prompt: str, use_cache: bool = True):
+    """
+    Streaming counterpart of run_openai: yields text as the model produces it.
+    A cached answer is yielded in one piece; a completed stream is cached.
+    """
+    cache = get_cache() if use_cache and cache_enabled() else None
+    key = cache_key(OPENAI_MODEL, OPENAI_TEMPERATURE, SYSTEM_PROMPT, prompt)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    for delta in chat_completion_stream(
+        [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        model=OPENAI_MODEL,
+        temperature=OPENAI_TEMPERATURE
+    ):
+        parts.append(delta)
+        yield delta
+
+    if cache is not None:
+        cache.put(key, "".join(parts).strip())
+
+def _iter_lines(deltas):
+    """Re-cut a stream of text deltas into complete lines, emitting each as soon as it ends."""
+    pending = ""
+    for delta in deltas:
+        pending += delta
+        *lines, pending = pending.split("\n")
+        yield from lines
+    if pending:
+        yield pending
+
+def _map_concurrently(fn, items: list, max_concurrency: int | None = None) -> list:
+    """Run fn over items on a bounded thread pool; results are returned in input order."""
+    if not items:
+        return []
+    workers = max(1, min(max_concurrency or LLM_MAX_CONCURRENCY, len(items)))
+    if workers == 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(propagate(fn), items))
+
+def _normalize_deduction(name: str) -> str:
+    """Dedup key for deduction names: case, punctuation and spacing differences collapse."""
+    name = name.casefold().replace("&", " and ")
+    return re.sub(r"[^a-z0-9]+", " ", name).strip()
+
+def _parse_deduction_lines(raw_response: str) -> list[str]:
+    # Clean up the response - remove numbers, bullets, etc.
+    lines = []
+    for line in raw_response.split('\n'):
+        line = line.strip()
+        if line:
+            # Remove numbers (1., 2.), bullets (•, -, *), etc.
+            cleaned_line = re.sub(r'^[\d]+[\.\)]\s*', '', line)  # Remove "1. " or "1) "
+            cleaned_line = re.sub(r'^[•\-\*]\s*', '', cleaned_line)  # Remove "• " or "- " or "* "
+            cleaned_line = cleaned_line.strip()
+            
+            if cleaned_line:
+                lines.append(cleaned_line)
+    return lines
+
+def _deduction_prompt(document_text: str) -> str:
+    return f"""
 You are an expert tax professional with deep knowledge of IRS regulations. Analyze the following tax document and identify ALL IRS-eligible deductions, credits, and income types that are clearly supported by the document content.
 
 IMPORTANT REQUIREMENTS:
@@ -58,36 +165,97 @@ CRITICAL: Return ONLY deduction/income names, one per line, NO numbers, NO bulle
 
 Document:
 \"\"\"
-{document_text[:3000]}
+{document_text}
 \"\"\"
 
 Deduction/Income names:"""
-    
-    raw_response = run_openai(prompt)
-    
-    # Clean up the response - remove numbers, bullets, etc.
-    lines = []
-    for line in raw_response.split('\n'):
-        line = line.strip()
-        if line:
-            # Remove common list formatting
-            import re
-            # Remove numbers (1., 2.), bullets (•, -, *), etc.
-            cleaned_line = re.sub(r'^[\d]+[\.\)]\s*', '', line)  # Remove "1. " or "1) "
-            cleaned_line = re.sub(r'^[•\-\*]\s*', '', cleaned_line)  # Remove "• " or "- " or "* "
-            cleaned_line = cleaned_line.strip()
-            
-            if cleaned_line:
-                lines.append(cleaned_line)
-    
+
+def _deductions_for_chunk(document_text: str) -> list[str]:
+    return _parse_deduction_lines(run_openai(_deduction_prompt(document_text)))
+
+def suggest_deductions(document_text: str, max_concurrency: int | None = None) -> str:
+    """
+    Identify deductions/income types across the whole document set.
+    The text is split into token-budgeted chunks on document/page boundaries,
+    chunks are analysed concurrently, and the partial lists are merged with
+    duplicates (after normalization) removed, keeping first-seen order.
+    """
+    chunks = chunk_text(document_text, DEDUCTION_CHUNK_TOKENS, OPENAI_MODEL) or [""]
+    partials = _map_concurrently(_deductions_for_chunk, chunks, max_concurrency)
+
     # Return all identified deductions (no artificial limit)
-    return '\n'.join(lines)
+    return '\n'.join(merge_deductions(partials))
 
-def recommend_forms(document_text: list):
+def merge_deductions(partials) -> list[str]:
+    """Concatenate deduction lists, dropping duplicates (after normalization) and keeping first-seen order."""
+    lines, seen = [], set()
+    for partial in partials:
+        for line in partial:
+            key = _normalize_deduction(line)
+            if key and key not in seen:
+                seen.add(key)
+                lines.append(line)
+    return lines
+
+def iter_deductions(document_text: str, max_concurrency: int | None = None):
+    """
+    Streaming suggest_deductions: yields each deduction name as soon as its line
+    is complete. Chunks stream concurrently, so names arrive in completion
+    order; duplicates are still removed.
+    """
+    for _, name in iter_document_deductions([document_text], max_concurrency):
+        if name is not None:
+            yield name
+
+def iter_document_deductions(texts: list[str], max_concurrency: int | None = None):
+    """
+    iter_deductions for several documents at once: the chunks of every
+    document share one pool of at most ``max_concurrency`` requests (default
+    LLM_MAX_CONCURRENCY). Yields (document index, name) as lines complete,
+    without duplicates within a document, and (document index, None) once
+    all of that document's chunks are done.
+    """
+    chunked = [chunk_text(text, DEDUCTION_CHUNK_TOKENS, OPENAI_MODEL) or [""] for text in texts]
+    done = object()
+    results = queue.Queue()
+
+    def stream_chunk(item):
+        index, chunk = item
+        try:
+            for line in _iter_lines(stream_openai(_deduction_prompt(chunk))):
+                for name in _parse_deduction_lines(line):
+                    results.put((index, name))
+        except Exception as e:
+            results.put((index, e))
+        finally:
+            results.put((index, done))
+
+    items = [(i, chunk) for i, chunks in enumerate(chunked) for chunk in chunks]
+    workers = max(1, min(max_concurrency or LLM_MAX_CONCURRENCY, len(items)))
+    seen = [set() for _ in texts]
+    remaining = [len(chunks) for chunks in chunked]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for item in items:
+            pool.submit(propagate(stream_chunk), item)
+        while any(remaining):
+            index, item = results.get()
+            if item is done:
+                remaining[index] -= 1
+                if not remaining[index]:
+                    yield index, None
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                key = _normalize_deduction(item)
+                if key and key not in seen[index]:
+                    seen[index].add(key)
+                    yield index, item
+
+def _forms_prompt(document_text: list) -> str:
     # Convert deductions list to text for AI analysis
     deductions_text = " ".join(str(item) for item in document_text)
     
-    prompt = f"""
+    return f"""
 You are an expert tax professional with comprehensive knowledge of all IRS forms and schedules. Based on the following deductions and income types identified from a taxpayer's documents, recommend ALL relevant IRS forms and schedules that would be needed to file their tax return.
 
 IMPORTANT REQUIREMENTS:
@@ -113,50 +281,52 @@ Schedule_D|f1040sd - Capital Gains and Losses
 
 CRITICAL: Return ONLY form names, codes, and descriptions in the format shown above, one per line, NO numbers, NO bullets, NO formatting.
 """
-    raw_response = run_openai(prompt)
+
+def _parse_form_line(line: str) -> dict | None:
+    """Parse one "Form_1040|f1040 - description" line into a form dict."""
+    line = line.strip()
+    if line and '|' in line and ' - ' in line:
+        parts = line.split('|', 1)
+        if len(parts) == 2:
+            form_name = parts[0].strip()
+            remaining = parts[1].strip()
+            if ' - ' in remaining:
+                code_desc = remaining.split(' - ', 1)
+                if len(code_desc) == 2:
+                    form_code = code_desc[0].strip()
+                    description = code_desc[1].strip()
+                    return {
+                        "form": form_name,
+                        "code": form_code,
+                        "desc": description
+                    }
+    return None
+
+def recommend_forms(document_text: list):
+    raw_response = run_openai(_forms_prompt(document_text))
     
     # Parse the AI response into form objects
     forms = []
     for line in raw_response.split('\n'):
-        line = line.strip()
-        if line and '|' in line and ' - ' in line:
-            parts = line.split('|', 1)
-            if len(parts) == 2:
-                form_name = parts[0].strip()
-                remaining = parts[1].strip()
-                if ' - ' in remaining:
-                    code_desc = remaining.split(' - ', 1)
-                    if len(code_desc) == 2:
-                        form_code = code_desc[0].strip()
-                        description = code_desc[1].strip()
-                        forms.append({
-                            "form": form_name,
-                            "code": form_code,
-                            "desc": description
-                        })
+        form = _parse_form_line(line)
+        if form:
+            forms.append(form)
     return forms
 
-def fill_pdf_form(pdf_fields: list[dict], user_data: str, form_name: str) -> dict:
-    """
-    Fill PDF form with user data using AI analysis.
-    Processes fields in batches of 50 to avoid token limits.
-    """
-    import json
-    
-    combined_form_fields = {}
-    combined_semantic_fields = {}
-    
-    batch_size = 50
-    total_fields = len(pdf_fields)
-    
-    
-    for i in range(0, total_fields, batch_size):
-        batch_fields = pdf_fields[i:i + batch_size]
-        batch_num = (i // batch_size) + 1
-        total_batches = (total_fields + batch_size - 1) // batch_size
-        
-        
-        prompt = f"""
+def iter_forms(document_text: list):
+    """Streaming recommend_forms: yields each form dict as soon as its line is complete."""
+    for line in _iter_lines(stream_openai(_forms_prompt(document_text))):
+        form = _parse_form_line(line)
+        if form:
+            yield form
+
+def _field_line(field_id: int, field: dict) -> str:
+    label = " ".join((field.get("label") or "").split()) or field.get("field_name", "")
+    return f"{field_id}: {label}"
+
+def _fill_batch_prompt(table: dict[int, dict], user_data: str, form_name: str, batch_num: int, total_batches: int) -> str:
+    fields = "\n".join(_field_line(i, f) for i, f in table.items())
+    return f"""
 You are an expert at filling IRS tax forms. Analyze the user's data and map it to the appropriate fields for the {form_name} form.
 
 USER DATA:
@@ -164,82 +334,228 @@ USER DATA:
 {user_data}
 \"\"\"
 
-PDF FIELDS WITH LABELS (Batch {batch_num}/{total_batches}):
-{batch_fields}
+PDF FIELDS (Batch {batch_num}/{total_batches}), one per line as ID: label:
+{fields}
 
 TASK:
-1. UNDERSTAND THE FIELD STRUCTURE:
-   - Each field has a 'field_name' (like "topmostSubform[0].Page1[0].f1_01[0]") and a 'label' (like "Your first name and middle initial")
-   - The LABEL tells you what the field is for
-   - The FIELD_NAME is what you must use in the response
-
-2. FIELD MAPPING PROCESS:
-   - READ the labels to understand what each field represents
-   - EXTRACT relevant data from user_data based on the label meaning
-   - RETURN the data using the EXACT field_name, not the label
-
-3. EXAMPLES OF LABEL → FIELD_NAME MAPPING:
-   - Label: "Your first name and middle initial" → Use field_name: "topmostSubform[0].Page1[0].f1_04[0]"
-   - Label: "Your social security number" → Use field_name: "topmostSubform[0].Page1[0].f1_06[0]"
-   - Label: "If joint return, spouse's first name" → Use field_name: "topmostSubform[0].Page1[0].f1_07[0]"
-
-4. DATA EXTRACTION RULES:
-   - NAMES: Split full names into first/middle/last based on label context
-   - ADDRESSES: Separate street, city, state, zip correctly
-   - SSN: Format as XXX-XX-XXXX
-   - INCOME: Match amounts to appropriate income fields
-   - CHECKBOXES: Set to "Yes" or "No" based on data
-
-CRITICAL RULES:
-- READ the labels to understand what each field is for
-- USE the field_name (not the label) in your response
-- Use ONLY the field names from the PDF fields list above
-- Do NOT make up field names
-- In form_fields, use the EXACT field_name values from the PDF
-- In semantic_fields, use human-readable descriptions
-- Be PRECISE about data extraction and field matching
-- Output ONLY valid JSON - no markdown, no code blocks, no explanations
-- Do NOT add any text before or after the JSON
-- Do NOT use single quotes - use double quotes only
-- Output must be EXACTLY this format with no variations:
-
-{{
-  "form_fields": {{
-    "topmostSubform[0].Page1[0].f1_01[0]": "value",
-    "topmostSubform[0].Page1[0].f1_02[0]": "value"
-  }},
-  "semantic_fields": {{
-    "human_readable_name": "value",
-    "another_readable_name": "value"
-  }}
-}}
-
-RESPOND WITH ONLY THE JSON OBJECT - NOTHING ELSE.
+- READ each label to understand what the field is for
+- EXTRACT the matching value from the user data
+
+DATA EXTRACTION RULES:
+- NAMES: Split full names into first/middle/last based on label context
+- ADDRESSES: Separate street, city, state, zip correctly
+- SSN: Format as XXX-XX-XXXX
+- INCOME: Match amounts to appropriate income fields
+- CHECKBOXES: Set to "Yes" or "No" based on data
+
+RESPONSE FORMAT:
+- One JSON object mapping field ID to value, e.g. {{"1": "John A", "3": "123-45-6789"}}
+- Use ONLY the IDs listed above; leave out fields the user data does not cover
+- Every value is a string
+- Output ONLY the JSON object - no markdown, no code blocks, no explanations
 """
-        
-        raw_response = run_openai(prompt)
-        
+
+def _repair_prompt(table: dict[int, dict], user_data: str, form_name: str) -> str:
+    fields = "\n".join(_field_line(i, f) for i, f in table.items())
+    return f"""
+Your previous answer for these {form_name} fields was not valid JSON of the form {{"ID": "value"}}.
+
+USER DATA:
+\"\"\"
+{user_data}
+\"\"\"
+
+PDF FIELDS, one per line as ID: label:
+{fields}
+
+Answer again with ONE JSON object mapping field ID to a string value, using only the IDs above and
+leaving out fields the user data does not cover. Output ONLY the JSON object.
+"""
+
+def _answer_schema(table: dict[int, dict]) -> dict:
+    return {
+        "type": "object",
+        "properties": {str(i): {"type": ["string", "number", "boolean", "null"]} for i in table},
+    }
+
+def _parse_answer(raw_response: str):
+    """The JSON object in a model answer, tolerating code fences and stray text around it; None if there is none."""
+    text = raw_response.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```\w*\s*|\s*```$", "", text)
+    try:
+        return json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            return None
         try:
-            cleaned_response = raw_response.strip()
-            if cleaned_response.startswith("'") and cleaned_response.endswith("'"):
-                cleaned_response = cleaned_response[1:-1]
-            if cleaned_response.startswith('"') and cleaned_response.endswith('"'):
-                cleaned_response = cleaned_response[1:-1]
-            
-            # Parse the JSON
-            batch_result = json.loads(cleaned_response)
-            
-            # Combine results
-            if "form_fields" in batch_result:
-                combined_form_fields.update(batch_result["form_fields"])
-            if "semantic_fields" in batch_result:
-                combined_semantic_fields.update(batch_result["semantic_fields"])
-                
-            
-        except Exception as e:
-            continue  
+            return json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+
+def _as_text(value) -> str:
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _check_answer(answer, table: dict[int, dict]) -> tuple[dict[int, str], set[int]]:
+    """
+    Values of a parsed answer that pass the batch schema, and the IDs to ask
+    again: every ID when the answer is not an object, otherwise those whose
+    value has the wrong type. Unknown IDs are dropped; omitted ones mean "no data".
+    """
+    if not isinstance(answer, dict):
+        return {}, set(table)
+    ids = {str(i): i for i in table}
+    answer = {k.strip(): v for k, v in answer.items() if k.strip() in ids}
+    failed = {ids[e.path[0]] for e in jsonschema.Draft202012Validator(_answer_schema(table)).iter_errors(answer) if e.path}
+    values = {ids[k]: _as_text(v) for k, v in answer.items()
+              if ids[k] not in failed and v is not None and str(v).strip() != ""}
+    return values, failed
+
+def _run_fill_batch(batch: tuple[dict[int, dict], str, str, str]) -> tuple[dict[int, str], list[int]]:
+    """
+    Send one batch prompt and return ({field ID: value}, IDs left unresolved).
+    IDs whose answer does not validate are asked again on their own, up to
+    FILL_REPAIR_ATTEMPTS times, instead of dropping the batch. A model call
+    that fails outright (LLMError, after llm_client's retries) leaves the IDs
+    it was asked for unresolved rather than failing the whole form.
+    """
+    table, context, form_name, prompt = batch
+    values, failed = {}, set(table)
+    with span("fill_batch", fields=len(table)) as s:
+        repairs = 0
+        try:
+            values, failed = _check_answer(_parse_answer(run_openai(prompt)), table)
+            while failed and repairs < FILL_REPAIR_ATTEMPTS:
+                repairs += 1
+                subset = {i: table[i] for i in sorted(failed)}
+                repaired, failed = _check_answer(_parse_answer(run_openai(_repair_prompt(subset, context, form_name))), subset)
+                values.update(repaired)
+        except LLMError as e:
+            s.set(llm_error=type(e).__name__)
+        s.set(repairs=repairs, unresolved=len(failed))
+    return values, sorted(failed)
+
+def _batch_user_data(batches: list[list[dict]], user_data: str, use_retrieval: bool) -> list[str]:
+    """
+    User data to embed in each batch prompt. Small inputs are sent whole; large
+    ones are indexed once and each batch only gets the passages matching its labels.
+    """
+    if not use_retrieval or count_tokens(user_data, OPENAI_MODEL) <= RETRIEVAL_MIN_TOKENS:
+        return [user_data] * len(batches)
+    index = PassageIndex(user_data)
+    return [
+        index.context(" ".join(f.get("label", "") for f in batch), RETRIEVAL_CONTEXT_TOKENS)
+        for batch in batches
+    ]
+
+def _fill_batches(pdf_fields: list[dict], user_data: str, form_name: str,
+                  use_retrieval: bool) -> list[tuple[dict[int, dict], str, str, str]]:
+    """
+    Fields in batches of FILL_BATCH_SIZE as (ID table, user data context, form
+    name, prompt). IDs number the fields 1..n across all batches, so answers
+    map straight back to field names without the model ever repeating them.
+    """
+    batch_size = FILL_BATCH_SIZE
+    tables = [dict(enumerate(pdf_fields[i:i + batch_size], i + 1)) for i in range(0, len(pdf_fields), batch_size)]
+    contexts = _batch_user_data([list(t.values()) for t in tables], user_data, use_retrieval)
+    return [
+        (table, context, form_name, _fill_batch_prompt(table, context, form_name, n + 1, len(tables)))
+        for n, (table, context) in enumerate(zip(tables, contexts))
+    ]
+
+def build_fill_prompts(pdf_fields: list[dict], user_data: str, form_name: str, use_retrieval: bool = True) -> list[str]:
+    """All batch prompts fill_pdf_form would send, in batch order."""
+    return [batch[-1] for batch in _fill_batches(pdf_fields, user_data, form_name, use_retrieval)]
+
+def _fill_plan(pdf_fields: list[dict], user_data: str, form_name: str, use_retrieval: bool,
+               form_code: str | None, field_names, use_records: bool, lines: dict | None = None) -> tuple[dict, list[tuple]]:
+    """Rule- and memo-resolved values and the batches left for the model (see _fill_batches)."""
+    resolved = {"form_fields": {}, "semantic_fields": {}, "filled_by": {}}
+    if form_code:
+        # Hand-written rules beat learned mappings where both cover a field.
+        for origin, known in (("memo", apply_memo(form_code, user_data, field_names)),
+                              ("rules", apply_rules(form_code, user_data, field_names, lines))):
+            resolved["form_fields"].update(known["form_fields"])
+            resolved["semantic_fields"].update(known["semantic_fields"])
+            resolved["filled_by"].update(dict.fromkeys(known["form_fields"], origin))
+    pending = [f for f in pdf_fields if f.get("field_name") not in resolved["form_fields"]]
+    prompt_data = compact_user_data(user_data) if use_records else user_data
+    return resolved, _fill_batches(pending, prompt_data, form_name, use_retrieval)
+
+def estimate_fill_tokens(pdf_fields: list[dict], user_data: str, form_name: str, use_retrieval: bool = True,
+                         form_code: str | None = None, field_names=None, use_records: bool = True,
+                         lines: dict | None = None) -> int:
+    """
+    Tokens fill_pdf_form would spend with the same arguments: prompt plus
+    expected completion for every batch the LLM cache cannot answer.
+    """
+    _, batches = _fill_plan(pdf_fields, user_data, form_name, use_retrieval, form_code, field_names, use_records, lines)
+    cache = get_cache() if cache_enabled() else None
+    total = 0
+    for *_, prompt in batches:
+        if cache is not None and cache.get(cache_key(OPENAI_MODEL, OPENAI_TEMPERATURE, SYSTEM_PROMPT, prompt)) is not None:
+            continue
+        total += count_tokens(SYSTEM_PROMPT + prompt, OPENAI_MODEL) + EXPECTED_COMPLETION_TOKENS
+    return total
+
+def fill_pdf_form(pdf_fields: list[dict], user_data: str, form_name: str, max_concurrency: int | None = None,
+                  use_retrieval: bool = True, form_code: str | None = None, field_names=None,
+                  use_records: bool = True, lines: dict | None = None) -> dict:
+    """
+    Fill PDF form with user data using AI analysis.
+    When ``form_code`` has a rule table (see form_rules.py) or learned
+    mappings for its stored revision (see field_memo.py), the fields they
+    resolve are filled deterministically and only the rest go to the model;
+    ``field_names`` (every field in the PDF) guards against renamed fields,
+    and ``lines`` (the PDF's line index) places rule values by printed line.
+    With ``use_records``, documents that parse into W-2/1099 records (see
+    file_parser.py) reach the model as one compact JSON block instead of raw text.
+    Processes fields in batches of 50 to avoid token limits. Batches are sent
+    concurrently (at most ``max_concurrency`` at a time, default
+    ``LLM_MAX_CONCURRENCY``) and merged in batch order, so the result does not
+    depend on which request finishes first. Large user data is cut down per
+    batch to the passages relevant to that batch's labels (see retrieval.py).
+    The model sees short field IDs and answers {ID: value}, checked against a
+    JSON schema (see _run_fill_batch); ``semantic_fields`` are keyed by the
+    fields' labels here rather than generated by the model. Fields the model
+    never answered validly, even after repair prompts, come back in
+    ``unresolved`` as {field name: label} for the reviewer to fill by hand,
+    and ``filled_by`` says whether each value came from the "rules", the
+    "memo" or the "model".
+    """
+    combined_form_fields = {}
+    combined_semantic_fields = {}
+    filled_by = {}
+    unresolved = {}
+
+    resolved, batches = _fill_plan(pdf_fields, user_data, form_name, use_retrieval, form_code, field_names, use_records,
+                                   lines)
+    for (table, *_), (values, failed) in zip(batches, _map_concurrently(_run_fill_batch, batches, max_concurrency)):
+        for field_id in failed:
+            field = table[field_id]
+            unresolved[field["field_name"]] = " ".join((field.get("label") or "").split()) or field["field_name"]
+        for field_id, value in values.items():
+            field = table[field_id]
+            combined_form_fields[field["field_name"]] = value
+            filled_by[field["field_name"]] = "model"
+            label = " ".join((field.get("label") or "").split()) or field["field_name"]
+            name, n = label, 2
+            while name in combined_semantic_fields:
+                name, n = f"{label} ({n})", n + 1
+            combined_semantic_fields[name] = value
+
+    # Rule values are exact; never let a model guess overwrite them.
+    combined_form_fields.update(resolved["form_fields"])
+    combined_semantic_fields.update(resolved["semantic_fields"])
+    filled_by.update(resolved["filled_by"])
     return {
         "form_fields": combined_form_fields,
-        "semantic_fields": combined_semantic_fields
+        "semantic_fields": combined_semantic_fields,
+        "filled_by": filled_by,
+        "unresolved": unresolved,
     }
-
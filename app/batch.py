@@ -0,0 +1,199 @@
+"""
+Headless batch processing of client tax packets.
+
+    python app/batch.py CLIENTS_DIR OUT_DIR [--workers 4] [--llm-rpm 120] [--llm-tpm 40000]
+
+Every sub-directory of CLIENTS_DIR is one client. Each client goes through the
+same pipeline as the Streamlit app: extraction, deductions, form
+recommendations, then field mapping and filling for every recommended form.
+Filled PDFs, data CSVs and one merged complete_return.pdf go to OUT_DIR/<client>/. Progress is checkpointed
+per client, so an interrupted run picks up where it stopped. Point
+OPENAI_BASE_URL at a local server to run against a fake model.
+"""
+import argparse
+import csv
+import io
+import json
+import mimetypes
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ai_engine import recommend_forms, suggest_deductions
+from capital_gains import CAPITAL_GAINS_FORMS, summarize_uploads
+from chunking import join_documents
+from irs_forms import download_form_bytes
+from jobs import map_form
+from llm_client import set_rate_limits
+from ocr_utils import extract_texts
+from pdf_filler import fill_pdf_file, fill_return
+from telemetry import get_recorder, labels
+
+UPLOAD_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".csv")
+CHECKPOINT_FILE = "checkpoint.json"
+RETURN_FILE = "complete_return.pdf"
+
+
+class LocalFile:
+    """Minimal stand-in for Streamlit's UploadedFile, backed by a file on disk."""
+
+    def __init__(self, path: str):
+        self.name = os.path.basename(path)
+        self.type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        with open(path, "rb") as f:
+            self._data = f.read()
+
+    def getvalue(self) -> bytes:
+        return self._data
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.\-]+", "_", name).strip("_") or "form"
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _load_checkpoint(client_out: str) -> dict:
+    try:
+        with open(os.path.join(client_out, CHECKPOINT_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_checkpoint(client_out: str, checkpoint: dict) -> None:
+    _write_atomic(os.path.join(client_out, CHECKPOINT_FILE),
+                  json.dumps(checkpoint, indent=2).encode("utf-8"))
+
+
+def client_documents(client_dir: str) -> list[LocalFile]:
+    names = sorted(n for n in os.listdir(client_dir) if n.lower().endswith(UPLOAD_EXTENSIONS))
+    return [LocalFile(os.path.join(client_dir, n)) for n in names]
+
+
+def fill_form(form: dict, user_data: str, client_out: str, trades: dict | None = None) -> dict:
+    """Download, map and fill one recommended form; returns the output file paths."""
+    pdf_bytes, mapping = map_form(form["code"], form["form"], user_data, trades)
+    if not pdf_bytes:
+        return {"status": "unavailable"}
+
+    base = os.path.join(client_out, _safe_name(form["form"]))
+    fill_pdf_file(pdf_bytes, mapping["form_fields"], f"{base}_filled.pdf")
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["Field", "Value"])
+    writer.writerows(mapping.get("semantic_fields", {}).items())
+    _write_atomic(f"{base}_extracted_data.csv", buf.getvalue().encode("utf-8"))
+    return {"status": "done", "pdf": f"{base}_filled.pdf", "csv": f"{base}_extracted_data.csv",
+            "fields": mapping["form_fields"], "unresolved": mapping["unresolved"], "warnings": mapping["warnings"]}
+
+
+def process_client(client_dir: str, out_dir: str) -> dict:
+    """Run the full pipeline for one client folder, resuming from its checkpoint."""
+    client = os.path.basename(os.path.normpath(client_dir))
+    client_out = os.path.join(out_dir, client)
+    os.makedirs(client_out, exist_ok=True)
+    checkpoint = _load_checkpoint(client_out)
+
+    if "extracted_text" not in checkpoint:
+        checkpoint["extracted_text"] = join_documents(extract_texts(client_documents(client_dir)))
+        _save_checkpoint(client_out, checkpoint)
+    user_data = checkpoint["extracted_text"]
+
+    if "deductions" not in checkpoint:
+        raw = suggest_deductions(user_data)
+        checkpoint["deductions"] = [line.strip() for line in raw.split("\n") if line.strip()]
+        _save_checkpoint(client_out, checkpoint)
+
+    if "forms" not in checkpoint:
+        checkpoint["forms"] = recommend_forms(checkpoint["deductions"]) if checkpoint["deductions"] else []
+        _save_checkpoint(client_out, checkpoint)
+
+    filled = checkpoint.setdefault("filled", {})
+    trades = None
+    for form in checkpoint["forms"]:
+        if filled.get(form["code"], {}).get("status") == "done":
+            continue
+        if trades is None and form["code"] in CAPITAL_GAINS_FORMS:
+            trades = summarize_uploads(client_documents(client_dir)) or {}
+        with labels(form=form["code"]):
+            filled[form["code"]] = fill_form(form, user_data, client_out, trades)
+        _save_checkpoint(client_out, checkpoint)
+
+    done = [f["code"] for f in checkpoint["forms"] if filled.get(f["code"], {}).get("status") == "done"]
+    if done:
+        forms = [(download_form_bytes(code), filled[code].get("fields", {})) for code in done]
+        _write_atomic(os.path.join(client_out, RETURN_FILE), fill_return([f for f in forms if f[0]]))
+
+    return {"client": client, "forms": len(checkpoint["forms"]), "filled": len(done)}
+
+
+def _process_labelled(client_dir: str, out_dir: str) -> dict:
+    with labels(client=os.path.basename(os.path.normpath(client_dir))):
+        return process_client(client_dir, out_dir)
+
+
+def run_batch(clients_dir: str, out_dir: str, workers: int = 4,
+              llm_rpm: float | None = None, llm_tpm: float | None = None) -> dict:
+    """Process every client folder concurrently; returns per-client results and throughput."""
+    client_dirs = sorted(
+        os.path.join(clients_dir, n) for n in os.listdir(clients_dir)
+        if os.path.isdir(os.path.join(clients_dir, n))
+    )
+    os.makedirs(out_dir, exist_ok=True)
+    set_rate_limits(llm_rpm, llm_tpm)
+
+    results, failures = [], []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(_process_labelled, d, out_dir): d for d in client_dirs}
+        for future, client_dir in futures.items():
+            try:
+                results.append(future.result())
+            except Exception as e:
+                failures.append({"client": os.path.basename(client_dir), "error": str(e)})
+    elapsed = time.perf_counter() - start
+
+    return {
+        "clients": results,
+        "failures": failures,
+        "elapsed_seconds": elapsed,
+        "clients_per_hour": len(results) / elapsed * 3600 if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process a directory of client tax packets without the UI.")
+    parser.add_argument("clients_dir", help="directory with one sub-directory of documents per client")
+    parser.add_argument("out_dir", help="where filled forms, CSVs and checkpoints are written")
+    parser.add_argument("--workers", type=int, default=4, help="clients processed concurrently")
+    parser.add_argument("--llm-rpm", type=float, default=None, help="max model requests per minute")
+    parser.add_argument("--llm-tpm", type=float, default=None, help="max model tokens per minute")
+    parser.add_argument("--metrics", default=None, help="write per-stage metrics here (Prometheus text format)")
+    args = parser.parse_args(argv)
+
+    summary = run_batch(args.clients_dir, args.out_dir, args.workers, args.llm_rpm, args.llm_tpm)
+    for r in summary["clients"]:
+        print(f"✔ {r['client']}: {r['filled']}/{r['forms']} forms filled")
+    for f in summary["failures"]:
+        print(f"❌ {f['client']}: {f['error']}")
+    print(f"{len(summary['clients'])} clients in {summary['elapsed_seconds']:.1f}s "
+          f"({summary['clients_per_hour']:.1f} clients/hour)")
+    recorder = get_recorder()
+    for row in recorder.aggregate(("stage",)):
+        print(f"  {row['stage']:<12} {row['count']:>6} calls  p50 {row['p50_s']:7.3f}s  p95 {row['p95_s']:7.3f}s  "
+              f"{row['prompt_tokens'] + row['completion_tokens']:>9} tokens  ${row['cost']:.4f}")
+    if args.metrics:
+        _write_atomic(os.path.abspath(args.metrics), recorder.to_prometheus().encode("utf-8"))
+    return 1 if summary["failures"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
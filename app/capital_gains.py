@@ -0,0 +1,396 @@
+"""
+Vectorized ingestion of brokerage (1099-B) and crypto-exchange CSV exports.
+
+CSVs are read in chunks with pandas; every lot's gain or loss, holding period
+and wash-sale adjustment is computed on NumPy arrays, and the result is rolled
+up into Form 8949 box totals and Schedule D lines. Column names are matched
+with the same aliases as file_parser.parse_csv.
+"""
+from __future__ import annotations
+
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from extraction_cache import content_hash
+from file_parser import DATE_FORMATS, CryptoTrade, csv_columns, csv_record_type, is_csv_upload
+from resources import lazy_module
+
+np = lazy_module("numpy")
+pd = lazy_module("pandas")
+
+CSV_CHUNK_ROWS = int(os.getenv("WISECPA_CSV_CHUNK_ROWS", "250000"))
+WASH_SALE_DAYS = 30
+# Forms filled from the trade summary rather than by the model.
+CAPITAL_GAINS_FORMS = ("f1040sd", "f8949")
+
+# Form 8949 checkbox per (source, term). Brokerage lots are assumed to have
+# basis reported to the IRS; exchange exports are not on a 1099-B.
+BOX_FOR = {("brokerage", "short"): "A", ("brokerage", "long"): "D",
+           ("crypto", "short"): "C", ("crypto", "long"): "F"}
+# Schedule D line fed by each Form 8949 box.
+SCHEDULE_D_LINE = {"A": "1b", "B": "2", "C": "3", "D": "8b", "E": "9", "F": "10"}
+
+_QUANTITY_PREFIX = re.compile(r"^\s*[\d.,]+\s+(?:sh(?:are)?s?\.?\s+(?:of\s+)?)?", re.IGNORECASE)
+
+
+def _to_amounts(col: pd.Series) -> np.ndarray:
+    """Parse money columns; only values plain to_numeric rejects ('$1,200.00', '(5.00)') go through the regexes."""
+    values = pd.to_numeric(col, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    retry = np.isnan(values) & col.notna().to_numpy()
+    if retry.any():
+        s = col[retry].astype("string").str.replace(r"[$,\s]", "", regex=True)
+        s = s.str.replace(r"^\((.*)\)$", r"-\1", regex=True)
+        values[retry] = pd.to_numeric(s, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    return values
+
+
+def _date_format(values) -> str | None:
+    """First known format that parses a sample of the values, so pandas never falls back to per-row guessing."""
+    sample = pd.Series(values).dropna().head(20)
+    for fmt in DATE_FORMATS:
+        if pd.to_datetime(sample, format=fmt, errors="coerce").notna().any():
+            return fmt
+    return None
+
+
+def _to_days(col: pd.Series) -> np.ndarray:
+    """
+    Dates as int64 days since the epoch; unparseable values (e.g. 'VARIOUS')
+    become -1. Exports repeat the same few thousand dates, so only the
+    distinct strings are parsed.
+    """
+    codes, uniques = pd.factorize(col)
+    fmt = _date_format(uniques)
+    if fmt is None:
+        return np.full(len(col), -1, dtype=np.int64)
+    dates = pd.to_datetime(pd.Series(uniques), format=fmt, errors="coerce")
+    days = np.append(dates.to_numpy(dtype="datetime64[D]").astype(np.int64), -1)
+    days[:-1][dates.isna().to_numpy()] = -1
+    return days[codes]
+
+
+def _long_term(acquired: np.ndarray, sold: np.ndarray) -> np.ndarray:
+    """Held more than one year: sold after the anniversary of the acquisition date."""
+    acq = acquired.astype("datetime64[D]")
+    months = acq.astype("datetime64[M]")
+    anniversary = (months + 12).astype("datetime64[D]") + (acq - months.astype("datetime64[D]"))
+    return sold > anniversary.astype(np.int64)
+
+
+class _Lots:
+    """Column arrays accumulated chunk by chunk."""
+
+    def __init__(self):
+        self.parts = {name: [] for name in ("security", "acquired", "sold", "proceeds", "cost",
+                                            "adjustment", "term", "crypto", "reported_wash")}
+        self.securities: dict[str, int] = {}
+        self.skipped = 0
+
+    def _security_ids(self, values: pd.Series, strip_quantity: bool) -> np.ndarray:
+        """Stable integer id per security across chunks; missing names get -1."""
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        names = pd.Series(uniques, dtype="string")
+        if strip_quantity:
+            # "10 sh AAPL" and "5 AAPL" are the same security for wash-sale matching.
+            names = names.str.replace(_QUANTITY_PREFIX, "", regex=True).str.strip().str.upper()
+        mapping = np.array([self.securities.setdefault(u, len(self.securities)) for u in names] + [-1],
+                           dtype=np.int64)
+        return mapping[codes]
+
+    def add_chunk(self, chunk: pd.DataFrame, columns: dict[str, int], crypto: bool) -> None:
+        col = {attr: chunk.iloc[:, i] for attr, i in columns.items()}
+        n = len(chunk)
+        proceeds = _to_amounts(col["proceeds"])
+        cost = _to_amounts(col["cost_basis"])
+        if "fee" in col:
+            proceeds = proceeds - np.nan_to_num(np.abs(_to_amounts(col["fee"])))
+        wash = np.nan_to_num(_to_amounts(col["wash_sale_loss_disallowed"])) if "wash_sale_loss_disallowed" in col \
+            else np.zeros(n)
+        acquired = _to_days(col["date_acquired"]) if "date_acquired" in col else np.full(n, -1, np.int64)
+        sold = _to_days(col["date_sold"]) if "date_sold" in col else np.full(n, -1, np.int64)
+
+        # 0 short, 1 long, -1 unknown; an explicit term column wins over dates.
+        term = np.where((acquired >= 0) & (sold >= 0), _long_term(np.maximum(acquired, 0), sold), -1)
+        if "term" in col:
+            first = col["term"].astype("string").str.strip().str[0].str.lower().to_numpy(dtype=object, na_value="")
+            term = np.where(first == "s", 0, np.where(first == "l", 1, term))
+
+        use_asset = "asset" in col
+        security = self._security_ids(col["asset"] if use_asset else col["description"],
+                                      strip_quantity=not use_asset and not crypto)
+
+        valid = ~(np.isnan(proceeds) | np.isnan(cost))
+        self.skipped += int(n - valid.sum())
+        parts = self.parts
+        parts["security"].append(security[valid])
+        parts["acquired"].append(acquired[valid])
+        parts["sold"].append(sold[valid])
+        parts["proceeds"].append(proceeds[valid])
+        parts["cost"].append(cost[valid])
+        parts["adjustment"].append(wash[valid])
+        parts["term"].append(term[valid].astype(np.int8))
+        parts["crypto"].append(np.full(int(valid.sum()), crypto))
+        parts["reported_wash"].append(np.full(int(valid.sum()), "wash_sale_loss_disallowed" in col))
+
+    def mark(self) -> tuple:
+        return {name: len(chunks) for name, chunks in self.parts.items()}, self.skipped
+
+    def rollback(self, mark: tuple) -> None:
+        """Drop every chunk added since mark(), e.g. for a file that turned out to be unreadable."""
+        lengths, self.skipped = mark
+        for name, chunks in self.parts.items():
+            del chunks[lengths[name]:]
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {name: (np.concatenate(chunks) if chunks else np.empty(0))
+                for name, chunks in self.parts.items()}
+
+
+def _read_chunks(source, chunksize: int):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return pd.read_csv(source, dtype=str, chunksize=chunksize, skipinitialspace=True,
+                       encoding="utf-8-sig", on_bad_lines="skip")
+
+
+def _csv_errors() -> tuple:
+    """What pandas raises for files it cannot read at all: empty, unbalanced quotes, not UTF-8."""
+    return pd.errors.EmptyDataError, pd.errors.ParserError, UnicodeDecodeError
+
+
+def detect_wash_sales(security: np.ndarray, acquired: np.ndarray, sold: np.ndarray,
+                      gain: np.ndarray) -> np.ndarray:
+    """
+    Flag losses where another lot of the same security was acquired within 30
+    days before or after the sale and is not itself disposed of within that
+    window (it is still held, or sold after the window ends). Lots bought
+    together and all sold inside the window are therefore not replacements
+    for each other.
+
+    Vectorized with sorted (security, day) key arrays and searchsorted: lots
+    acquired in the window, minus those also sold in it. A lot both acquired
+    and sold in the window is held at most 60 days, and every such "short"
+    lot acquired before the window was sold before its end, so the second
+    count is (short lots sold by the window's end) - (short lots acquired
+    before its start). The loss lot itself cancels out the same way. Share
+    counts are not matched, so a flagged loss is disallowed in full.
+    """
+    key_scale = np.int64(1 << 20)  # days since 1970 stay far below 2**20
+    window = WASH_SALE_DAYS
+    has_date = acquired >= 0
+    keys = np.sort(security[has_date] * key_scale + acquired[has_date])
+    short = has_date & (sold >= acquired) & (sold - acquired <= 2 * window)
+    short_sold = np.sort(security[short] * key_scale + sold[short])
+    short_acquired = np.sort(security[short] * key_scale + acquired[short])
+
+    losses = (gain < 0) & (sold >= 0) & (security >= 0)
+    base = security[losses] * key_scale
+    start, end = base + sold[losses] - window, base + sold[losses] + window
+    acquired_in_window = np.searchsorted(keys, end, side="right") - np.searchsorted(keys, start, side="left")
+    sold_by_end = np.searchsorted(short_sold, end, side="right") - np.searchsorted(short_sold, base, side="left")
+    acquired_before = np.searchsorted(short_acquired, start, side="left") - np.searchsorted(short_acquired, base, side="left")
+    flagged = np.zeros(len(gain), dtype=bool)
+    flagged[losses] = acquired_in_window - (sold_by_end - acquired_before) > 0
+    return flagged
+
+
+def _totals(mask, proceeds, cost, adjustment) -> dict:
+    return {
+        "lots": int(mask.sum()),
+        "proceeds": round(float(proceeds[mask].sum()), 2),
+        "cost": round(float(cost[mask].sum()), 2),
+        "adjustment": round(float(adjustment[mask].sum()), 2),
+        "gain": round(float((proceeds[mask] - cost[mask] + adjustment[mask]).sum()), 2),
+    }
+
+
+def summarize_trades(sources, chunksize: int | None = None, detect_wash: bool = True) -> dict:
+    """
+    Read brokerage/crypto CSVs (paths, file objects or bytes) chunk by chunk and
+    return Form 8949 box totals and Schedule D line aggregates:
+
+        {"lots", "skipped_rows", "unreadable_files", "wash_sales", "unknown_term",
+         "form_8949": {"A": {"lots", "proceeds", "cost", "adjustment", "gain"}, ...},
+         "schedule_d": {"1b": {...}, "3": {...}, "7": gain, "15": gain, "16": gain}}
+
+    Lots with an unknown holding period are reported as short term. Wash sales
+    are detected only for brokerage exports without a broker-reported
+    disallowed-loss column; digital assets are not subject to the rule.
+    A file pandas cannot read (empty, unbalanced quotes, not UTF-8) is left
+    out entirely and counted in "unreadable_files".
+    """
+    lots = _Lots()
+    unreadable = 0
+    for source in sources:
+        columns = None
+        mark = lots.mark()
+        try:
+            for chunk in _read_chunks(source, chunksize or CSV_CHUNK_ROWS):
+                if columns is None:
+                    columns = csv_columns(list(chunk.columns))
+                    record_type = csv_record_type(columns)
+                    if record_type is None:
+                        break
+                lots.add_chunk(chunk, columns, record_type is CryptoTrade)
+        except _csv_errors():
+            lots.rollback(mark)
+            unreadable += 1
+
+    a = lots.arrays()
+    proceeds, cost, adjustment = a["proceeds"], a["cost"], a["adjustment"]
+    gain = proceeds - cost + adjustment
+    wash_sales = 0
+    if detect_wash and len(gain):
+        candidates = ~a["crypto"].astype(bool) & ~a["reported_wash"].astype(bool)
+        flagged = detect_wash_sales(a["security"], a["acquired"], a["sold"], gain) & candidates
+        adjustment = adjustment.copy()
+        adjustment[flagged] = -gain[flagged]
+        wash_sales = int(flagged.sum())
+
+    crypto = a["crypto"].astype(bool)
+    long_term = a["term"] == 1
+    form_8949, schedule_d = {}, {}
+    for (kind, term), box in BOX_FOR.items():
+        mask = (crypto if kind == "crypto" else ~crypto) & (long_term if term == "long" else ~long_term)
+        if mask.any():
+            form_8949[box] = _totals(mask, proceeds, cost, adjustment)
+            schedule_d[SCHEDULE_D_LINE[box]] = form_8949[box]
+    short_gain = sum(form_8949[b]["gain"] for b in "ABC" if b in form_8949)
+    long_gain = sum(form_8949[b]["gain"] for b in "DEF" if b in form_8949)
+    schedule_d.update({"7": round(short_gain, 2), "15": round(long_gain, 2), "16": round(short_gain + long_gain, 2)})
+
+    return {
+        "lots": int(len(gain)),
+        "skipped_rows": lots.skipped,
+        "unreadable_files": unreadable,
+        "wash_sales": wash_sales,
+        "unknown_term": int((a["term"] == -1).sum()),
+        "form_8949": form_8949,
+        "schedule_d": schedule_d,
+    }
+
+
+SUMMARY_MEMO_ENTRIES = 8
+_summary_memo: "OrderedDict[tuple, dict]" = OrderedDict()
+_summary_lock = threading.Lock()
+
+
+def summarize_uploads(uploaded_files) -> dict | None:
+    """summarize_trades over the trade CSVs among the uploads, memoized on their content hashes."""
+    blobs = [f.getvalue() for f in uploaded_files if is_csv_upload(f)]
+    blobs = [b for b in blobs if is_trade_csv(b)]
+    if not blobs:
+        return None
+    key = tuple(content_hash(b) for b in blobs)
+    with _summary_lock:
+        summary = _summary_memo.get(key)
+    if summary is None:
+        summary = summarize_trades(blobs)
+        with _summary_lock:
+            _summary_memo[key] = summary
+            while len(_summary_memo) > SUMMARY_MEMO_ENTRIES:
+                _summary_memo.popitem(last=False)
+    return summary
+
+
+def is_trade_csv(data: bytes) -> bool:
+    """True when the CSV header looks like a brokerage or crypto export; False for files pandas cannot read."""
+    try:
+        header = next(_read_chunks(data, 1), None)
+    except _csv_errors():
+        return False
+    return header is not None and csv_record_type(csv_columns(list(header.columns))) is not None
+
+
+def format_amount(value: float) -> str:
+    """IRS style: 1,234.00 and (1,234.00) for losses."""
+    return f"({abs(value):,.2f})" if value < 0 else f"{value:,.2f}"
+
+
+def summary_text(summary: dict) -> str:
+    """Short plain-text digest of a summary, used as the extracted text of a trades CSV."""
+    out = [f"Capital gains and losses from {summary['lots']} sale lots (Form 8949 / Schedule D)"]
+    for box, t in summary["form_8949"].items():
+        out.append(f"Form 8949 box {box}: {t['lots']} lots, proceeds {format_amount(t['proceeds'])}, "
+                   f"cost basis {format_amount(t['cost'])}, adjustments {format_amount(t['adjustment'])}, "
+                   f"gain or loss {format_amount(t['gain'])}")
+    sd = summary["schedule_d"]
+    out.append(f"Net short-term capital gain or loss {format_amount(sd['7'])}")
+    out.append(f"Net long-term capital gain or loss {format_amount(sd['15'])}")
+    if summary["wash_sales"]:
+        out.append(f"Wash sales: {summary['wash_sales']} losses disallowed")
+    if summary["unreadable_files"]:
+        out.append(f"{summary['unreadable_files']} trade CSV file(s) could not be read and are not included")
+    return "\n".join(out)
+
+
+def capital_gains_semantic(summary: dict) -> dict[str, str]:
+    """Human-readable Schedule D lines for the Step 4 summary table and CSV export."""
+    fields = {}
+    for line, t in summary["schedule_d"].items():
+        if isinstance(t, dict):
+            for col, key in (("d", "proceeds"), ("e", "cost"), ("g", "adjustment"), ("h", "gain")):
+                fields[f"Schedule D line {line} ({col}) {key}"] = format_amount(t[key])
+        else:
+            fields[f"Schedule D line {line}"] = format_amount(t)
+    return fields
+
+
+# Form 8949 page and boxes of each part; every box needs a page of its own.
+FORM_8949_PARTS = ((0, "ABC"), (1, "DEF"))
+
+
+def form_8949_warnings(summary: dict) -> list[str]:
+    """Parts of Form 8949 the trades need more than one page of, which capital_gains_fields leaves alone."""
+    warnings = []
+    for part, (_, boxes) in zip(("I", "II"), FORM_8949_PARTS):
+        present = [b for b in boxes if b in summary["form_8949"]]
+        if len(present) > 1:
+            warnings.append(f"Form 8949 Part {part} needs a separate page for each of boxes {', '.join(present)}, "
+                            "so it is not filled from the trades; use the per-box totals in the summary.")
+    return warnings
+
+
+def capital_gains_fields(form_code: str, summary: dict, lines: dict, widgets=()) -> dict[str, str]:
+    """
+    Field values for Schedule D (f1040sd) or the Form 8949 totals rows (f8949),
+    ready for fill_pdf_form_simple. ``lines`` and ``widgets`` come from the
+    field index (pdf_filler.load_field_index). Rows whose widget count doesn't
+    match the expected columns are skipped rather than guessed. A Form 8949
+    page holds one box, so a part is filled, and its box checked, only when
+    the trades fall in a single box of it (see form_8949_warnings).
+    """
+    columns = ("proceeds", "cost", "adjustment", "gain")
+    values = {}
+
+    def row(line, page=None):
+        return next((names for p, names in lines.get(line, []) if page is None or p == page), [])
+
+    def put_row(line, totals, page=None):
+        names = row(line, page)
+        if len(names) == len(columns):
+            values.update({n: format_amount(totals[c]) for n, c in zip(names, columns)})
+
+    if form_code == "f1040sd":
+        for line, t in summary["schedule_d"].items():
+            if isinstance(t, dict):
+                put_row(line, t)
+            elif row(line):
+                values[row(line)[-1]] = format_amount(t)
+    elif form_code == "f8949":
+        for page, boxes in FORM_8949_PARTS:
+            present = [b for b in boxes if b in summary["form_8949"]]
+            if len(present) != 1:
+                continue
+            box = present[0]
+            put_row("2", summary["form_8949"][box], page)
+            # The box checkboxes are the first ones on the page, top to bottom (A, B, C then the later boxes).
+            checkboxes = sorted((w for w in widgets if w["page"] == page and w["widget_type"] == "checkbox"),
+                                key=lambda w: (round(w["rect"][1]), w["rect"][0]))
+            if len(checkboxes) >= len(boxes):
+                checkbox = checkboxes[boxes.index(box)]
+                values[checkbox["field_name"]] = checkbox.get("on_state") or "Yes"
+    return values
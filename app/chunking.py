@@ -0,0 +1,119 @@
+import os
+
+from resources import lazy_module, resource
+
+tiktoken = lazy_module("tiktoken")
+
+# Separators written by ocr_utils: pages inside a document, and documents in an upload set.
+PAGE_BREAK = "\f"
+DOCUMENT_BREAK = "\f\f"
+
+DEFAULT_CHUNK_TOKENS = int(os.getenv("WISECPA_CHUNK_TOKENS", "3000"))
+
+
+class _ApproxEncoding:
+    """~4 characters per token; used only when the tiktoken BPE files cannot be loaded (offline)."""
+
+    def encode(self, text: str) -> list[str]:
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def decode(self, tokens: list[str]) -> str:
+        return "".join(tokens)
+
+
+@resource(warm=("gpt-4",))
+def get_encoding(model: str = "gpt-4"):
+    """tiktoken encodings are expensive to build; keep one per model."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return _ApproxEncoding()
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    return len(get_encoding(model).encode(text))
+
+
+def join_documents(texts: list[str]) -> str:
+    """Combine per-document extraction results, keeping document boundaries visible to the chunker."""
+    return DOCUMENT_BREAK.join(t for t in texts if t.strip())
+
+
+def split_sections(document: str, markers) -> list[str]:
+    """
+    Cut one document into runs of pages that belong to the same form. A page
+    matching a different set of ``markers`` (compiled regexes, e.g. "W-2" and
+    "1099-INT") than the previous one starts a new section; pages matching
+    none continue the current section. Copies of one form on consecutive
+    pages stay together.
+    """
+    sections, current, current_key = [], [], None
+    for page in document.split(PAGE_BREAK):
+        if not page.strip():
+            continue
+        key = frozenset(i for i, marker in enumerate(markers) if marker.search(page))
+        if key and key != current_key:
+            if current:
+                sections.append(PAGE_BREAK.join(current))
+            current, current_key = [], key
+        current.append(page)
+    if current:
+        sections.append(PAGE_BREAK.join(current))
+    return sections
+
+
+def _split_oversized(text: str, max_tokens: int, model: str) -> list[str]:
+    """Split a single page that exceeds the budget: on lines first, then on raw token windows."""
+    enc = get_encoding(model)
+    pieces, current, current_tokens = [], [], 0
+    for line in text.split("\n"):
+        n = len(enc.encode(line)) + 1
+        if n > max_tokens:
+            if current:
+                pieces.append("\n".join(current))
+                current, current_tokens = [], 0
+            tokens = enc.encode(line)
+            pieces.extend(enc.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens))
+            continue
+        if current_tokens + n > max_tokens and current:
+            pieces.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += n
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def chunk_text(text: str, max_tokens: int = DEFAULT_CHUNK_TOKENS, model: str = "gpt-4") -> list[str]:
+    """
+    Split extracted text into chunks of at most ``max_tokens`` tokens.
+    Chunks break on document boundaries and then page boundaries; whole pages
+    are packed greedily and only pages larger than the budget are cut further.
+    """
+    enc = get_encoding(model)
+    chunks, current, current_tokens = [], [], 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append("\n\n".join(current))
+        current, current_tokens = [], 0
+
+    for document in text.split(DOCUMENT_BREAK):
+        pages = [p.strip() for p in document.split(PAGE_BREAK) if p.strip()]
+        for page in pages:
+            n = len(enc.encode(page))
+            if n > max_tokens:
+                flush()
+                chunks.extend(_split_oversized(page, max_tokens, model))
+                continue
+            if current_tokens + n > max_tokens:
+                flush()
+            current.append(page)
+            current_tokens += n + 1
+    flush()
+    return chunks
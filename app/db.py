@@ -1,8 +1,63 @@
-# Placeholder for database functions (Postgres or SQLite)
+"""
+SQLite storage shared by the app, the batch CLI and job workers: the job
+queue, client sessions and the cross-client field memo, in one WAL-mode file
+with one pooled connection per thread.
+"""
+import json
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
-def init_db(db_path="taxwise.db"):
-    conn = sqlite3.connect(db_path)
+from settings import CACHE_DIR
+
+DB_PATH = os.getenv("WISECPA_DB_PATH", os.path.join(CACHE_DIR, "taxwise.db"))
+
+_local = threading.local()
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+def get_connection(db_path=DB_PATH):
+    """
+    This thread's pooled connection to db_path, opened once in WAL mode.
+    Streamlit sessions and worker threads each keep their own connection and
+    share the file; writers wait on the busy timeout instead of failing.
+    """
+    pool = getattr(_local, "connections", None)
+    if pool is None:
+        pool = _local.connections = {}
+    conn = pool.get(db_path)
+    if conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        pool[db_path] = conn
+    if db_path not in _schema_ready:
+        with _schema_lock:
+            if db_path not in _schema_ready:
+                _create_schema(conn)
+                _schema_ready.add(db_path)
+    return conn
+
+
+@contextmanager
+def transaction(db_path=DB_PATH):
+    """BEGIN IMMEDIATE ... COMMIT on the pooled connection; rolls back on error."""
+    conn = get_connection(db_path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _create_schema(conn):
     cursor = conn.cursor()
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS filings (
@@ -13,12 +68,300 @@ def init_db(db_path="taxwise.db"):
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     """)
-    conn.commit()
-    conn.close()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        key TEXT,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        result TEXT,
+        output BLOB,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)")
+    # Client sessions. Documents are keyed by content hash and results by a
+    # hash of their inputs, so a changed upload set only invalidates what
+    # actually depends on the change.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS clients (
+        id TEXT PRIMARY KEY,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS client_documents (
+        client_id TEXT NOT NULL REFERENCES clients (id) ON DELETE CASCADE,
+        digest TEXT NOT NULL,
+        name TEXT,
+        position INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        deductions TEXT,
+        PRIMARY KEY (client_id, digest)
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS client_results (
+        client_id TEXT NOT NULL REFERENCES clients (id) ON DELETE CASCADE,
+        kind TEXT NOT NULL,
+        item TEXT NOT NULL DEFAULT '',
+        input_hash TEXT NOT NULL,
+        result TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (client_id, kind, item)
+    )
+    """)
+    # Shared across clients: which parsed-record source (e.g. "W2.wages") feeds
+    # a field of one form revision, for clients with the same kinds of records
+    # (e.g. "INT,W2"). A field may keep several candidate sources until a
+    # client's accepted values tell them apart.
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(field_memo)")]
+    if columns and "kinds" not in columns:
+        # Learned before memos were split by record kinds; relearned from later accepts.
+        cursor.execute("DROP TABLE field_memo")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS field_memo (
+        form_code TEXT NOT NULL,
+        revision TEXT NOT NULL,
+        kinds TEXT NOT NULL,
+        field_name TEXT NOT NULL,
+        source TEXT NOT NULL,
+        label TEXT,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (form_code, revision, kinds, field_name, source)
+    )
+    """)
 
-def save_filing(user, raw_text, deductions, db_path="taxwise.db"):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO filings (user, raw_text, deductions) VALUES (?, ?, ?)", (user, raw_text, deductions))
-    conn.commit()
-    conn.close()
+
+def init_db(db_path=DB_PATH):
+    get_connection(db_path)
+
+def save_filing(user, raw_text, deductions, db_path=DB_PATH):
+    conn = get_connection(db_path)
+    conn.execute("INSERT INTO filings (user, raw_text, deductions) VALUES (?, ?, ?)", (user, raw_text, deductions))
+
+
+# === Job queue ===
+# status: queued -> running -> done | failed. "key" identifies identical work so
+# it is queued once; "output" holds a binary artifact such as a filled PDF.
+# Payloads carry client documents, so finished rows are purged (purge_jobs).
+
+_REUSABLE = "key = ? AND (status IN ('queued', 'running') OR (status = 'done' AND finished_at >= ?))"
+
+
+def enqueue_job(kind, payload, key=None, max_age=0, db_path=DB_PATH):
+    """
+    Queue a job and return its id. A queued or running job with the same key
+    is reused, and so is one finished less than ``max_age`` seconds ago.
+    """
+    with transaction(db_path) as conn:
+        if key is not None:
+            row = conn.execute(f"SELECT id FROM jobs WHERE {_REUSABLE} ORDER BY id DESC LIMIT 1",
+                               (key, time.time() - max_age)).fetchone()
+            if row:
+                return row[0]
+        cursor = conn.execute(
+            "INSERT INTO jobs (kind, key, payload, created_at) VALUES (?, ?, ?, ?)",
+            (kind, key, json.dumps(payload), time.time()),
+        )
+        return cursor.lastrowid
+
+
+def find_job(key, max_age=0, db_path=DB_PATH):
+    """Id of the newest job enqueue_job would reuse for this key, or None."""
+    row = get_connection(db_path).execute(
+        f"SELECT id FROM jobs WHERE {_REUSABLE} ORDER BY id DESC LIMIT 1", (key, time.time() - max_age)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def claim_job(worker, kinds=None, db_path=DB_PATH):
+    """Atomically move the oldest queued job to running; returns (id, kind, payload) or None."""
+    with transaction(db_path) as conn:
+        query = "SELECT id, kind, payload FROM jobs WHERE status = 'queued'"
+        params = []
+        if kinds:
+            query += f" AND kind IN ({','.join('?' * len(kinds))})"
+            params.extend(kinds)
+        row = conn.execute(query + " ORDER BY id LIMIT 1", params).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, time.time(), row[0]),
+            )
+    return (row[0], row[1], json.loads(row[2])) if row else None
+
+
+def finish_job(job_id, result=None, output=None, db_path=DB_PATH):
+    get_connection(db_path).execute(
+        "UPDATE jobs SET status = 'done', result = ?, output = ?, finished_at = ? WHERE id = ?",
+        (json.dumps(result), output, time.time(), job_id),
+    )
+
+
+def fail_job(job_id, error, db_path=DB_PATH):
+    get_connection(db_path).execute(
+        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+        (str(error), time.time(), job_id),
+    )
+
+
+def get_job(job_id, db_path=DB_PATH):
+    """Job row as a dict (result decoded from JSON), or None for an unknown id."""
+    cursor = get_connection(db_path).execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    job = dict(zip([c[0] for c in cursor.description], row))
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+def requeue_stale_jobs(max_age, db_path=DB_PATH):
+    """Put back jobs left running longer than max_age seconds (their worker died); returns how many."""
+    cursor = get_connection(db_path).execute(
+        "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND started_at < ?",
+        (time.time() - max_age,),
+    )
+    return cursor.rowcount
+
+
+def purge_jobs(max_age, db_path=DB_PATH):
+    """Delete done and failed jobs, payload and all, finished more than max_age seconds ago; returns how many."""
+    cursor = get_connection(db_path).execute(
+        "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (time.time() - max_age,)
+    )
+    return cursor.rowcount
+
+
+def job_counts(db_path=DB_PATH):
+    """{status: count} across the queue."""
+    rows = get_connection(db_path).execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+    return dict(rows)
+
+
+# === Client sessions ===
+
+def client_documents(client_id, db_path=DB_PATH):
+    """{digest: {"name", "position", "text", "deductions"}} for a client's stored documents."""
+    rows = get_connection(db_path).execute(
+        "SELECT digest, name, position, text, deductions FROM client_documents WHERE client_id = ?", (client_id,)
+    ).fetchall()
+    return {
+        digest: {"name": name, "position": position, "text": text,
+                 "deductions": json.loads(deductions) if deductions is not None else None}
+        for digest, name, position, text, deductions in rows
+    }
+
+
+def sync_client_documents(client_id, documents, db_path=DB_PATH):
+    """
+    Make the stored set match ``documents`` [(digest, name, text)] in upload
+    order: new ones are inserted, kept ones re-positioned (their extraction and
+    deductions stay), removed ones deleted. Any change to the packet drops the
+    client's stored field mappings, which were computed from the old one.
+    """
+    with transaction(db_path) as conn:
+        now = time.time()
+        conn.execute(
+            "INSERT INTO clients (id, created_at, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET updated_at = excluded.updated_at",
+            (client_id, now, now),
+        )
+        digests = [d for d, _, _ in documents]
+        stored = [d for d, in conn.execute(
+            "SELECT digest FROM client_documents WHERE client_id = ? ORDER BY position", (client_id,))]
+        if stored != digests:
+            conn.execute("DELETE FROM client_results WHERE client_id = ? AND kind = 'mapping'", (client_id,))
+        conn.execute(
+            f"DELETE FROM client_documents WHERE client_id = ? AND digest NOT IN ({','.join('?' * len(digests))})",
+            (client_id, *digests),
+        )
+        conn.executemany(
+            "INSERT INTO client_documents (client_id, digest, name, position, text) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (client_id, digest) DO UPDATE SET name = excluded.name, position = excluded.position",
+            [(client_id, digest, name, position, text) for position, (digest, name, text) in enumerate(documents)],
+        )
+
+
+def save_document_deductions(client_id, digest, deductions, db_path=DB_PATH):
+    get_connection(db_path).execute(
+        "UPDATE client_documents SET deductions = ? WHERE client_id = ? AND digest = ?",
+        (json.dumps(deductions), client_id, digest),
+    )
+
+
+def get_client_result(client_id, kind, item="", input_hash=None, db_path=DB_PATH):
+    """
+    Stored result of ``kind`` (e.g. "forms", or "mapping" per form code), or
+    None. With ``input_hash`` only a result computed from the same inputs counts.
+    """
+    row = get_connection(db_path).execute(
+        "SELECT input_hash, result FROM client_results WHERE client_id = ? AND kind = ? AND item = ?",
+        (client_id, kind, item),
+    ).fetchone()
+    if row is None or (input_hash is not None and row[0] != input_hash):
+        return None
+    return json.loads(row[1])
+
+
+def client_results(client_id, kind, input_hash=None, db_path=DB_PATH):
+    """{item: result} for every stored result of ``kind``; with ``input_hash``, only those computed from it."""
+    rows = get_connection(db_path).execute(
+        "SELECT item, input_hash, result FROM client_results WHERE client_id = ? AND kind = ?", (client_id, kind)
+    ).fetchall()
+    return {item: json.loads(result) for item, stored_hash, result in rows
+            if input_hash is None or stored_hash == input_hash}
+
+
+def save_client_result(client_id, kind, result, input_hash, item="", db_path=DB_PATH):
+    get_connection(db_path).execute(
+        "INSERT INTO client_results (client_id, kind, item, input_hash, result, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (client_id, kind, item) DO UPDATE SET input_hash = excluded.input_hash, "
+        "result = excluded.result, updated_at = excluded.updated_at",
+        (client_id, kind, item, input_hash, json.dumps(result), time.time()),
+    )
+
+
+# === Field-mapping memo ===
+
+def field_memo(form_code, revision, kinds, db_path=DB_PATH):
+    """{field name: {"label", "sources": [candidate source, ...]}} for one form revision and record kinds."""
+    rows = get_connection(db_path).execute(
+        "SELECT field_name, source, label FROM field_memo WHERE form_code = ? AND revision = ? AND kinds = ? "
+        "ORDER BY source",
+        (form_code, revision, kinds),
+    ).fetchall()
+    memo = {}
+    for field_name, source, label in rows:
+        memo.setdefault(field_name, {"label": label, "sources": []})["sources"].append(source)
+    return memo
+
+
+def update_field_memo(form_code, revision, kinds, learned, contradicted=(), db_path=DB_PATH):
+    """
+    Record ``learned`` [(field name, source, label)] candidates and drop the
+    ``contradicted`` [(field name, source)] ones, in one transaction.
+    """
+    with transaction(db_path) as conn:
+        conn.executemany(
+            "DELETE FROM field_memo WHERE form_code = ? AND revision = ? AND kinds = ? AND field_name = ? AND source = ?",
+            [(form_code, revision, kinds, field_name, source) for field_name, source in contradicted],
+        )
+        conn.executemany(
+            "INSERT INTO field_memo (form_code, revision, kinds, field_name, source, label, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (form_code, revision, kinds, field_name, source) DO UPDATE SET label = excluded.label, "
+            "updated_at = excluded.updated_at",
+            [(form_code, revision, kinds, field_name, source, label, time.time())
+             for field_name, source, label in learned],
+        )
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from resources import resource
+from settings import CACHE_DIR, env_flag
+
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("WISECPA_EXTRACTION_CACHE_ENTRIES", "512"))
+EXTRACTION_CACHE_DIR = os.getenv("WISECPA_EXTRACTION_CACHE_DIR", os.path.join(CACHE_DIR, "extraction"))
+# Extracted text holds names and SSNs: the disk tier (opt-in) expires and is size-bounded.
+EXTRACTION_CACHE_TTL = int(os.getenv("WISECPA_EXTRACTION_CACHE_TTL", str(7 * 24 * 3600)))
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("WISECPA_EXTRACTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Bump when extraction output changes (OCR settings, page joining) so old entries are ignored.
+EXTRACTION_VERSION = 2
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def expired(path: str, ttl_seconds: int, now: float | None = None) -> bool:
+    try:
+        return bool(ttl_seconds) and (now or time.time()) - os.path.getmtime(path) > ttl_seconds
+    except OSError:
+        return True
+
+
+def prune_cache_dir(directory: str, ttl_seconds: int, max_bytes: int) -> int:
+    """
+    Delete a disk cache's files older than ``ttl_seconds``, then the oldest
+    ones until the rest fit ``max_bytes``. Returns how many were deleted.
+    """
+    now = time.time()
+    try:
+        names = [n for n in os.listdir(directory) if not n.startswith(".tmp-")]
+    except OSError:
+        return 0
+    files, removed = [], 0
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if ttl_seconds and now - stat.st_mtime > ttl_seconds:
+            removed += _unlink(path)
+        else:
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        removed += _unlink(path)
+        total -= size
+    return removed
+
+
+def _unlink(path: str) -> int:
+    try:
+        os.unlink(path)
+        return 1
+    except OSError:
+        return 0
+
+
+class ExtractionCache:
+    """
+    Extracted text memoized by sha256 of the uploaded bytes.
+    A bounded in-process LRU sits in front of an optional on-disk tier, so
+    identical documents are extracted once across reruns, sessions and clients.
+    Disk entries expire after ``ttl_seconds`` and the oldest are evicted past
+    ``max_bytes``; forget() drops a document from both tiers.
+    """
+
+    def __init__(self, max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES,
+                 disk_dir: str | None = EXTRACTION_CACHE_DIR, ttl_seconds: int = EXTRACTION_CACHE_TTL,
+                 max_bytes: int = EXTRACTION_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.disk_dir, f"{digest}.v{EXTRACTION_VERSION}.txt")
+
+    def get(self, digest: str, size: int = 0) -> str | None:
+        """Look up a document; ``size`` is the upload size credited to bytes_saved on a hit."""
+        with self._lock:
+            text = self._memory.get(digest)
+            if text is not None:
+                self._memory.move_to_end(digest)
+                self.hits += 1
+                self.bytes_saved += size
+                return text
+
+        if self.disk_dir:
+            path = self._path(digest)
+            text = None
+            if expired(path, self.ttl_seconds):
+                _unlink(path)
+            else:
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        text = f.read()
+                except OSError:
+                    pass
+            if text is not None:
+                with self._lock:
+                    self._remember(digest, text)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self.bytes_saved += size
+                return text
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, digest: str, text: str) -> None:
+        with self._lock:
+            self._remember(digest, text)
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, prefix=".tmp-")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(tmp_path, self._path(digest))
+            except OSError:
+                pass
+            prune_cache_dir(self.disk_dir, self.ttl_seconds, self.max_bytes)
+
+    def forget(self, *digests: str) -> None:
+        """Drop documents from memory and disk, e.g. once no client keeps them."""
+        with self._lock:
+            for digest in digests:
+                self._memory.pop(digest, None)
+        if self.disk_dir:
+            for digest in digests:
+                _unlink(self._path(digest))
+
+    def _remember(self, digest: str, text: str) -> None:
+        self._memory[digest] = text
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "entries": len(self._memory),
+            }
+
+
+@resource(warm=())
+def get_extraction_cache() -> ExtractionCache:
+    """Process-wide cache; memory-only unless WISECPA_EXTRACTION_DISK_CACHE=1 adds the disk tier."""
+    disk = EXTRACTION_CACHE_DIR if env_flag("WISECPA_EXTRACTION_DISK_CACHE") else None
+    return ExtractionCache(disk_dir=disk)
@@ -0,0 +1,138 @@
+"""
+Cross-client memo of which structured source feeds each form field.
+
+For one revision of a form, a field such as the 1040's "Wages, salaries, tips"
+line is fed by the same source for every client: W-2 box 1, named here
+``W2.wages`` after the parsed record attribute (file_parser.py). When a
+reviewer accepts a field mapping, an accepted value that equals exactly one
+source in the client's own records is remembered under (form code, revision,
+record kinds, field name) in SQLite (db.py). Values that match several
+sources say nothing and are skipped, as are fields the rules or the memo
+itself filled. A source that a later accepted value disagrees with is
+dropped again.
+
+The record kinds ("INT,W2") are part of the key because a total depends on
+them: a W-2-only client's total income is its wages, but not once a 1099-INT
+is added. Later clients with the same kinds get memoized fields from their
+own records without the model; a field is only filled when its remaining
+candidates agree on one value for the client, and fields whose source the
+client lacks still go to the model. A new form revision starts with an
+empty memo.
+"""
+import re
+from collections import defaultdict
+
+import db
+from chunking import DOCUMENT_BREAK
+from file_parser import parse_amount, parse_document
+from irs_forms import form_revision
+from settings import env_flag
+
+# Origins of a filled value that say which source a field takes; rule and
+# memo values would only teach the memo what it already assumed.
+LEARNED_FROM = ("model", "reviewer")
+
+
+def memo_enabled() -> bool:
+    return env_flag("WISECPA_FIELD_MEMO", default=True)
+
+
+def record_sources(user_data: str) -> dict[str, str]:
+    """
+    {"W2.wages": "52,000.00", ...} from the documents that parse into complete
+    records: amounts are summed over every record of a kind, text is kept only
+    when all records of the kind agree.
+    """
+    values = defaultdict(list)
+    for doc in user_data.split(DOCUMENT_BREAK):
+        parsed = parse_document(doc)
+        if parsed and all(r.complete() for r in parsed):
+            for record in parsed:
+                for attr, value in record.to_dict().items():
+                    values[f"{record.kind}.{attr}"].append(value)
+    sources = {}
+    for source, found in values.items():
+        if all(isinstance(v, float) for v in found):
+            sources[source] = f"{sum(found):,.2f}"
+        elif len(set(map(str, found))) == 1:
+            sources[source] = str(found[0])
+    return sources
+
+
+def record_kinds(sources: dict[str, str]) -> str:
+    """The record kinds behind ``sources`` (record_sources()), e.g. "INT,W2"."""
+    return ",".join(sorted({source.split(".", 1)[0] for source in sources}))
+
+
+def _normalize(value: str):
+    amount = parse_amount(value)
+    if amount is not None:
+        return round(amount, 2)
+    return re.sub(r"\s+", " ", str(value)).strip().casefold()
+
+
+def _empty(value) -> bool:
+    return value in ("", 0, None)
+
+
+def apply_memo(form_code: str, user_data: str, field_names=None, revision: str | None = None) -> dict:
+    """
+    Fields of ``form_code`` the memo can fill from the client's records,
+    as {"form_fields", "semantic_fields"} keyed like form_rules.apply_rules.
+    ``revision`` defaults to the locally stored copy's (irs_forms.form_revision).
+    """
+    form_fields, semantic_fields = {}, {}
+    revision = revision or form_revision(form_code)
+    if not memo_enabled() or not revision or not user_data:
+        return {"form_fields": form_fields, "semantic_fields": semantic_fields}
+
+    sources = record_sources(user_data)
+    memo = db.field_memo(form_code, revision, record_kinds(sources)) if sources else {}
+    known = set(field_names) if field_names is not None else None
+    for field_name, entry in memo.items():
+        if known is not None and field_name not in known:
+            continue
+        values = {sources[s] for s in entry["sources"] if s in sources}
+        if len(values) == 1:
+            value = values.pop()
+            form_fields[field_name] = value
+            semantic_fields[entry["label"] or field_name] = value
+    return {"form_fields": form_fields, "semantic_fields": semantic_fields}
+
+
+def learn(form_code: str, user_data: str, form_fields: dict, labels: dict | None = None,
+          revision: str | None = None, filled_by: dict | None = None) -> int:
+    """
+    Remember the sources behind a reviewer-accepted mapping ({field name:
+    value}); ``labels`` ({field name: label}) name the fields in later
+    summaries. ``filled_by`` ({field name: "rules", "memo", "model", ...},
+    see ai_engine.fill_pdf_form) marks where each value came from: only
+    model answers and fields without an origin (the reviewer's) are evidence.
+    Returns how many fields now have a memoized source for the client's
+    record kinds.
+    """
+    revision = revision or form_revision(form_code)
+    if not memo_enabled() or not revision:
+        return 0
+    found = record_sources(user_data)
+    kinds = record_kinds(found)
+    sources = {s: _normalize(v) for s, v in found.items()}
+    memo = db.field_memo(form_code, revision, kinds)
+    labels = labels or {}
+    filled_by = filled_by or {}
+    learned, contradicted = [], []
+    for field_name, value in form_fields.items():
+        if filled_by.get(field_name, "reviewer") not in LEARNED_FROM:
+            continue
+        accepted = _normalize(value)
+        if _empty(accepted):
+            # Zero or blank matches too many sources to say anything.
+            continue
+        known = memo.get(field_name, {}).get("sources", [])
+        contradicted += [(field_name, s) for s in known if s in sources and sources[s] != accepted]
+        matches = [s for s, v in sources.items() if v == accepted]
+        if len(matches) == 1:
+            label = " ".join((labels.get(field_name) or "").split()) or None
+            learned.append((field_name, matches[0], label))
+    db.update_field_memo(form_code, revision, kinds, learned, contradicted)
+    return len(db.field_memo(form_code, revision, kinds))
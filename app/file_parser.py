@@ -1,3 +1,395 @@
-# Placeholder for advanced file parsing logic
-def parse_uploaded_file(file):
-    return file.read().decode("utf-8") if hasattr(file, "read") else str(file)
+"""
+Structured records for the documents we see most: W-2, 1099-INT, 1099-DIV,
+1099-B lots and crypto trades.
+
+Records are plain ``__slots__`` classes, so a client with thousands of lots
+costs a few hundred bytes per lot instead of a dict each. records_payload()
+turns them into a compact columnar JSON block for prompts.
+"""
+import csv
+import io
+import json
+import re
+from datetime import datetime
+
+from chunking import DOCUMENT_BREAK, PAGE_BREAK, split_sections
+
+_AMOUNT = r"\(?-?\$?[ \t]*\d[\d,]*\.\d{2}\)?"
+_PAYER = r"Payer'?s?(?:\s+name(?:,\s*street\s+address[^\n]*)?)?"
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%Y/%m/%d", "%m-%d-%Y", "%d %b %Y", "%b %d, %Y")
+
+
+class Record:
+    """Base for parsed records; subclasses list their attributes in __slots__."""
+    __slots__ = ()
+    kind = "record"
+    # Attributes that must be present before the record may stand in for the raw text.
+    required: tuple = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    def complete(self) -> bool:
+        return all(getattr(self, name) is not None for name in self.required)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    def __repr__(self):
+        body = ", ".join(f"{k}={v!r}" for k, v in self.to_dict().items())
+        return f"{type(self).__name__}({body})"
+
+
+class W2(Record):
+    __slots__ = ("employee_name", "employee_ssn", "employee_address", "employer_name", "employer_ein",
+                 "wages", "federal_withholding", "social_security_wages", "social_security_tax",
+                 "medicare_wages", "medicare_tax", "state", "state_wages", "state_withholding")
+    kind = "W2"
+    required = ("employee_name", "wages")
+
+
+class Form1099INT(Record):
+    __slots__ = ("payer", "interest", "early_withdrawal_penalty", "us_savings_bond_interest",
+                 "federal_withholding", "tax_exempt_interest")
+    kind = "1099-INT"
+    required = ("payer", "interest")
+
+
+class Form1099DIV(Record):
+    __slots__ = ("payer", "ordinary_dividends", "qualified_dividends", "capital_gain_distributions",
+                 "federal_withholding")
+    kind = "1099-DIV"
+    required = ("payer", "ordinary_dividends")
+
+
+class Form1099B(Record):
+    """One sale lot as reported on a 1099-B or a brokerage CSV export."""
+    __slots__ = ("payer", "description", "date_acquired", "date_sold", "proceeds", "cost_basis",
+                 "wash_sale_loss_disallowed", "term", "federal_withholding")
+    kind = "1099-B"
+    required = ("proceeds", "cost_basis")
+
+
+class CryptoTrade(Record):
+    """One disposal of a digital asset, from an exchange CSV export."""
+    __slots__ = ("asset", "quantity", "date_acquired", "date_sold", "proceeds", "cost_basis", "fee")
+    kind = "crypto"
+    required = ("asset", "proceeds", "cost_basis")
+
+
+def parse_amount(raw) -> float | None:
+    """'$1,234.50' -> 1234.5; '(12.00)' and '-12.00' -> -12.0; anything else -> None."""
+    if raw is None:
+        return None
+    s = str(raw).strip().replace("$", "").replace(",", "").replace(" ", "")
+    negative = s.startswith("(") and s.endswith(")")
+    s = s.strip("()")
+    try:
+        value = float(s)
+    except ValueError:
+        return None
+    return -value if negative else value
+
+
+def parse_date(raw) -> str | None:
+    """ISO date for the common US/ISO formats; other non-empty values (e.g. 'VARIOUS') pass through."""
+    s = str(raw or "").strip()
+    if not s:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return s
+
+
+def _box_amount(text: str, label: str) -> float | None:
+    """
+    Amount printed after a box label on the same line, or on the next line.
+    For side-by-side boxes ("1 Wages ... 2 Federal income tax withheld" over
+    "52,000.00 6,200.00") the label's position among the box numbers on its
+    line picks the amount.
+    """
+    m = re.search(rf"{label}[^\d\n(]{{0,20}}({_AMOUNT})", text, re.IGNORECASE)
+    if m:
+        return parse_amount(m.group(1))
+    m = re.search(rf"{label}[^\n]*\n([^\n]*)", text, re.IGNORECASE)
+    if not m:
+        return None
+    line_start = text.rfind("\n", 0, m.start()) + 1
+    boxes = len(re.findall(r"(?:^|\s)\d{1,2}[a-z]?\s+[A-Za-z]", text[line_start:m.start() + 1]))
+    amounts = re.findall(_AMOUNT, m.group(1))
+    position = max(boxes - 1, 0)
+    return parse_amount(amounts[position]) if position < len(amounts) else None
+
+
+def _box_text(text: str, label: str) -> str | None:
+    """Free text after a label on the same line, or the next line when the label ends its line."""
+    m = re.search(rf"{label}[ \t:]*([^\n]*)(?:\n([^\n]*))?", text, re.IGNORECASE)
+    if not m:
+        return None
+    value = (m.group(1) or "").strip() or (m.group(2) or "").strip()
+    return value or None
+
+
+def _ssn(text: str, label: str) -> str | None:
+    m = re.search(rf"{label}[^\d\n]{{0,20}}(\d{{3}})-?(\d{{2}})-?(\d{{4}})", text, re.IGNORECASE)
+    return "-".join(m.groups()) if m else None
+
+
+def _parse_w2(text: str) -> W2:
+    ein = re.search(r"\b(\d{2}-\d{7})\b", text)
+    state = re.search(r"\b15\s+State\b[^\n]*\n?[ \t]*([A-Z]{2})\b", text)
+    return W2(
+        employee_name=_box_text(text, r"Employee'?s\s+(?:first\s+)?name(?:\s+and\s+initial)?(?:\s+Last\s+name)?"),
+        employee_ssn=_ssn(text, r"Employee'?s\s+social\s+security\s+number"),
+        employee_address=_box_text(text, r"Employee'?s\s+address(?:\s+and\s+ZIP\s+code)?"),
+        employer_name=_box_text(text, r"Employer(?!'?s?\s+(?:identification|state))(?:'?s\s+name(?:,\s*address,?\s*and\s+ZIP\s+code)?)?"),
+        employer_ein=ein.group(1) if ein else None,
+        wages=_box_amount(text, r"Wages,?\s*tips,?\s*other\s*comp(?:ensation)?"),
+        federal_withholding=_box_amount(text, r"Federal\s+income\s+tax\s+withheld"),
+        social_security_wages=_box_amount(text, r"Social\s+security\s+wages"),
+        social_security_tax=_box_amount(text, r"Social\s+security\s+tax\s+withheld"),
+        medicare_wages=_box_amount(text, r"Medicare\s+wages\s+and\s+tips"),
+        medicare_tax=_box_amount(text, r"Medicare\s+tax\s+withheld"),
+        state=state.group(1) if state else None,
+        state_wages=_box_amount(text, r"State\s+wages,?\s*tips,?\s*etc\.?"),
+        state_withholding=_box_amount(text, r"State\s+income\s+tax"),
+    )
+
+
+def _parse_1099_int(text: str) -> Form1099INT:
+    return Form1099INT(
+        payer=_box_text(text, _PAYER),
+        interest=_box_amount(text, r"Interest\s+income"),
+        early_withdrawal_penalty=_box_amount(text, r"Early\s+withdrawal\s+penalty"),
+        us_savings_bond_interest=_box_amount(text, r"Interest\s+on\s+U\.?S\.?\s+Savings\s+Bonds"),
+        federal_withholding=_box_amount(text, r"Federal\s+income\s+tax\s+withheld"),
+        tax_exempt_interest=_box_amount(text, r"Tax-exempt\s+interest"),
+    )
+
+
+def _parse_1099_div(text: str) -> Form1099DIV:
+    return Form1099DIV(
+        payer=_box_text(text, _PAYER),
+        ordinary_dividends=_box_amount(text, r"Total\s+ordinary\s+dividends"),
+        qualified_dividends=_box_amount(text, r"Qualified\s+dividends"),
+        capital_gain_distributions=_box_amount(text, r"Total\s+capital\s+gain\s+distr(?:ibutions|\.)?"),
+        federal_withholding=_box_amount(text, r"Federal\s+income\s+tax\s+withheld"),
+    )
+
+
+def _parse_1099_b(text: str) -> Form1099B:
+    term = re.search(r"\b(short|long)[\s-]*term\b", text, re.IGNORECASE)
+    return Form1099B(
+        payer=_box_text(text, _PAYER),
+        description=_box_text(text, r"Description\s+of\s+property"),
+        date_acquired=parse_date(_box_text(text, r"Date\s+acquired")),
+        date_sold=parse_date(_box_text(text, r"Date\s+sold\s+or\s+disposed")),
+        proceeds=_box_amount(text, r"Proceeds"),
+        cost_basis=_box_amount(text, r"Cost\s+or\s+other\s+basis"),
+        wash_sale_loss_disallowed=_box_amount(text, r"Wash\s+sale\s+loss\s+disallowed"),
+        term=term.group(1).lower() if term else None,
+        federal_withholding=_box_amount(text, r"Federal\s+income\s+tax\s+withheld"),
+    )
+
+
+# (document marker, parser); a consolidated statement can match several.
+_TEXT_PARSERS = (
+    (re.compile(r"Form\s*W-2\b|Wage and Tax Statement", re.IGNORECASE), _parse_w2),
+    (re.compile(r"1099-INT\b", re.IGNORECASE), _parse_1099_int),
+    (re.compile(r"1099-DIV\b", re.IGNORECASE), _parse_1099_div),
+    (re.compile(r"1099-B\b", re.IGNORECASE), _parse_1099_b),
+)
+
+
+_MARKERS = [marker for marker, _ in _TEXT_PARSERS]
+
+
+def parse_section(text: str) -> list[Record]:
+    """Records recognised in one section (the pages of one form, see document_sections)."""
+    return [parse(text) for marker, parse in _TEXT_PARSERS if marker.search(text)]
+
+
+def document_sections(text: str) -> list[str]:
+    """A document cut into per-form sections, e.g. a W-2 page and a 1099-INT page of one PDF."""
+    return split_sections(text, _MARKERS)
+
+
+def parse_document(text: str) -> list[Record]:
+    """
+    Records recognised in the text of one document (empty when nothing
+    matched). Each form's pages are parsed on their own, so a 1099 page never
+    picks up the W-2 withholding printed on the page before it.
+    """
+    return [r for section in document_sections(text) for r in parse_section(section)]
+
+
+def parse_text(text: str) -> list[Record]:
+    """Records from every document in joined extraction output (see chunking.join_documents)."""
+    return [r for doc in text.split(DOCUMENT_BREAK) for r in parse_document(doc)]
+
+
+# Normalised CSV header -> record attribute, for brokerage and exchange exports.
+CSV_COLUMNS = {
+    "description": ("description", "security", "security description", "name"),
+    "asset": ("asset", "currency", "coin", "symbol", "ticker", "asset name"),
+    "quantity": ("quantity", "amount", "qty", "shares", "units", "size"),
+    "date_acquired": ("date acquired", "acquired", "open date", "purchase date", "date purchased"),
+    "date_sold": ("date sold", "sold", "close date", "sale date", "date disposed", "disposed"),
+    "proceeds": ("proceeds", "sales price", "gross proceeds", "sale proceeds"),
+    "cost_basis": ("cost basis", "cost", "basis", "cost or other basis"),
+    "wash_sale_loss_disallowed": ("wash sale loss disallowed", "wash sale", "wash sale disallowed",
+                                  "wash sale adjustment"),
+    "term": ("term", "holding period", "short/long"),
+    "fee": ("fee", "fees", "commission"),
+}
+_HEADER_LOOKUP = {alias: attr for attr, aliases in CSV_COLUMNS.items() for alias in aliases}
+
+
+def _normalize_header(name: str) -> str:
+    return re.sub(r"[^a-z/]+", " ", name.lower()).strip()
+
+
+def csv_columns(header: list[str]) -> dict[str, int]:
+    """Map record attributes to column positions for a CSV header row."""
+    columns = {}
+    for i, name in enumerate(header):
+        attr = _HEADER_LOOKUP.get(_normalize_header(name))
+        if attr and attr not in columns:
+            columns[attr] = i
+    return columns
+
+
+def csv_record_type(columns: dict[str, int]):
+    """CryptoTrade for exchange exports, Form1099B for brokerage ones, None otherwise."""
+    if "proceeds" not in columns or "cost_basis" not in columns:
+        return None
+    return CryptoTrade if "asset" in columns and "description" not in columns else Form1099B
+
+
+def _term(raw) -> str | None:
+    s = str(raw or "").strip().lower()
+    if s.startswith("s"):
+        return "short"
+    if s.startswith("l"):
+        return "long"
+    return None
+
+
+def parse_csv(data) -> list[Record]:
+    """Parse a brokerage or crypto CSV export into Form1099B / CryptoTrade records."""
+    text = data.decode("utf-8-sig", errors="replace") if isinstance(data, (bytes, bytearray)) else data
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None)
+    if not header:
+        return []
+    columns = csv_columns(header)
+    record_type = csv_record_type(columns)
+    if record_type is None:
+        return []
+
+    converters = {
+        "quantity": parse_amount, "proceeds": parse_amount, "cost_basis": parse_amount,
+        "wash_sale_loss_disallowed": parse_amount, "fee": parse_amount,
+        "date_acquired": parse_date, "date_sold": parse_date, "term": _term,
+    }
+    attrs = [(a, i, converters.get(a)) for a, i in columns.items() if a in record_type.__slots__]
+    records = []
+    for row in reader:
+        if not row:
+            continue
+        values = {}
+        for attr, i, convert in attrs:
+            raw = row[i].strip() if i < len(row) else ""
+            values[attr] = convert(raw) if convert else (raw or None)
+        record = record_type(**values)
+        if record.complete():
+            records.append(record)
+    return records
+
+
+def records_payload(records: list[Record]) -> str:
+    """
+    Compact columnar JSON: {"W2": {"cols": [...], "rows": [[...], ...]}, ...}.
+    Columns that are empty for every record of a kind are dropped.
+    """
+    grouped: dict[str, list[Record]] = {}
+    for r in records:
+        grouped.setdefault(r.kind, []).append(r)
+    payload = {}
+    for kind, group in grouped.items():
+        cols = [name for name in type(group[0]).__slots__ if any(getattr(r, name) is not None for r in group)]
+        payload[kind] = {"cols": cols, "rows": [[getattr(r, c) for c in cols] for r in group]}
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def _unparsed_lines(text: str, records: list[Record]) -> list[str]:
+    """
+    Lines of a parsed section that carry something its records don't: an
+    amount no record holds (box 12 codes, box 14 notes, a receipt total) or,
+    for lines without amounts, neither record text nor the form's title.
+    """
+    amounts, texts = set(), [m for m in _MARKERS if m.search(text)]
+    for record in records:
+        for value in record.to_dict().values():
+            if isinstance(value, float):
+                amounts.add(round(value, 2))
+            elif len(str(value)) >= 3:
+                texts.append(re.compile(rf"(?<!\w){re.escape(str(value))}(?!\w)", re.IGNORECASE))
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        found = [parse_amount(a) for a in re.findall(_AMOUNT, line)]
+        if found:
+            covered = all(a is not None and round(a, 2) in amounts for a in found)
+        else:
+            covered = any(t.search(line) for t in texts)
+        if not covered:
+            lines.append(line)
+    return lines
+
+
+def compact_user_data(text: str) -> str:
+    """
+    Replace the sections (per-form pages, see document_sections) that parse
+    into complete records with one columnar JSON block. Their lines the
+    records don't cover stay as text next to it, as do sections that don't
+    parse (receipts, letters, partial parses).
+    """
+    records, rest = [], []
+    for doc in text.split(DOCUMENT_BREAK):
+        kept = []
+        for section in document_sections(doc):
+            parsed = parse_section(section)
+            if parsed and all(r.complete() for r in parsed):
+                records.extend(parsed)
+                lines = _unparsed_lines(section, parsed)
+                if lines:
+                    kinds = ", ".join(r.kind for r in parsed)
+                    kept.append(f"Lines of the {kinds} not in the JSON block:\n" + "\n".join(lines))
+            else:
+                kept.append(section)
+        if kept:
+            rest.append(PAGE_BREAK.join(kept))
+    if not records:
+        return text
+    return DOCUMENT_BREAK.join([f"Structured tax documents (JSON, columnar):\n{records_payload(records)}", *rest])
+
+
+def is_csv_upload(file) -> bool:
+    """CSV by extension or MIME type (browsers on Windows report Excel's type for .csv)."""
+    name = (getattr(file, "name", "") or "").lower()
+    return name.endswith(".csv") or getattr(file, "type", "") in ("text/csv", "application/vnd.ms-excel")
+
+
+def parse_uploaded_file(file) -> list[Record]:
+    """Records from an uploaded CSV export or text document."""
+    data = file.getvalue() if hasattr(file, "getvalue") else file.read() if hasattr(file, "read") else file
+    if is_csv_upload(file):
+        return parse_csv(data)
+    return parse_text(data.decode("utf-8", errors="replace") if isinstance(data, (bytes, bytearray)) else str(data))
@@ -0,0 +1,170 @@
+"""
+Deterministic fast path for form filling.
+
+Rule tables live in models/rules/<form_code>.json. Each table names value
+``sources`` (regexes with a ``value`` group, optionally restricted to
+documents matching a ``document`` regex) and the ``fields`` they fill. The IRS
+reuses field names such as ``f1_32`` with other meanings in later revisions,
+so a field with a printed ``line`` ("1a") fills whichever field sits on that
+line of the form being filled (pdf_filler's line index); the exact PDF field
+name is only trusted for the stored form ``revisions`` the table lists. A PDF holding several forms (a W-2 page, then a 1099-INT
+page) is cut into per-form sections on those ``document`` regexes first, so
+a source only ever reads its own form's pages. A field may add up several
+amount sources (a list), and a field with an ``unless`` regex is left to the
+model whenever any document matches it, e.g. a 1099 type its sources do not
+read. Whatever the rules resolve is filled locally; only the remaining fields
+go to the model.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+from chunking import DOCUMENT_BREAK, split_sections
+from irs_forms import form_revision
+
+RULES_DIR = os.getenv(
+    "WISECPA_RULES_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "rules"),
+)
+
+_rules_memo: dict[str, dict | None] = {}
+_rules_lock = threading.Lock()
+
+
+def _compile(table: dict, version: str) -> dict:
+    sources = {}
+    for name, spec in table.get("sources", {}).items():
+        sources[name] = {
+            "document": re.compile(spec["document"], re.IGNORECASE) if spec.get("document") else None,
+            "patterns": [re.compile(p, re.IGNORECASE) for p in spec["patterns"]],
+            "type": spec.get("type", "text"),
+            "combine": spec.get("combine", "first"),
+        }
+    markers = [s["document"] for s in sources.values() if s["document"] is not None]
+    fields = [
+        {**rule, "source": [rule["source"]] if isinstance(rule["source"], str) else list(rule["source"]),
+         "unless": re.compile(rule["unless"], re.IGNORECASE) if rule.get("unless") else None}
+        for rule in table.get("fields", [])
+    ]
+    return {"form": table.get("form"), "sources": sources, "fields": fields, "markers": markers,
+            "revisions": set(table.get("revisions", [])), "version": version}
+
+
+def load_rules(form_code: str) -> dict | None:
+    """Compiled rule table for a form code, or None when the form has no rules."""
+    if not form_code or not re.fullmatch(r"[A-Za-z0-9_\-]+", form_code):
+        return None
+    key = form_code.lower()
+    if key in _rules_memo:
+        return _rules_memo[key]
+    try:
+        with open(os.path.join(RULES_DIR, f"{key}.json"), "rb") as f:
+            raw = f.read()
+        rules = _compile(json.loads(raw), hashlib.sha256(raw).hexdigest()[:16])
+    except FileNotFoundError:
+        rules = None
+    with _rules_lock:
+        _rules_memo[key] = rules
+    return rules
+
+
+def rules_version(form_code: str) -> str | None:
+    """Content hash of a form's rule table, or None without one; part of job keys so edited rules re-map."""
+    rules = load_rules(form_code)
+    return rules["version"] if rules else None
+
+
+def _parse_amount(raw: str) -> float | None:
+    try:
+        return float(raw.replace("$", "").replace(",", "").strip())
+    except ValueError:
+        return None
+
+
+def _normalize(value: str, kind: str):
+    if kind == "amount":
+        return _parse_amount(value)
+    if kind == "ssn":
+        digits = re.sub(r"\D", "", value)
+        return f"{digits[:3]}-{digits[3:5]}-{digits[5:]}" if len(digits) == 9 else None
+    return value.strip() or None
+
+
+def _first_match(source: dict, document: str):
+    """Value of the first pattern that matches a document; only one per document, so repeated copies aren't double counted."""
+    for pattern in source["patterns"]:
+        m = pattern.search(document)
+        if m:
+            return _normalize(m.group("value"), source["type"])
+    return None
+
+
+def extract_source(source: dict, documents: list[str]):
+    """Combine a source's per-document (or per-section) values; None when it can't be resolved."""
+    values = [
+        v for doc in documents
+        if source["document"] is None or source["document"].search(doc)
+        for v in [_first_match(source, doc)] if v is not None
+    ]
+    if not values:
+        return None
+    combine = source["combine"]
+    if combine == "sum":
+        total = sum(values)
+        return f"{total:,.2f}"
+    if combine == "unique":
+        # Conflicting values (e.g. W-2s for both spouses) are left to the model.
+        return values[0] if len(set(values)) == 1 else None
+    value = values[0]
+    return f"{value:,.2f}" if isinstance(value, float) else value
+
+
+def _target(rule: dict, lines: dict | None, pinned: bool) -> str | None:
+    """The PDF field a rule fills: by printed line when the form's line index is known, else its pinned name."""
+    if lines is not None and rule.get("line"):
+        for page, names in lines.get(rule["line"], []):
+            if rule.get("page") is None or page == rule["page"]:
+                return names[0]
+        return None
+    return rule["field"] if pinned else None
+
+
+def apply_rules(form_code: str, user_data: str, field_names=None, lines: dict | None = None,
+                revision: str | None = None) -> dict:
+    """
+    Resolve fields of ``form_code`` from the extracted text without the model.
+    A field with several sources gets their sum. ``lines`` is the line index
+    of the form being filled ({printed line: [[page, [field names]]]}, see
+    pdf_filler.load_field_index); rules without a line there, or without the
+    index, only apply when ``revision`` (default: the stored copy's) is one the
+    table lists. Rules whose target is not in ``field_names`` (when given) are
+    skipped too, so a new form revision degrades to the model instead of
+    filling the wrong box. Returns {"form_fields", "semantic_fields"}.
+    """
+    rules = load_rules(form_code)
+    form_fields, semantic_fields = {}, {}
+    if rules is None or not user_data:
+        return {"form_fields": form_fields, "semantic_fields": semantic_fields}
+
+    pinned = (revision or form_revision(form_code)) in rules["revisions"]
+    known = set(field_names) if field_names is not None else None
+    documents = [section for d in user_data.split(DOCUMENT_BREAK) for section in split_sections(d, rules["markers"])]
+    values = {}
+    for rule in rules["fields"]:
+        target = _target(rule, lines, pinned)
+        if target is None or (known is not None and target not in known):
+            continue
+        if rule["unless"] is not None and any(rule["unless"].search(d) for d in documents):
+            continue
+        for source in rule["source"]:
+            if source not in values:
+                values[source] = extract_source(rules["sources"][source], documents)
+        found = [values[source] for source in rule["source"] if values[source] is not None]
+        if not found:
+            continue
+        value = found[0] if len(found) == 1 else f"{sum(_parse_amount(v) for v in found):,.2f}"
+        form_fields[target] = value
+        semantic_fields[rule.get("semantic") or target] = value
+    return {"form_fields": form_fields, "semantic_fields": semantic_fields}
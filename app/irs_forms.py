@@ -1,18 +1,181 @@
-import requests
-def download_form_bytes(form_code):
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from resources import lazy_module, resource
+from settings import CACHE_DIR, env_flag
+from telemetry import span
+
+requests = lazy_module("requests")
+
+IRS_BASE_URL = os.getenv("WISECPA_IRS_BASE_URL", "https://www.irs.gov/pub/irs-pdf")
+FORMS_DIR = os.getenv("WISECPA_FORMS_DIR", os.path.join(CACHE_DIR, "irs_forms"))
+# Stored copies younger than this are served without revalidating against irs.gov.
+FORMS_MAX_AGE = int(os.getenv("WISECPA_FORMS_MAX_AGE", str(24 * 3600)))
+REQUEST_TIMEOUT = float(os.getenv("WISECPA_FORMS_TIMEOUT", "20"))
+
+COMMON_FORMS = (
+    "f1040", "f1040s1", "f1040s2", "f1040s3",
+    "f1040sa", "f1040sb", "f1040sc", "f1040sd", "f1040se", "f1040sse",
+    "f8949", "f8863", "f8812", "f2441", "f8889", "f8995", "f4562",
+)
+
+_FORM_CODE_RE = re.compile(r"[A-Za-z0-9_\-]+")
+
+
+@resource(warm=())
+def get_session():
+    """Process-wide pooled session; retries transient gateway errors."""
+    retry = requests.adapters.Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                                    allowed_methods=("GET",))
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _form_dir(form_code):
+    return os.path.join(FORMS_DIR, form_code)
+
+
+def _load_meta(form_code):
+    try:
+        with open(os.path.join(_form_dir(form_code), "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _atomic_write(path, data: bytes):
+    """Write to a temp file in the same directory and rename, so readers never see partial files."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+
+
+def _save_meta(form_code, meta):
+    _atomic_write(os.path.join(_form_dir(form_code), "meta.json"),
+                  json.dumps(meta, indent=2).encode("utf-8"))
+
+
+def _read_revision(form_code, meta):
+    try:
+        with open(os.path.join(_form_dir(form_code), f"{meta['revision']}.pdf"), "rb") as f:
+            return f.read()
+    except (OSError, KeyError):
+        return None
+
+
+def _store(form_code, content: bytes, response) -> dict:
+    revision = hashlib.sha256(content).hexdigest()[:16]
+    blob_path = os.path.join(_form_dir(form_code), f"{revision}.pdf")
+    if not os.path.exists(blob_path):
+        _atomic_write(blob_path, content)
+    meta = {
+        "form_code": form_code,
+        "revision": revision,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "checked_at": time.time(),
+    }
+    _save_meta(form_code, meta)
+    return meta
+
+
+def form_revision(form_code):
+    """Revision id (content hash prefix) of the locally stored copy of a form, if any."""
+    meta = _load_meta(form_code)
+    return meta.get("revision") if meta else None
+
+
+def download_form_bytes(form_code, offline=None):
     """
-    Download a form from IRS website and return the PDF bytes without saving locally.
-    This prevents the project from becoming huge with stored forms.
+    Return the PDF bytes for an IRS form, using the local form store.
+    Fresh copies are served straight from disk; stale ones are revalidated with
+    ETag/Last-Modified so unchanged forms cost a 304 instead of a full download;
+    if irs.gov errors or is unreachable, the stale copy is served.
+    In offline mode (argument or WISECPA_OFFLINE=1) only the disk is consulted.
     """
-    url = f"https://www.irs.gov/pub/irs-pdf/{form_code}.pdf"
+    with span("download", form=form_code) as s:
+        pdf_bytes = _download_form_bytes(form_code, offline)
+        s.set(bytes=len(pdf_bytes) if pdf_bytes else 0)
+        return pdf_bytes
+
+
+def _download_form_bytes(form_code, offline):
+    if not form_code or not _FORM_CODE_RE.fullmatch(form_code):
+        print(f"❌ Invalid form code: {form_code!r}")
+        return None
+    if offline is None:
+        offline = env_flag("WISECPA_OFFLINE")
+
+    meta = _load_meta(form_code)
+    cached = _read_revision(form_code, meta) if meta else None
+    if cached is not None and (offline or time.time() - meta.get("checked_at", 0) < FORMS_MAX_AGE):
+        return cached
+    if offline:
+        print(f"❌ Form not available offline: {form_code}")
+        return None
+
+    headers = {}
+    if cached is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    url = f"{IRS_BASE_URL}/{form_code}.pdf"
     try:
-        r = requests.get(url)
+        r = get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if r.status_code == 304 and cached is not None:
+            meta["checked_at"] = time.time()
+            _save_meta(form_code, meta)
+            return cached
         if r.status_code == 200:
+            _store(form_code, r.content, r)
             return r.content
-        else:
-            print(f"❌ Form not found: {form_code}")
-            return None
+        if cached is not None:
+            print(f"⚠️ Revalidating {form_code} returned HTTP {r.status_code}; serving the stored copy")
+            return cached
+        print(f"❌ Form not found: {form_code}")
+        return None
     except Exception as e:
         print(f"⚠️ Error downloading {form_code}: {e}")
-        return None
+        # A stale copy beats no form at all when irs.gov is unreachable.
+        return cached
+
+
+def warm_forms(form_codes=COMMON_FORMS):
+    """Pre-fetch forms into the local store; returns {form_code: revision or None}."""
+    return {code: (form_revision(code) if download_form_bytes(code) else None) for code in form_codes}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the local IRS form store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm = sub.add_parser("warm", help="pre-fetch forms into the local store")
+    warm.add_argument("forms", nargs="*", help=f"form codes (default: {' '.join(COMMON_FORMS)})")
+    args = parser.parse_args(argv)
+
+    if args.command == "warm":
+        results = warm_forms(args.forms or COMMON_FORMS)
+        for code, revision in results.items():
+            print(f"{'✔' if revision else '❌'} {code} {revision or ''}".rstrip())
+        return 0 if all(results.values()) else 1
+
 
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,288 @@
+"""
+Background jobs on the SQLite queue in db.py, run by a local worker pool.
+
+    python app/jobs.py work [--workers 2]
+
+The Streamlit app submits jobs and polls them by id, so long steps survive
+reruns instead of blocking them. Workers start inside the app process on
+first submit (WISECPA_JOB_WORKERS threads, 0 to leave the queue to an
+external ``jobs.py work`` process).
+"""
+import argparse
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import field_memo
+from ai_engine import estimate_fill_tokens, fill_pdf_form
+from capital_gains import CAPITAL_GAINS_FORMS, capital_gains_fields, capital_gains_semantic, form_8949_warnings
+from form_rules import rules_version
+from irs_forms import download_form_bytes, form_revision
+from pdf_filler import fill_pdf_form_simple, list_filtered_pdf_fields, list_pdf_fields, load_field_index, open_pdf
+from resources import resource
+from telemetry import labels, propagate, span
+
+JOB_WORKERS = int(os.getenv("WISECPA_JOB_WORKERS", "2"))
+POLL_INTERVAL = float(os.getenv("WISECPA_JOB_POLL_SECONDS", "0.5"))
+STALE_AFTER = float(os.getenv("WISECPA_JOB_STALE_SECONDS", "900"))
+# Finished jobs are reused for identical work this long, then deleted with their payloads.
+JOB_TTL = float(os.getenv("WISECPA_JOB_TTL_SECONDS", "3600"))
+PREFETCH_CONCURRENCY = int(os.getenv("WISECPA_PREFETCH_CONCURRENCY", "6"))
+# Estimated LLM tokens prefetch may spend mapping forms nobody has opened yet. The default 0
+# only downloads and indexes them; a budget such as 30000 also maps the first recommended forms.
+PREFETCH_TOKEN_BUDGET = int(os.getenv("WISECPA_PREFETCH_TOKEN_BUDGET", "0"))
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register fn(payload) -> (result, output bytes or None) for a job kind."""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def map_form(form_code: str, form_name: str, user_data: str, trades: dict | None = None):
+    """
+    Download a form and map the client's data onto it; returns (blank PDF
+    bytes, {"form_fields", "semantic_fields", "filled_by", "unresolved", "warnings"}) or
+    (None, None) when the IRS has no fillable PDF for the code.
+    """
+    pdf_bytes = download_form_bytes(form_code)
+    if not pdf_bytes:
+        return None, None
+    # Parse once; the same document serves field listing and the line map.
+    pdf_doc, _ = open_pdf(pdf_bytes)
+    try:
+        fields = list_filtered_pdf_fields(pdf_bytes, pdf_doc)
+        field_names = [f["field_name"] for f in list_pdf_fields(pdf_bytes, pdf_doc)]
+        index = load_field_index(pdf_bytes, pdf_doc)
+        lines = index["lines"]
+        mapping = fill_pdf_form(fields, user_data, form_name, form_code=form_code, field_names=field_names,
+                                lines=lines)
+        mapping.setdefault("form_fields", {})
+        mapping.setdefault("semantic_fields", {})
+        mapping.setdefault("filled_by", {})
+        mapping.setdefault("unresolved", {})
+        mapping.setdefault("warnings", [])
+        if trades and trades["lots"] and form_code in CAPITAL_GAINS_FORMS:
+            # Totals computed from the lots beat anything the model read off the digest.
+            computed = capital_gains_fields(form_code, trades, lines, index["widgets"])
+            if form_code == "f8949":
+                mapping["warnings"] += form_8949_warnings(trades)
+            mapping["form_fields"].update(computed)
+            mapping["semantic_fields"].update(capital_gains_semantic(trades))
+            mapping["filled_by"].update(dict.fromkeys(computed, "trades"))
+            for name in computed:
+                mapping["unresolved"].pop(name, None)
+    finally:
+        pdf_doc.close()
+    return pdf_bytes, mapping
+
+
+def field_labels(form_code: str) -> dict:
+    """{field name: label} for every field of the stored form; empty when there is no fillable PDF."""
+    pdf_bytes = download_form_bytes(form_code)
+    if not pdf_bytes:
+        return {}
+    return {f["field_name"]: " ".join((f.get("label") or "").split()) for f in list_pdf_fields(pdf_bytes)}
+
+
+def accept_mapping(payload: dict, form_fields: dict, filled_by: dict | None = None) -> int:
+    """
+    A reviewer accepted the mapping of a preview payload, with ``filled_by``
+    saying where each value came from ("reviewer" for values they edited):
+    teach the field memo which record sources fed it (see field_memo.py).
+    Returns the memo's size for the form revision.
+    """
+    labels = field_labels(payload["code"])
+    if not labels:
+        return 0
+    return field_memo.learn(payload["code"], payload["user_data"], form_fields, labels, filled_by=filled_by)
+
+
+@handler("preview")
+def preview(payload: dict):
+    """Step 4 preview: field mapping as the result, the filled PDF as the output."""
+    pdf_bytes, mapping = map_form(payload["code"], payload["form"], payload["user_data"], payload.get("trades"))
+    if pdf_bytes is None:
+        raise ValueError(f"No fillable PDF available for {payload['code']}")
+    return mapping, fill_pdf_form_simple(pdf_bytes, mapping["form_fields"])
+
+
+def _prefetch_form(code: str) -> dict:
+    with labels(form=code):
+        pdf_bytes = download_form_bytes(code)
+        if not pdf_bytes:
+            return {"revision": None, "fields": 0}
+        return {"revision": form_revision(code), "fields": len(list_pdf_fields(pdf_bytes))}
+
+
+def prefetch_forms(codes, max_concurrency: int | None = None) -> dict:
+    """Download every form and build its field index concurrently; {code: {"revision", "fields"}}."""
+    codes = list(dict.fromkeys(codes))
+    if not codes:
+        return {}
+    workers = max(1, min(max_concurrency or PREFETCH_CONCURRENCY, len(codes)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(codes, pool.map(propagate(_prefetch_form), codes)))
+
+
+def _mapping_tokens(preview_payload: dict) -> int:
+    pdf_bytes = download_form_bytes(preview_payload["code"])
+    if not pdf_bytes:
+        return 0
+    fields = list_filtered_pdf_fields(pdf_bytes)
+    field_names = [f["field_name"] for f in list_pdf_fields(pdf_bytes)]
+    return estimate_fill_tokens(fields, preview_payload["user_data"], preview_payload["form"],
+                                form_code=preview_payload["code"], field_names=field_names,
+                                lines=load_field_index(pdf_bytes)["lines"])
+
+
+@handler("prefetch")
+def prefetch(payload: dict):
+    """
+    After Step 3: fetch and index every recommended form, then queue preview
+    jobs in recommended order while their estimated LLM tokens fit the budget.
+    """
+    forms = prefetch_forms([p["code"] for p in payload["previews"]])
+    budget = payload.get("token_budget", PREFETCH_TOKEN_BUDGET)
+    spent, queued, skipped = 0, {}, []
+    for preview_payload in payload["previews"]:
+        if not forms[preview_payload["code"]]["revision"]:
+            continue
+        tokens = _mapping_tokens(preview_payload) if budget > 0 else None
+        if tokens is None or spent + tokens > budget:
+            skipped.append(preview_payload["code"])
+            continue
+        spent += tokens
+        queued[preview_payload["code"]] = db.enqueue_job(
+            "preview", preview_payload, key=job_key("preview", preview_payload), max_age=JOB_TTL)
+    return {"forms": forms, "previews": queued, "skipped": skipped, "estimated_tokens": spent}, None
+
+
+def job_key(kind: str, payload: dict) -> str:
+    # "client" only labels telemetry; the same work for another session is still the same job.
+    keyed = {k: v for k, v in payload.items() if k != "client"}
+    if "code" in payload:
+        # A new form revision or an edited rule table is different work.
+        keyed["versions"] = [form_revision(payload["code"]), rules_version(payload["code"])]
+    return hashlib.sha256(f"{kind}\0{json.dumps(keyed, sort_keys=True)}".encode("utf-8")).hexdigest()
+
+
+def run_job(job_id: int, kind: str, payload: dict) -> None:
+    try:
+        with labels(client=payload.get("client"), form=payload.get("code")), span("job", kind=kind):
+            result, output = HANDLERS[kind](payload)
+    except Exception as e:
+        db.fail_job(job_id, f"{type(e).__name__}: {e}")
+    else:
+        db.finish_job(job_id, result, output)
+
+
+def work(stop: threading.Event, name: str) -> None:
+    """
+    Claim and run jobs until stop is set, sleeping while the queue is empty.
+    Idle workers also purge jobs finished more than JOB_TTL ago.
+    """
+    purged_at = 0.0
+    while not stop.is_set():
+        job = db.claim_job(name, kinds=list(HANDLERS))
+        if job is None:
+            if time.monotonic() - purged_at >= min(JOB_TTL, 60):
+                db.purge_jobs(JOB_TTL)
+                purged_at = time.monotonic()
+            stop.wait(POLL_INTERVAL)
+            continue
+        run_job(*job)
+
+
+class WorkerPool:
+    def __init__(self, workers: int):
+        self.stop = threading.Event()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self.threads = [threading.Thread(target=work, args=(self.stop, f"{prefix}:{n}"), daemon=True)
+                        for n in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.stop.set()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def alive(self) -> bool:
+        """False once stopped or when a worker thread died, so the pool is replaced."""
+        return not self.stop.is_set() and all(thread.is_alive() for thread in self.threads)
+
+
+@resource(check=lambda pool: pool is None or pool.alive(), close=lambda pool: pool and pool.shutdown(wait=False))
+def _worker_pool(workers: int) -> WorkerPool | None:
+    db.init_db()
+    db.requeue_stale_jobs(STALE_AFTER)
+    db.purge_jobs(JOB_TTL)
+    return WorkerPool(workers) if workers > 0 else None
+
+
+def start_workers(workers: int | None = None) -> WorkerPool | None:
+    """Start the in-process pool once; later calls return the running pool (restarted if it died)."""
+    return _worker_pool(JOB_WORKERS if workers is None else workers)
+
+
+def submit(kind: str, payload: dict) -> int:
+    """Queue a job (identical pending work, or work finished within JOB_TTL, is reused) and return its id."""
+    start_workers()
+    return db.enqueue_job(kind, payload, key=job_key(kind, payload), max_age=JOB_TTL)
+
+
+def find(kind: str, payload: dict) -> dict | None:
+    """The job already queued, or finished within JOB_TTL, for this exact work, if any."""
+    start_workers()
+    job_id = db.find_job(job_key(kind, payload), max_age=JOB_TTL)
+    return db.get_job(job_id) if job_id is not None else None
+
+
+def get(job_id: int) -> dict | None:
+    return db.get_job(job_id)
+
+
+def wait(job_id: int, timeout: float) -> dict | None:
+    """Poll until the job is done or failed, or timeout seconds pass; returns the last state."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = db.get_job(job_id)
+        if job is None or job["status"] in ("done", "failed") or time.monotonic() >= deadline:
+            return job
+        time.sleep(min(POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest="command", required=True)
+    work_parser = sub.add_parser("work", help="Run a worker pool until interrupted")
+    work_parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1))
+    sub.add_parser("status", help="Print job counts by status")
+    args = parser.parse_args()
+
+    db.init_db()
+    if args.command == "status":
+        print(json.dumps(db.job_counts(), indent=2))
+        return
+    pool = start_workers(args.workers)
+    print(f"{args.workers} workers on {db.DB_PATH}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main()
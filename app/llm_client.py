@@ -0,0 +1,159 @@
+import os
+import time
+
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from chunking import count_tokens
+from rate_limit import TokenBucket
+from resources import lazy_module, resource
+from telemetry import span
+
+# Account limits to stay under; 0 disables the corresponding bucket.
+LLM_RPM = float(os.getenv("WISECPA_LLM_RPM", "500"))
+LLM_TPM = float(os.getenv("WISECPA_LLM_TPM", "40000"))
+LLM_MAX_ATTEMPTS = int(os.getenv("WISECPA_LLM_MAX_ATTEMPTS", "6"))
+LLM_TIMEOUT = float(os.getenv("WISECPA_LLM_TIMEOUT", "120"))
+LLM_MAX_CONNECTIONS = int(os.getenv("WISECPA_LLM_MAX_CONNECTIONS", "20"))
+# Completion tokens reserved up front, before the real usage is known.
+EXPECTED_COMPLETION_TOKENS = 500
+
+httpx = lazy_module("httpx")
+openai = lazy_module("openai")
+
+
+def _retryable(error: BaseException) -> bool:
+    return isinstance(error, (
+        openai.RateLimitError,
+        openai.APIConnectionError,  # includes APITimeoutError
+        openai.InternalServerError,
+    ))
+
+
+class LLMError(Exception):
+    """The model call failed after retries, or with a non-retryable error."""
+
+
+class LLMRateLimitError(LLMError):
+    """Still rate limited (HTTP 429) after every retry."""
+
+
+class LLMUnavailableError(LLMError):
+    """Connection failures, timeouts or 5xx responses outlasted the retries."""
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets that every call must clear."""
+
+    def __init__(self, rpm: float | None, tpm: float | None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def acquire(self, estimated_tokens: int) -> None:
+        if self.requests is not None:
+            self.requests.acquire()
+        if self.tokens is not None:
+            self.tokens.acquire(estimated_tokens)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct the token bucket once the response reports real usage."""
+        if self.tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+
+_limiter = RateLimiter(LLM_RPM, LLM_TPM)
+
+
+@resource(check=lambda client: not client.is_closed(), close=lambda client: client.close(), warm=())
+def get_client():
+    """Process-wide OpenAI client over a pooled HTTP transport; SDK retries are off, tenacity owns them."""
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                            max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        timeout=LLM_TIMEOUT,
+    )
+    return openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=0)
+
+
+def set_rate_limits(rpm: float | None = None, tpm: float | None = None) -> None:
+    """Replace the shared limiter, e.g. from the batch CLI. None keeps the env default; 0 disables a bucket."""
+    global _limiter
+    _limiter = RateLimiter(LLM_RPM if rpm is None else rpm, LLM_TPM if tpm is None else tpm)
+
+
+@retry(
+    retry=retry_if_exception(_retryable),
+    wait=wait_random_exponential(multiplier=1, max=60),
+    stop=stop_after_attempt(LLM_MAX_ATTEMPTS),
+    reraise=True,
+)
+def _create(limiter: RateLimiter, estimated_tokens: int, **kwargs):
+    limiter.acquire(estimated_tokens)
+    response = get_client().chat.completions.create(**kwargs)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        limiter.settle(estimated_tokens, usage.total_tokens)
+    return response
+
+
+def chat_completion(messages: list[dict], model: str, **kwargs):
+    """
+    Rate-limited chat completion with exponential backoff and jitter on 429/5xx
+    and connection errors. Raises an LLMError subclass instead of returning
+    error text.
+    """
+    estimated = sum(count_tokens(m.get("content") or "", model) for m in messages) + EXPECTED_COMPLETION_TOKENS
+    try:
+        with span("llm", model=model) as s:
+            response = _create(_limiter, estimated, model=model, messages=messages, **kwargs)
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                s.record_usage(model, usage.prompt_tokens, usage.completion_tokens)
+            return response
+    except openai.RateLimitError as e:
+        raise LLMRateLimitError(f"rate limited by the model API: {e}") from e
+    except (openai.APIConnectionError, openai.InternalServerError) as e:
+        raise LLMUnavailableError(f"model API unavailable: {e}") from e
+    except openai.OpenAIError as e:
+        raise LLMError(f"model request failed: {e}") from e
+
+
+@retry(
+    retry=retry_if_exception(_retryable),
+    wait=wait_random_exponential(multiplier=1, max=60),
+    stop=stop_after_attempt(LLM_MAX_ATTEMPTS),
+    reraise=True,
+)
+def _open_stream(limiter: RateLimiter, estimated_tokens: int, **kwargs):
+    limiter.acquire(estimated_tokens)
+    return get_client().chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+
+
+def chat_completion_stream(messages: list[dict], model: str, **kwargs):
+    """
+    Streaming variant of chat_completion: yields content deltas as they arrive.
+    Retries only cover opening the stream; a failure mid-stream raises LLMError.
+    """
+    estimated = sum(count_tokens(m.get("content") or "", model) for m in messages) + EXPECTED_COMPLETION_TOKENS
+    limiter = _limiter
+    try:
+        with span("llm", model=model, stream=True) as s:
+            stream = _open_stream(limiter, estimated, model=model, messages=messages, **kwargs)
+            for chunk in stream:
+                if chunk.usage is not None:
+                    limiter.settle(estimated, chunk.usage.total_tokens)
+                    s.record_usage(model, chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if "first_token_s" not in s.attrs:
+                        s.set(first_token_s=round(time.time() - s.start, 6))
+                    yield chunk.choices[0].delta.content
+    except openai.RateLimitError as e:
+        raise LLMRateLimitError(f"rate limited by the model API: {e}") from e
+    except (openai.APIConnectionError, openai.InternalServerError) as e:
+        raise LLMUnavailableError(f"model API unavailable: {e}") from e
+    except openai.OpenAIError as e:
+        raise LLMError(f"model request failed: {e}") from e
@@ -1,13 +1,25 @@
+from __future__ import annotations
+
 import streamlit as st
-import pandas as pd
 import re
 from io import BytesIO
-from ocr_utils import extract_text_from_file
-from ai_engine import suggest_deductions, recommend_forms, fill_pdf_form
-from fpdf import FPDF
+from extraction_cache import get_extraction_cache
+from chunking import join_documents
 from irs_forms import download_form_bytes
-from pdf_filler import list_pdf_fields, fill_pdf_form_simple
-from ocr_utils import filter_pdf_fields
+from pdf_filler import fill_pdf_form_simple, fill_return
+from capital_gains import CAPITAL_GAINS_FORMS
+import jobs
+import sessions
+from resources import health as resource_health, lazy_module, warm_up
+from settings import env_flag
+from telemetry import get_recorder, set_labels
+
+# pandas and fpdf are only needed once there is something to show; the first
+# page renders without them while warm_up() loads the heavy modules and the
+# pooled clients in the background, once per process.
+pd = lazy_module("pandas")
+fpdf = lazy_module("fpdf")
+warm_up()
 
 st.set_page_config(page_title="WiseCPA – AI Tax Assistant", layout="wide")
 
@@ -25,6 +37,26 @@ uploaded_files = st.file_uploader(
     accept_multiple_files=True,
 )
 
+if "client_id" not in st.session_state:
+    # The id lives in the URL (?client=...), so a refresh reopens the stored session.
+    # It is the only key to the client's documents, hence an unguessable token.
+    requested = st.query_params.get("client")
+    st.session_state.client_id = requested if sessions.valid_client_id(requested) else sessions.new_client_id()
+    st.query_params["client"] = st.session_state.client_id
+    restored = sessions.session_state(st.session_state.client_id)
+    if restored["deductions"]:
+        st.session_state.step2_deductions = restored["deductions"]
+    st.session_state.recommended_forms_ai = restored["forms"]
+    st.session_state.filled_forms = {}
+    for code, mapping in restored["mappings"].items():
+        blank_pdf = download_form_bytes(code)
+        if blank_pdf:
+            st.session_state.filled_forms[code] = {"pdf": blank_pdf, "fields": mapping["form_fields"]}
+        else:
+            st.warning(f"Form {code} could not be downloaded; preview it again to include it in the complete return.")
+# Every span recorded while this rerun runs is attributed to this client.
+set_labels(client=sessions.client_alias(st.session_state.client_id))
+
 if "recommended_forms_ai" not in st.session_state:
     st.session_state.recommended_forms_ai = []
 if "auto_filled_data" not in st.session_state:
@@ -33,6 +65,8 @@ if "downloaded_pdf" not in st.session_state:
     st.session_state.downloaded_pdf = None
 if "filled_pdf" not in st.session_state:
     st.session_state.filled_pdf = None
+if "filled_forms" not in st.session_state:
+    st.session_state.filled_forms = {}  # form code -> blank PDF bytes + field map, for the merged return
 
 # === Helpers ===
 def normalize_label(label: str) -> str:
@@ -47,7 +81,7 @@ def download_csv_or_pdf(form_name, df, file_format):
     if file_format == "CSV":
         df.to_csv(buffer, index=False)
     elif file_format == "PDF":
-        pdf = FPDF()
+        pdf = fpdf.FPDF()
         pdf.add_page()
         pdf.set_font("Arial", "B", 14)
         pdf.cell(0, 10, f"Worksheet: {form_name}", ln=True)
@@ -58,9 +92,63 @@ def download_csv_or_pdf(form_name, df, file_format):
     buffer.seek(0)
     return buffer
 
-if uploaded_files:
-    st.success(f"✔ {len(uploaded_files)} documents uploaded successfully.")
-    extracted_text = "\n".join([extract_text_from_file(file) for file in uploaded_files])
+def render_cache_stats():
+    stats = get_extraction_cache().stats()
+    with st.sidebar.expander("📊 Extraction cache"):
+        st.metric("Hit rate", f"{stats['hit_rate']:.0%}")
+        st.metric("Bytes saved", f"{stats['bytes_saved'] / 1024:,.0f} KiB")
+        st.caption(f"{stats['hits']} hits ({stats['disk_hits']} from disk) · "
+                   f"{stats['misses']} misses · {stats['entries']} in memory")
+
+def render_metrics():
+    recorder = get_recorder()
+    # The recorder is shared by every session; show only this client's spans.
+    client = sessions.client_alias(st.session_state.client_id)
+    with st.sidebar.expander("⏱ Pipeline metrics (admin)"):
+        by = st.selectbox("Group by", ["stage", "form"], key="metrics_group")
+        keys = ("stage",) if by == "stage" else (by, "stage")
+        rows = recorder.aggregate(keys, client=client)
+        st.caption("Pooled resources")
+        st.dataframe(pd.DataFrame(resource_health()), use_container_width=True, hide_index=True)
+        if not rows:
+            st.caption("No spans recorded yet.")
+            return
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        st.download_button("⬇️ Prometheus text", recorder.to_prometheus(client), file_name="wisecpa_metrics.prom",
+                           mime="text/plain")
+        st.download_button("⬇️ Spans (JSONL)", recorder.to_jsonl(client), file_name="wisecpa_spans.jsonl",
+                           mime="application/x-ndjson")
+
+PREVIEW_WAIT_SECONDS = 120
+
+def preview_payload(form: dict, user_data: str) -> dict:
+    """Step 4 preview job for one recommended form; identical payloads share a job."""
+    return {"code": form["code"], "form": form["form"], "user_data": user_data,
+            "trades": trades if form["code"] in CAPITAL_GAINS_FORMS else None,
+            "client": sessions.client_alias(st.session_state.client_id)}
+
+client_id = st.session_state.client_id
+# Only documents this client has not stored before are extracted.
+documents = sessions.extract_documents(client_id, uploaded_files) if uploaded_files else sessions.stored_documents(client_id)
+
+if documents:
+    if uploaded_files:
+        st.success(f"✔ {len(uploaded_files)} documents uploaded successfully.")
+    else:
+        st.info(f"↺ Restored {len(documents)} stored documents for client {client_id}. "
+                "Upload the packet again to change it; unchanged documents are not re-analyzed.")
+    extracted_text = join_documents([d["text"] for d in documents])
+    packet = sessions.packet_hash(documents)
+    if st.session_state.get("packet") not in (None, packet):
+        # Forms filled from the previous upload set must not reach the merged return.
+        st.session_state.filled_forms = {}
+        st.session_state.filled_pdf = None
+        st.session_state.pop("preview_review", None)
+    st.session_state.packet = packet
+    trades = sessions.client_trades(client_id, uploaded_files)
+    render_cache_stats()
+    if env_flag("WISECPA_ADMIN_PANEL"):
+        render_metrics()
 
     tabs = st.tabs([
         "Step 2: Deductions",
@@ -73,16 +161,17 @@ if uploaded_files:
         st.subheader("✅ Step 2: IRS-Eligible Deductions")
         if st.button("Generate Deductions"):
             try:
-                with st.spinner("Analyzing your tax documents... This may take few moments"):
-                    raw = suggest_deductions(extracted_text)
-                lines = [line.strip() for line in raw.split("\n") if line.strip()]
-
                 st.markdown("""
 Based on the analysis of the uploaded documents, the following IRS-eligible deduction-related fields were identified:
 """)
-
-                deduced_table = pd.DataFrame([[i+1, normalize_label(line)] for i, line in enumerate(lines)], columns=["#", "Deduction"])
-                st.dataframe(deduced_table, use_container_width=True)
+                table = st.empty()
+                lines = []
+                with st.spinner("Analyzing your tax documents... This may take few moments"):
+                    # Rows appear as soon as each line of the model's answer is complete.
+                    for line in sessions.iter_client_deductions(client_id, documents):
+                        lines.append(line)
+                        deduced_table = pd.DataFrame([[i+1, normalize_label(l)] for i, l in enumerate(lines)], columns=["#", "Deduction"])
+                        table.dataframe(deduced_table, use_container_width=True)
                 st.session_state.step2_deductions = lines
             except Exception as e:
                 st.error(f"Error generating deductions: {e}")
@@ -91,16 +180,19 @@ Based on the analysis of the uploaded documents, the following IRS-eligible dedu
         st.subheader("📑 Step 3: IRS Recommended Forms")
         if st.button("Get Form Suggestions"):
             try:
-                with st.spinner("Analyzing deductions for relevant IRS forms..."):
-                    ai_deductions = st.session_state.get('step2_deductions', [])
-                    if ai_deductions:
-                        forms = recommend_forms(ai_deductions)
-                    
-                if isinstance(forms, dict):
-                    forms = [forms]
+                forms = []
+                ai_deductions = st.session_state.get('step2_deductions', [])
+                if ai_deductions:
+                    with st.spinner("Analyzing deductions for relevant IRS forms..."):
+                        for f in sessions.iter_client_forms(client_id, ai_deductions):
+                            forms.append(f)
+                            st.markdown(f"**{f['form']}** – {f.get('desc','')}")
                 st.session_state.recommended_forms_ai = forms
-                for f in forms:
-                    st.markdown(f"**{f['form']}** – {f.get('desc','')}")
+                # Download and index every recommended form now, and map as many as the
+                # prefetch token budget allows, so Step 4 finds the work already done.
+                previews = [preview_payload(f, extracted_text) for f in forms if f.get("code")]
+                if previews:
+                    jobs.submit("prefetch", {"previews": previews})
             except Exception as e:
                 st.error(f"Form recommendation failed: {e}")
 
@@ -109,39 +201,99 @@ Based on the analysis of the uploaded documents, the following IRS-eligible dedu
         form_options = [f["form"] for f in st.session_state.recommended_forms_ai]
         if form_options:
             selected = st.selectbox("Select IRS Form", form_options)
+            selected_form_data = next((f for f in st.session_state.recommended_forms_ai if f["form"] == selected), None)
+            if selected_form_data and selected_form_data.get("code"):
+                prefetched = jobs.find("preview", preview_payload(selected_form_data, extracted_text))
+                if prefetched:
+                    st.caption("✔ Preview ready" if prefetched["status"] == "done" else f"Preview {prefetched['status']} in the background")
             if st.button("Generate Preview"):
                 try:
-                    with st.spinner("Downloading form and filling with your data..."):
-                        selected_form_data = next((f for f in st.session_state.recommended_forms_ai if f["form"] == selected), None)
-                        
-                        if selected_form_data and "code" in selected_form_data:
-                            form_code = selected_form_data["code"]
-                            form_desc = selected_form_data.get("desc", "")
-                            
-                            pdf_bytes = download_form_bytes(form_code)
-                            
-                            if pdf_bytes:
-                                user_data = extracted_text
-                                pdf_fields = list_pdf_fields(pdf_bytes)
-                                filtered_pdf_fields = filter_pdf_fields(pdf_fields)
-                                field_mapping = fill_pdf_form(filtered_pdf_fields, user_data, selected)
-                                semantic_fields = field_mapping.get("semantic_fields", {})
-                                form_fields = field_mapping.get("form_fields", {})
-                                filled_pdf_bytes = fill_pdf_form_simple(pdf_bytes, form_fields)
-                                if semantic_fields:
-                                    st.subheader("Extracted Data Summary")                                    
-                                    semantic_data = []
-                                    for field_name, value in semantic_fields.items():
-                                        semantic_data.append([field_name, value])
-                                    
-                                    if semantic_data:
-                                        semantic_df = pd.DataFrame(semantic_data, columns=["Field", "Value"])
-                                        st.dataframe(semantic_df, use_container_width=True)                                
-                                st.session_state.filled_pdf = filled_pdf_bytes
-                                st.session_state.form_name = selected
-                                st.session_state.semantic_fields = semantic_fields
+                    if selected_form_data and "code" in selected_form_data:
+                        form_code = selected_form_data["code"]
+                        # Reuses the job queued after Step 3 when the documents are unchanged.
+                        payload = preview_payload(selected_form_data, extracted_text)
+                        job_id = jobs.submit("preview", payload)
+                        with st.spinner("Downloading form and filling with your data..."):
+                            job = jobs.wait(job_id, PREVIEW_WAIT_SECONDS)
+
+                        if job["status"] == "failed":
+                            st.error(f"Error processing form: {job['error']}")
+                        elif job["status"] != "done":
+                            st.info(f"Preview job #{job_id} is still {job['status']}; click Generate Preview again to check.")
+                        else:
+                            semantic_fields = job["result"].get("semantic_fields", {})
+                            form_fields = job["result"].get("form_fields", {})
+                            if semantic_fields:
+                                st.subheader("Extracted Data Summary")
+                                semantic_data = []
+                                for field_name, value in semantic_fields.items():
+                                    semantic_data.append([field_name, value])
+
+                                if semantic_data:
+                                    semantic_df = pd.DataFrame(semantic_data, columns=["Field", "Value"])
+                                    st.dataframe(semantic_df, use_container_width=True)
+                            st.session_state.filled_pdf = job["output"]
+                            st.session_state.form_name = selected
+                            st.session_state.semantic_fields = semantic_fields
+                            # The blank form is in the local store already; the worker downloaded it.
+                            blank_pdf = download_form_bytes(form_code)
+                            if blank_pdf:
+                                st.session_state.filled_forms[form_code] = {"pdf": blank_pdf, "fields": form_fields}
+                            else:
+                                st.session_state.filled_forms.pop(form_code, None)
+                                st.warning(f"Form {form_code} is no longer available; it is left out of the complete return.")
+                            sessions.save_mapping(client_id, form_code, documents, form_fields, semantic_fields)
+                            st.session_state.preview_review = {
+                                "payload": payload, "form_fields": form_fields,
+                                "filled_by": job["result"].get("filled_by", {}),
+                                "unresolved": job["result"].get("unresolved", {}),
+                                "warnings": job["result"].get("warnings", []),
+                            }
                 except Exception as e:
                     st.error(f"Error processing form: {e}")
+            review = st.session_state.get("preview_review")
+            if review and selected_form_data and review["payload"]["code"] == selected_form_data.get("code"):
+                form_code = review["payload"]["code"]
+                for warning in review.get("warnings", []):
+                    st.warning(warning)
+                if review["unresolved"]:
+                    st.warning(f"The AI gave no usable answer for {len(review['unresolved'])} field(s); "
+                               "they are left blank: " + "; ".join(review["unresolved"].values()))
+                st.subheader("Review Mapping")
+                st.caption("Correct or fill in values before accepting; the filled form is updated to match.")
+                labels = jobs.field_labels(form_code)
+                names = list(review["form_fields"]) + [n for n in review["unresolved"] if n not in review["form_fields"]]
+                review_df = pd.DataFrame(
+                    [[labels.get(n) or n, review["form_fields"].get(n, ""), review["filled_by"].get(n, "")] for n in names],
+                    index=names, columns=["Field", "Value", "Filled by"],
+                )
+                edited = st.data_editor(review_df, disabled=["Field", "Filled by"], hide_index=True,
+                                        use_container_width=True, key=f"review_{form_code}")
+                if st.button("✅ Accept Mapping", help="Remember which document boxes fed these fields, "
+                                                      "so later clients get them filled without the AI"):
+                    try:
+                        accepted = {n: str(v).strip() for n, v in edited["Value"].items() if v is not None and str(v).strip()}
+                        # Edited values are the reviewer's own; the memo learns from them like a model answer.
+                        filled_by = {n: review["filled_by"].get(n, "model") if v == review["form_fields"].get(n) else "reviewer"
+                                     for n, v in accepted.items()}
+                        if accepted != review["form_fields"]:
+                            semantic_fields = dict(st.session_state.semantic_fields)
+                            for n in set(accepted) | set(review["form_fields"]):
+                                if accepted.get(n) != review["form_fields"].get(n):
+                                    semantic_fields[labels.get(n) or n] = accepted.get(n, "")
+                            blank_pdf = download_form_bytes(form_code)
+                            if blank_pdf:
+                                st.session_state.filled_pdf = fill_pdf_form_simple(blank_pdf, accepted)
+                                st.session_state.filled_forms[form_code] = {"pdf": blank_pdf, "fields": accepted}
+                            else:
+                                st.warning(f"Form {form_code} could not be downloaded; the filled PDF still shows the previous values.")
+                            st.session_state.semantic_fields = semantic_fields
+                            sessions.save_mapping(client_id, form_code, documents, accepted, semantic_fields)
+                        memoized = jobs.accept_mapping(review["payload"], accepted, filled_by)
+                        review.update(form_fields=accepted, filled_by=filled_by)
+                        st.success(f"Mapping accepted. {memoized} field(s) of this form revision are now filled straight from documents.")
+                    except Exception as e:
+                        st.error(f"Could not save the mapping: {e}")
         else:
             st.warning("No IRS forms suggested. Complete Step 3 first.")
 
@@ -153,8 +305,8 @@ Based on the analysis of the uploaded documents, the following IRS-eligible dedu
             # Dropdown to select download format
             download_format = st.selectbox(
                 "Select Download Format:",
-                ["PDF Form", "CSV Data"],
-                help="Choose between the filled PDF form or extracted data as CSV"
+                ["PDF Form", "CSV Data", "Complete Return (PDF)"],
+                help="Choose between the filled PDF form, extracted data as CSV, or every previewed form merged into one PDF"
             )
             
             # Download button based on selection
@@ -167,6 +319,24 @@ Based on the analysis of the uploaded documents, the following IRS-eligible dedu
                     help="Download the filled tax form with your data"
                 )
                 
+            elif download_format == "Complete Return (PDF)":
+                # Recommended order (1040 first, then schedules), previewed forms only.
+                filled_forms = st.session_state.filled_forms
+                codes = [f["code"] for f in st.session_state.recommended_forms_ai
+                         if filled_forms.get(f.get("code"), {}).get("pdf")]
+                if not codes:
+                    st.warning("No previewed form is available to merge; generate a preview in Step 4 first.")
+                else:
+                    merged = fill_return([(filled_forms[c]["pdf"], filled_forms[c]["fields"]) for c in codes])
+                    st.caption(f"{len(codes)} form(s): {', '.join(codes)}")
+                    st.download_button(
+                        label="⬇️ Download Complete Return",
+                        data=merged,
+                        file_name="complete_return.pdf",
+                        mime="application/pdf",
+                        help="All previewed forms filled and merged into a single PDF"
+                    )
+
             elif download_format == "CSV Data":
                 if hasattr(st.session_state, 'semantic_fields') and st.session_state.semantic_fields:
                     semantic_df = pd.DataFrame([
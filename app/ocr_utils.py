@@ -1,25 +1,267 @@
-import pdfplumber
-import pytesseract
-from PIL import Image
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import re
 from typing import Tuple
 
+from capital_gains import is_trade_csv, summarize_trades, summary_text
+from chunking import PAGE_BREAK
+from extraction_cache import content_hash, expired, get_extraction_cache, prune_cache_dir
+from file_parser import is_csv_upload
+from resources import lazy_module, resource
+from settings import CACHE_DIR, env_flag
+from telemetry import span
+
+fitz = lazy_module("fitz")
+pdfplumber = lazy_module("pdfplumber")
+pytesseract = lazy_module("pytesseract")
+Image = lazy_module("PIL.Image")
+
+# Worker processes used to OCR images and extract PDF pages in parallel.
+OCR_WORKERS = int(os.getenv("WISECPA_OCR_WORKERS", str(os.cpu_count() or 1)))
+# A page whose text layer has fewer alphanumeric characters than this is treated as scanned.
+MIN_TEXT_LAYER_CHARS = int(os.getenv("WISECPA_MIN_TEXT_LAYER_CHARS", "25"))
+# Resolution used to rasterize scanned PDF pages, and the longest side allowed into Tesseract.
+OCR_DPI = int(os.getenv("WISECPA_OCR_DPI", "300"))
+OCR_MAX_SIDE = int(os.getenv("WISECPA_OCR_MAX_SIDE", "3500"))
+OCR_CACHE_DIR = os.getenv("WISECPA_OCR_CACHE_DIR", os.path.join(CACHE_DIR, "ocr"))
+OCR_CACHE_TTL = int(os.getenv("WISECPA_OCR_CACHE_TTL", str(7 * 24 * 3600)))
+OCR_CACHE_MAX_BYTES = int(os.getenv("WISECPA_OCR_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+def _as_stream(data):
+    """Wrap raw bytes/memoryviews in a BytesIO; file-like objects pass through untouched."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return io.BytesIO(data)
+    return data
+
+def _read_upload(uploaded_file) -> bytes:
+    if isinstance(uploaded_file, (bytes, bytearray, memoryview)):
+        return bytes(uploaded_file)
+    if hasattr(uploaded_file, "getvalue"):
+        return uploaded_file.getvalue()
+    data = uploaded_file.read()
+    if hasattr(uploaded_file, "seek"):
+        uploaded_file.seek(0)
+    return data
+
 def extract_text_from_file(uploaded_file):
     if uploaded_file.type == "application/pdf":
         return extract_text_from_pdf(uploaded_file)
+    elif is_csv_upload(uploaded_file):
+        return extract_text_from_csv(uploaded_file)
     else:
         return extract_text_from_image(uploaded_file)
 
+def extract_text_from_csv(uploaded_file):
+    """
+    Brokerage/crypto exports become a Form 8949 / Schedule D digest instead of
+    thousands of rows of prompt text; any other CSV, or one pandas cannot
+    read, is passed through as text.
+    """
+    data = _read_upload(uploaded_file)
+    if is_trade_csv(data):
+        summary = summarize_trades([data])
+        if not summary["unreadable_files"]:
+            return summary_text(summary)
+    return data.decode("utf-8-sig", errors="replace").strip()
+
 def extract_text_from_pdf(uploaded_file):
-    text = ""
-    with pdfplumber.open(uploaded_file) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() or ""
-    return text.strip()
+    data = _read_upload(uploaded_file)
+    pages = []
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        for page_no, page in enumerate(pdf.pages):
+            text = page.extract_text() or ""
+            pages.append(text if has_text_layer(text) else _ocr_pdf_page(data, page_no, text)[0])
+    return _join_pages(pages)
 
 def extract_text_from_image(uploaded_file):
-    image = Image.open(uploaded_file)
-    return pytesseract.image_to_string(image)
+    image = Image.open(_as_stream(uploaded_file))
+    return _ocr_image(image)[0]
+
+def _otsu_threshold(gray: Image.Image) -> int:
+    """Global threshold maximising between-class variance of the grayscale histogram."""
+    hist = gray.histogram()
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    sum_bg = weight_bg = 0
+    best, threshold = -1.0, 127
+    for i, h in enumerate(hist):
+        weight_bg += h
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += i * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, threshold = between, i
+    return threshold
+
+def preprocess_for_ocr(image: Image.Image) -> Image.Image:
+    """Grayscale, downscale oversized scans to OCR_MAX_SIDE and binarize (Otsu) before Tesseract."""
+    gray = image.convert("L")
+    longest = max(gray.size)
+    if longest > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / longest
+        gray = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))),
+                           Image.LANCZOS)
+    threshold = _otsu_threshold(gray)
+    return gray.point(lambda v: 255 if v > threshold else 0, mode="1")
+
+def _ocr_image(image: Image.Image) -> tuple[str, str]:
+    """
+    OCR a PIL image. With WISECPA_OCR_CACHE=1 the result is cached on disk by a
+    hash of the preprocessed pixels, for OCR_CACHE_TTL and within OCR_CACHE_MAX_BYTES.
+    Returns (text, source) where source is "ocr" or "ocr-cache".
+    """
+    prepared = preprocess_for_ocr(image)
+    use_cache = env_flag("WISECPA_OCR_CACHE")
+    digest = hashlib.sha256(
+        f"{prepared.mode}:{prepared.size}".encode() + prepared.tobytes()
+    ).hexdigest()
+    path = os.path.join(OCR_CACHE_DIR, f"{digest}.txt")
+    if use_cache and not expired(path, OCR_CACHE_TTL):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return f.read(), "ocr-cache"
+        except OSError:
+            pass
+
+    try:
+        text = pytesseract.image_to_string(prepared)
+    except pytesseract.TesseractNotFoundError as e:
+        # This exception type cannot be unpickled, which would break the worker pool.
+        raise RuntimeError(str(e)) from None
+    if use_cache:
+        try:
+            os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=OCR_CACHE_DIR, prefix=".tmp-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+        prune_cache_dir(OCR_CACHE_DIR, OCR_CACHE_TTL, OCR_CACHE_MAX_BYTES)
+    return text, "ocr"
+
+def _join_pages(pages: list[str]) -> str:
+    """Join page texts with PAGE_BREAK so later chunking can split on page boundaries."""
+    return PAGE_BREAK.join(p.strip() for p in pages if p.strip())
+
+def has_text_layer(text: str | None) -> bool:
+    return sum(ch.isalnum() for ch in (text or "")) >= MIN_TEXT_LAYER_CHARS
+
+def _ocr_pdf_page(data: bytes, page_no: int, text_layer: str = "") -> tuple[str, str]:
+    """Rasterize one page and OCR it; falls back to the sparse text layer if OCR finds nothing."""
+    doc = fitz.open(stream=data, filetype="pdf")
+    try:
+        pix = doc[page_no].get_pixmap(dpi=OCR_DPI)
+        image = Image.frombytes("RGB" if pix.alpha == 0 else "RGBA", (pix.width, pix.height), pix.samples)
+    finally:
+        doc.close()
+    ocr_text, source = _ocr_image(image)
+    return (ocr_text, source) if ocr_text.strip() else (text_layer, "text")
+
+def extract_pdf_page(data: bytes, page_no: int) -> tuple[str, str]:
+    """
+    Text of one PDF page and how it was obtained: "text" when the page has a
+    usable text layer, otherwise the page is rasterized and OCR'd ("ocr"/"ocr-cache").
+    """
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        text = pdf.pages[page_no].extract_text() or ""
+    if has_text_layer(text):
+        return text, "text"
+    return _ocr_pdf_page(data, page_no, text)
+
+def _extract_pdf_page(data: bytes, page_no: int) -> str:
+    """Process-pool task: text of a single PDF page."""
+    return extract_pdf_page(data, page_no)[0]
+
+def split_pdf_pages(data: bytes) -> list[bytes]:
+    """
+    One single-page PDF per page, so a pool task pickles and parses its own
+    page instead of the whole document.
+    """
+    pages = []
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        if doc.page_count <= 1:
+            return [data] * doc.page_count
+        for page_no in range(doc.page_count):
+            with fitz.open() as single:
+                single.insert_pdf(doc, from_page=page_no, to_page=page_no)
+                pages.append(single.tobytes(garbage=3, deflate=True))
+    return pages
+
+@resource(check=lambda pool: not (pool._broken or pool._shutdown_thread),
+          close=lambda pool: pool.shutdown(wait=False, cancel_futures=True))
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Long-lived process pool per size, replaced once a worker crash breaks it."""
+    return ProcessPoolExecutor(max_workers=workers)
+
+def extract_texts(uploaded_files, max_workers: int | None = None, use_cache: bool = True) -> list[str]:
+    """
+    Extract text from many uploads at once, fanning out one task per PDF page
+    and per image across a process pool. Results come back in upload order,
+    with each PDF's pages kept in document order. Documents already seen (same
+    sha256) are served from the extraction cache and never re-extracted.
+    """
+    cache = get_extraction_cache() if use_cache else None
+    results: list[str | None] = [None] * len(uploaded_files)
+    pending: dict[str, list[int]] = {}  # digest -> upload indexes still to extract
+    tasks = []  # (digest, callable, args)
+    for idx, uploaded_file in enumerate(uploaded_files):
+        data = _read_upload(uploaded_file)
+        digest = content_hash(data)
+        if digest in pending:
+            pending[digest].append(idx)
+            continue
+        cached = cache.get(digest, len(data)) if cache is not None else None
+        if cached is not None:
+            results[idx] = cached
+            continue
+        pending[digest] = [idx]
+        if uploaded_file.type == "application/pdf":
+            tasks.extend((digest, _extract_pdf_page, (page, 0)) for page in split_pdf_pages(data))
+        elif is_csv_upload(uploaded_file):
+            tasks.append((digest, extract_text_from_csv, (data,)))
+        else:
+            tasks.append((digest, extract_text_from_image, (data,)))
+
+    workers = max(1, max_workers or OCR_WORKERS)
+    with span("ocr", documents=len(pending), tasks=len(tasks), cached=len(uploaded_files) - sum(map(len, pending.values()))):
+        if workers == 1 or len(tasks) <= 1:
+            outputs = [fn(*args) for _, fn, args in tasks]
+        else:
+            # The pool keeps a fixed size; shrinking it per call would tear it
+            # down under other threads that are still using it.
+            pool = _get_pool(workers)
+            futures = [pool.submit(fn, *args) for _, fn, args in tasks]
+            try:
+                outputs = [f.result() for f in futures]
+            except BrokenProcessPool:
+                # Shut the broken pool down now so its surviving workers exit;
+                # the next call builds a fresh one.
+                _get_pool.discard(workers)
+                raise
+
+    per_file: dict[str, list[str]] = {digest: [] for digest in pending}
+    for (digest, _, _), text in zip(tasks, outputs):
+        per_file[digest].append(text)
+    for digest, pages in per_file.items():
+        text = _join_pages(pages)
+        if cache is not None:
+            cache.put(digest, text)
+        for idx in pending[digest]:
+            results[idx] = text
+    return results
 
 
 
@@ -0,0 +1,75 @@
+import threading
+import time
+
+from chunking import get_encoding
+
+# Default model prices in USD per 1K tokens: (input, output). Update as needed.
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+}
+DEFAULT_PRICES = MODEL_PRICES["gpt-4"]
+
+
+def usage_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """USD cost of one request at the model's input and output rates."""
+    input_price, output_price = MODEL_PRICES.get(model, DEFAULT_PRICES)
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1000
+
+
+class OpenAIUsageTracker:
+    def __init__(self, model="gpt-4", price_per_1k_tokens=None, output_price_per_1k_tokens=None):
+        self.model = model
+        input_price, output_price = MODEL_PRICES.get(model, DEFAULT_PRICES)
+        self.price_per_1k_tokens = price_per_1k_tokens or input_price
+        self.output_price_per_1k_tokens = output_price_per_1k_tokens or output_price
+        self.total_tokens = 0
+        self.total_cost = 0.0
+        self.log = []
+        self._lock = threading.Lock()
+
+    def _num_tokens(self, text: str) -> int:
+        return len(get_encoding(self.model).encode(text))
+
+    def track(self, prompt: str = "", response: str = "", extra_metadata=None,
+              prompt_tokens: int | None = None, completion_tokens: int | None = None):
+        """
+        Record one request. Pass the API's ``usage`` counts when available;
+        otherwise both sides are counted locally with tiktoken.
+        """
+        if prompt_tokens is None:
+            prompt_tokens = self._num_tokens(prompt)
+        if completion_tokens is None:
+            completion_tokens = self._num_tokens(response)
+        total = prompt_tokens + completion_tokens
+        cost = (prompt_tokens * self.price_per_1k_tokens + completion_tokens * self.output_price_per_1k_tokens) / 1000
+
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "model": self.model,
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": completion_tokens,
+            "total_tokens": total,
+            "cost": cost,
+            "extra": extra_metadata or {}
+        }
+        with self._lock:
+            self.log.append(entry)
+            self.total_tokens += total
+            self.total_cost += cost
+
+        return entry
+
+    def summary(self):
+        return {
+            "model": self.model,
+            "total_requests": len(self.log),
+            "total_tokens": self.total_tokens,
+            "total_cost_usd": round(self.total_cost, 5)
+        }
+
+    def print_audit_log(self):
+        for item in self.log:
+            print(f"[{item['timestamp']}] {item['model']} - {item['total_tokens']} tokens → ${item['cost']:.4f}")
@@ -1,83 +1,378 @@
+from __future__ import annotations
+
 import io
-import fitz
+import hashlib
+import json
 import tempfile
 import os
-import tempfile, os
-from typing import Any, Dict, List
-import fitz
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple, Union
+
+from ocr_utils import filter_pdf_fields
+from resources import lazy_module
+from settings import CACHE_DIR
+from telemetry import span, traced
+
+fitz = lazy_module("fitz")
+
+FIELD_INDEX_DIR = os.getenv("WISECPA_FIELD_INDEX_DIR", os.path.join(CACHE_DIR, "field_index"))
+# Bump when the index layout or label heuristics change so stale files are rebuilt.
+FIELD_INDEX_VERSION = 3
+# Side of the square grid cells (PDF points) used to bucket words for label lookup.
+WORD_GRID_CELL = 48.0
+# Printed line numbers such as "7", "1b" or "25a".
+LINE_NUMBER_RE = re.compile(r"\d{1,2}[a-z]?")
+
+_index_memo: Dict[str, Dict[str, Any]] = {}
+_by_name_memo: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+_index_lock = threading.Lock()
+
+# Anything PyMuPDF can open without touching disk, or an already parsed document.
+PdfSource = Union[bytes, bytearray, memoryview, "fitz.Document"]
 
-def list_pdf_fields(pdf_bytes: bytes) -> List[Dict[str, Any]]:
-    """Return a list of dicts with unique widget info: field_name, label"""
-    out: List[Dict[str, Any]] = []
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(pdf_bytes); tmp.flush()
-        fp = tmp.name
 
+def open_pdf(pdf: PdfSource) -> Tuple[fitz.Document, bool]:
+    """
+    Open a PDF from memory. Returns (doc, owned): when the caller passed a
+    parsed document it is reused as-is and owned is False, so it must not be closed here.
+    """
+    if isinstance(pdf, fitz.Document):
+        return pdf, False
+    return fitz.open(stream=bytes(pdf) if isinstance(pdf, memoryview) else pdf, filetype="pdf"), True
+
+
+class _WordGrid:
+    """Uniform-grid spatial index over page words, so label search only visits nearby words."""
+
+    def __init__(self, words, cell: float = WORD_GRID_CELL):
+        self.words = words
+        self.cell = cell
+        self.buckets = defaultdict(list)
+        for i, w in enumerate(words):
+            for key in self._cells(w[0], w[1], w[2], w[3]):
+                self.buckets[key].append(i)
+
+    def _cells(self, x0, y0, x1, y1):
+        c = self.cell
+        for gx in range(int(x0 // c), int(x1 // c) + 1):
+            for gy in range(int(y0 // c), int(y1 // c) + 1):
+                yield gx, gy
+
+    def intersecting(self, rect) -> List[str]:
+        """Words intersecting rect, in the order of the underlying word list."""
+        hits = set()
+        for key in self._cells(rect.x0, rect.y0, rect.x1, rect.y1):
+            for i in self.buckets.get(key, ()):
+                if i not in hits and fitz.Rect(self.words[i][:4]).intersects(rect):
+                    hits.add(i)
+        return [self.words[i][4] for i in sorted(hits)]
+
+
+def _extract_widgets(pdf: PdfSource) -> List[Dict[str, Any]]:
+    """Parse every widget on every page into plain dicts (name, label, page, rect, type, xref, on_state for buttons)."""
+    out: List[Dict[str, Any]] = []
+    doc, owned = open_pdf(pdf)
     try:
-        doc = fitz.open(fp)
         for p_idx in range(len(doc)):
             page = doc[p_idx]
-            words = sorted(page.get_text("words"), key=lambda w: (-w[1], w[0]))
             widgets = page.widgets() or []
+            grid = None
             for widget in widgets:
                 wtype = widget.field_type_string.lower()
-                if wtype != "text":
-                    continue
-
-                xref = widget.xref
                 name = widget.field_name or ""
                 alt = getattr(widget, "field_label", None)
                 label = alt if (alt and alt != name) else ""
-                if not label:
-                    r = widget.rect
+                r = widget.rect
+                if not label and wtype == "text":
+                    if grid is None:
+                        words = sorted(page.get_text("words"), key=lambda w: (-w[1], w[0]))
+                        grid = _WordGrid(words)
                     sr = fitz.Rect(r.x0 - r.width * 1.5, r.y0 - 30, r.x1, r.y0)
-                    near = [w[4] for w in words if fitz.Rect(w[:4]).intersects(sr)]
+                    near = grid.intersecting(sr)
                     if near:
                         label = " ".join(near[:7]).strip()
-                key = f"{p_idx+1}-{xref}"
 
-                out.append({
+                entry = {
                     "field_name": name,
                     "label": label,
-                })
-
-        doc.close()
+                    "page": p_idx,
+                    "rect": [r.x0, r.y0, r.x1, r.y1],
+                    "widget_type": wtype,
+                    "xref": widget.xref,
+                }
+                if wtype in ("checkbox", "radiobutton"):
+                    entry["on_state"] = widget.on_state()
+                out.append(entry)
     finally:
-        try: os.unlink(fp)
-        except OSError: pass
+        if owned:
+            doc.close()
 
     return out
 
 
-def fill_pdf_form_simple(pdf_bytes: bytes, fields: dict[str, str]) -> bytes:
-    """Fill PDF form using PyMuPDF (fitz) with visible updates and exact field match."""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(pdf_bytes)
-        tmp.flush()
-        input_path = tmp.name
-
+def _extract_lines(pdf: PdfSource, widgets: List[Dict[str, Any]]) -> Dict[str, List[List[Any]]]:
+    """
+    Map printed line numbers to the text widgets on the same row, left to right:
+    {"1b": [[page, [field_name, ...]], ...]}. A number counts as a line label
+    only when it starts its row (left margin) or is the last word before the
+    row's first widget (right-hand column), so "add lines 1a through 1h"
+    references are ignored.
+    """
+    by_page = defaultdict(list)
+    for w in widgets:
+        if w["widget_type"] == "text":
+            by_page[w["page"]].append(w)
+    lines: Dict[str, List[List[Any]]] = {}
+    doc, owned = open_pdf(pdf)
     try:
-        doc = fitz.open(input_path)
-        black_color = (0, 0, 0)
-        for page in doc:
-            widgets = page.widgets()
-            if not widgets:
+        for p_idx, page_widgets in sorted(by_page.items()):
+            words = doc[p_idx].get_text("words")
+            found: Dict[str, List[str]] = {}
+            for x0, y0, x1, y1, word, *_ in words:
+                if word in found or not LINE_NUMBER_RE.fullmatch(word):
+                    continue
+                row = sorted((w for w in page_widgets
+                              if w["rect"][0] >= x1 and w["rect"][1] < y1 and w["rect"][3] > y0),
+                             key=lambda w: w["rect"][0])
+                if not row:
+                    continue
+                mid = (y0 + y1) / 2
+                same_row = [w for w in words if w[1] <= mid <= w[3]]
+                starts_row = not any(w[2] <= x0 for w in same_row)
+                before_widget = not any(w[0] >= x1 and w[2] <= row[0]["rect"][0] for w in same_row)
+                if starts_row or before_widget:
+                    found[word] = [w["field_name"] for w in row]
+            for number, names in found.items():
+                lines.setdefault(number, []).append([p_idx, names])
+    finally:
+        if owned:
+            doc.close()
+    return lines
+
+
+def build_field_index(pdf_bytes: bytes, doc: fitz.Document | None = None) -> Dict[str, Any]:
+    """Build the field index for a PDF: all widgets, the filtered text-field labels and line rows."""
+    source = doc if doc is not None else pdf_bytes
+    widgets = _extract_widgets(source)
+    text_fields = [{"field_name": w["field_name"], "label": w["label"]}
+                   for w in widgets if w["widget_type"] == "text"]
+    return {
+        "version": FIELD_INDEX_VERSION,
+        "sha256": hashlib.sha256(pdf_bytes).hexdigest(),
+        "widgets": widgets,
+        "filtered_fields": filter_pdf_fields(text_fields),
+        "lines": _extract_lines(source, widgets),
+    }
+
+
+def load_field_index(pdf_bytes: bytes, doc: fitz.Document | None = None) -> Dict[str, Any]:
+    """
+    Return the field index for a PDF, keyed by the sha256 of its bytes.
+    Looked up in memory first, then on disk; built (and persisted) only on a miss,
+    reusing ``doc`` when the caller already has the document open.
+    """
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    index = _index_memo.get(digest)
+    if index is not None:
+        return index
+
+    path = os.path.join(FIELD_INDEX_DIR, f"{digest}.v{FIELD_INDEX_VERSION}.json")
+    # Memory hits are free and frequent; only disk loads and builds are timed.
+    with span("field_index") as s:
+        try:
+            with open(path, encoding="utf-8") as f:
+                index = json.load(f)
+            s.set(source="disk")
+        except (OSError, ValueError):
+            s.set(source="build")
+            index = build_field_index(pdf_bytes, doc)
+            try:
+                os.makedirs(FIELD_INDEX_DIR, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=FIELD_INDEX_DIR, prefix=".tmp-")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(index, f)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass  # read-only filesystem: keep the in-memory copy only
+
+    with _index_lock:
+        _index_memo[digest] = index
+    return index
+
+
+def list_pdf_fields(pdf_bytes: bytes, doc: fitz.Document | None = None) -> List[Dict[str, Any]]:
+    """Return a list of dicts with unique widget info: field_name, label"""
+    return [{"field_name": w["field_name"], "label": w["label"]}
+            for w in load_field_index(pdf_bytes, doc)["widgets"] if w["widget_type"] == "text"]
+
+
+def list_filtered_pdf_fields(pdf_bytes: bytes, doc: fitz.Document | None = None) -> List[Dict[str, Any]]:
+    """Same as filter_pdf_fields(list_pdf_fields(pdf_bytes)), served from the field index."""
+    return [dict(f) for f in load_field_index(pdf_bytes, doc)["filtered_fields"]]
+
+
+def line_fields(pdf_bytes: bytes, line: str, page: int | None = None,
+                doc: fitz.Document | None = None) -> List[str]:
+    """Text fields on the row of a printed line number, left to right (first page with that line unless ``page``)."""
+    for p_idx, names in load_field_index(pdf_bytes, doc)["lines"].get(line, []):
+        if page is None or p_idx == page:
+            return list(names)
+    return []
+
+
+def widget_index(pdf_bytes: bytes, doc: fitz.Document | None = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Field name -> its widget entries (page, xref, rect, ...) from the field index."""
+    index = load_field_index(pdf_bytes, doc)
+    by_name = _by_name_memo.get(index["sha256"])
+    if by_name is None:
+        grouped = defaultdict(list)
+        for w in index["widgets"]:
+            grouped[w["field_name"]].append(w)
+        by_name = dict(grouped)
+        with _index_lock:
+            _by_name_memo[index["sha256"]] = by_name
+    return by_name
+
+
+def _fill_widgets(doc: fitz.Document, by_name: Dict[str, List[Dict[str, Any]]], fields: dict[str, str]) -> int:
+    """Set and redraw only the widgets named in ``fields``; returns how many were touched."""
+    black_color = (0, 0, 0)
+    pages = {}
+    touched = 0
+    for name, value in fields.items():
+        for entry in by_name.get(name, ()):
+            page = pages.get(entry["page"])
+            if page is None:
+                page = pages[entry["page"]] = doc[entry["page"]]
+            widget = page.load_widget(entry["xref"])
+            if widget is None:
                 continue
+            widget.field_value = value
+            widget.text_color = black_color
+            widget.update()
+            touched += 1
+    return touched
 
-            for widget in widgets:
-                field_name = widget.field_name
-                if field_name in fields:
-                    widget.field_value = fields[field_name]
-                    widget.text_color = black_color
-                    widget.update()
 
-        buf = io.BytesIO()
-        doc.save(buf, incremental=False, encryption=fitz.PDF_ENCRYPT_KEEP, deflate=True)
-        doc.close()
-        return buf.getvalue()
+def _save(doc: fitz.Document) -> bytes:
+    buf = io.BytesIO()
+    doc.save(buf, incremental=False, encryption=fitz.PDF_ENCRYPT_KEEP, deflate=True)
+    return buf.getvalue()
+
+
+@traced("pdf_fill", mode="memory")
+def fill_pdf_form_simple(pdf: PdfSource, fields: dict[str, str], pdf_bytes: bytes | None = None) -> bytes:
+    """
+    Fill PDF form using PyMuPDF (fitz) with visible updates and exact field match.
+    Works entirely in memory; a document passed in by the caller is filled in
+    place and left open. When the PDF's bytes are known (passed directly or as
+    ``pdf_bytes`` next to an open document) only the named widgets are loaded,
+    through the field index, instead of walking every widget on every page.
+    """
+    if pdf_bytes is None and not isinstance(pdf, fitz.Document):
+        pdf_bytes = bytes(pdf)
+    doc, owned = open_pdf(pdf)
+    try:
+        if pdf_bytes is not None:
+            _fill_widgets(doc, widget_index(pdf_bytes, doc), fields)
+        else:
+            black_color = (0, 0, 0)
+            for page in doc:
+                widgets = page.widgets()
+                if not widgets:
+                    continue
 
+                for widget in widgets:
+                    field_name = widget.field_name
+                    if field_name in fields:
+                        widget.field_value = fields[field_name]
+                        widget.text_color = black_color
+                        widget.update()
+
+        return _save(doc)
     finally:
+        if owned:
+            doc.close()
+
+
+@traced("pdf_fill", mode="incremental")
+def fill_pdf_file(pdf_bytes: bytes, fields: dict[str, str], path: str) -> None:
+    """
+    Write a filled copy of a form to ``path`` using an incremental save: the
+    original bytes are written once and only the changed widgets are appended,
+    instead of rewriting and recompressing the whole file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_bytes)
+        doc = fitz.open(tmp_path)
         try:
-            os.unlink(input_path)
-        except OSError:
-            pass
+            _fill_widgets(doc, widget_index(pdf_bytes, doc), fields)
+            doc.saveIncr()
+        finally:
+            doc.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+
+
+def _checked(value, on_state) -> bool:
+    v = str(value).strip()
+    return v == on_state or v.lower() in ("yes", "on", "true", "1", "x")
+
+
+def _draw_values(doc: fitz.Document, by_name: Dict[str, List[Dict[str, Any]]], fields: dict[str, str]) -> None:
+    """Print the values into the page content at each widget's rect (the merged return carries no widgets)."""
+    pages = {}
+    for name, value in fields.items():
+        if value is None or str(value) == "":
+            continue
+        for entry in by_name.get(name, ()):
+            page = pages.get(entry["page"])
+            if page is None:
+                page = pages[entry["page"]] = doc[entry["page"]]
+            rect = fitz.Rect(entry["rect"])
+            if entry["widget_type"] in ("checkbox", "radiobutton"):
+                if _checked(value, entry.get("on_state")):
+                    page.insert_textbox(rect, "X", fontsize=max(4.0, rect.height * 0.8),
+                                        fontname="helv", align=fitz.TEXT_ALIGN_CENTER)
+                continue
+            text = str(value)
+            # Amounts read right-aligned, like the printed columns.
+            align = fitz.TEXT_ALIGN_RIGHT if re.fullmatch(r"[\d,.()$-]+", text) else fitz.TEXT_ALIGN_LEFT
+            fontsize = min(10.0, max(4.0, rect.height - 2))
+            while page.insert_textbox(rect, text, fontsize=fontsize, fontname="helv", align=align) < 0 \
+                    and fontsize > 4:
+                fontsize -= 1
+
+
+@traced("pdf_fill", mode="merged")
+def fill_return(forms: List[Tuple[bytes, dict]]) -> bytes:
+    """
+    Fill every form of a return in one pass and merge them into a single PDF.
+    ``forms`` is a list of (pdf_bytes, {field_name: value}) in output order.
+    IRS forms reuse the same field names (topmostSubform[0]...), so one merged
+    AcroForm can't hold them all; values are printed into the page content
+    instead of kept as interactive fields. Forms without PDF bytes (not
+    downloadable) are skipped.
+    """
+    out = fitz.open()
+    try:
+        for pdf_bytes, fields in forms:
+            if not pdf_bytes:
+                continue
+            doc, _ = open_pdf(pdf_bytes)
+            try:
+                _draw_values(doc, widget_index(pdf_bytes, doc), fields)
+                out.insert_pdf(doc)
+            finally:
+                doc.close()
+        return _save(out)
+    finally:
+        out.close()
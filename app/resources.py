@@ -0,0 +1,174 @@
+"""
+Lazy imports and a process-wide pool of long-lived resources.
+
+Heavy third-party modules (the OpenAI SDK, pandas, PyMuPDF, pytesseract, ...)
+are bound with lazy_module() and imported on first attribute access. A
+Streamlit cold start therefore renders the first page without paying for
+code that only later steps use.
+
+Long-lived objects (the OpenAI client, tiktoken encodings, the OCR process
+pool, the job workers, ...) are built through @resource. It follows the
+st.cache_resource pattern without depending on Streamlit, because the batch
+CLI and job workers share these objects too. There is one instance per
+argument tuple, and an instance is rebuilt when its ``check`` reports it
+unhealthy. warm_up() imports the heavy modules and builds the resources
+marked ``warm`` on a background thread, so they are ready before the first
+upload asks for them.
+"""
+import functools
+import importlib
+import threading
+import time
+
+from settings import env_flag
+
+# Imported by warm_up() in this order: the ones every analysis needs first.
+WARM_MODULES = ("openai", "tiktoken", "jsonschema", "pandas", "fitz", "pdfplumber", "pytesseract", "PIL.Image")
+
+_MISSING = object()
+_resources = {}
+_warm_lock = threading.Lock()
+_warm_thread = None
+
+
+class LazyModule:
+    """Stand-in for a module that imports it on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            # import_module holds the module's import lock, so racing threads import once.
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+class Resource:
+    """A @resource function: cached instances plus build and health statistics."""
+
+    def __init__(self, fn, check=None, close=None, warm=None):
+        self.fn = fn
+        self.check = check
+        self.close = close
+        self.warm = warm
+        self.instances = {}
+        self.builds = 0
+        self.rebuilds = 0
+        self.build_seconds = 0.0
+        self._lock = threading.RLock()
+        functools.update_wrapper(self, fn)
+
+    def __call__(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        with self._lock:
+            value = self.instances.get(key, _MISSING)
+            if value is not _MISSING and not self.healthy(value):
+                self.rebuilds += 1
+                self._dispose(self.instances.pop(key))
+                value = _MISSING
+            if value is _MISSING:
+                start = time.perf_counter()
+                value = self.instances[key] = self.fn(*args, **kwargs)
+                self.builds += 1
+                self.build_seconds += time.perf_counter() - start
+            return value
+
+    def healthy(self, value) -> bool:
+        if self.check is None:
+            return True
+        try:
+            return bool(self.check(value))
+        except Exception:
+            return False
+
+    def _dispose(self, value) -> None:
+        if self.close is not None:
+            try:
+                self.close(value)
+            except Exception:
+                pass
+
+    def discard(self, *args, **kwargs) -> None:
+        """Drop (and close) the instance built for these arguments, if any."""
+        with self._lock:
+            value = self.instances.pop((args, tuple(sorted(kwargs.items()))), _MISSING)
+        if value is not _MISSING:
+            self._dispose(value)
+
+    def clear(self) -> None:
+        """Drop (and close) every instance; the next call builds afresh."""
+        with self._lock:
+            instances, self.instances = self.instances, {}
+        for value in instances.values():
+            self._dispose(value)
+
+    def status(self) -> dict:
+        with self._lock:
+            instances = list(self.instances.values())
+        return {"resource": f"{self.fn.__module__}.{self.fn.__name__}", "instances": len(instances),
+                "healthy": sum(self.healthy(v) for v in instances), "builds": self.builds,
+                "rebuilds": self.rebuilds, "build_s": round(self.build_seconds, 3)}
+
+
+def resource(check=None, close=None, warm=None):
+    """
+    Decorator: build fn(*args) once per process and argument tuple. A cached
+    value for which ``check(value)`` is false (or raises) is closed with
+    ``close(value)`` and rebuilt. ``warm`` is an argument tuple warm_up()
+    builds ahead of time, e.g. ``()`` for a resource without arguments.
+    """
+    def decorate(fn):
+        pooled = Resource(fn, check, close, warm)
+        _resources[pooled.status()["resource"]] = pooled
+        return pooled
+    return decorate
+
+
+def warm_up(modules=WARM_MODULES, background: bool = True):
+    """
+    Import ``modules`` and build every warm resource, once per process; with
+    WISECPA_WARM_START=0 nothing happens. In the background by default,
+    returning the thread, so a cold start does not wait on it.
+    """
+    global _warm_thread
+    if not env_flag("WISECPA_WARM_START", default=True):
+        return None
+    with _warm_lock:
+        if _warm_thread is not None:
+            return _warm_thread
+
+        def run():
+            for name in modules:
+                try:
+                    importlib.import_module(name)
+                except ImportError:
+                    pass
+            for pooled in list(_resources.values()):
+                if pooled.warm is not None:
+                    try:
+                        pooled(*pooled.warm)
+                    except Exception:
+                        pass  # the first real use reports the error
+
+        _warm_thread = threading.Thread(target=run, name="wisecpa-warm-up", daemon=True)
+        if background:
+            _warm_thread.start()
+        else:
+            _warm_thread.run()
+        return _warm_thread
+
+
+def health() -> list[dict]:
+    """One row per registered resource: instances, how many pass their check, builds and rebuilds."""
+    return [pooled.status() for pooled in _resources.values()]
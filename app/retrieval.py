@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+from chunking import DOCUMENT_BREAK, PAGE_BREAK, count_tokens
+from resources import lazy_module
+
+np = lazy_module("numpy")
+
+# Passages are built from whole lines, up to roughly this many words each.
+PASSAGE_WORDS = int(os.getenv("WISECPA_PASSAGE_WORDS", "60"))
+
+_TERM_RE = re.compile(r"[a-z0-9]+(?:[\-\.][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from if in is it of on or the this to was were with you your "
+    "see enter line lines amount form instructions check here".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TERM_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def split_passages(text: str, max_words: int = PASSAGE_WORDS) -> list[str]:
+    """Cut text into passages of whole lines, never crossing a page or document boundary."""
+    passages = []
+    for page in text.replace(DOCUMENT_BREAK, PAGE_BREAK).split(PAGE_BREAK):
+        current, words = [], 0
+        for line in page.split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            n = len(line.split())
+            if current and words + n > max_words:
+                passages.append("\n".join(current))
+                current, words = [], 0
+            current.append(line)
+            words += n
+        if current:
+            passages.append("\n".join(current))
+    return passages
+
+
+class PassageIndex:
+    """
+    BM25 index over the passages of one client's extracted text.
+    Built once per fill; each field batch then queries it with its labels.
+    """
+
+    def __init__(self, text: str, k1: float = 1.5, b: float = 0.75):
+        self.passages = split_passages(text)
+        self.k1, self.b = k1, b
+        lengths = []
+        postings = defaultdict(lambda: ([], []))  # term -> (passage ids, term frequencies)
+        for pid, passage in enumerate(self.passages):
+            terms = tokenize(passage)
+            lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                ids, tfs = postings[term]
+                ids.append(pid)
+                tfs.append(tf)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        avg = self.lengths.mean() if len(lengths) else 0.0
+        self.norm = k1 * (1 - b + b * self.lengths / avg) if avg else np.full(len(lengths), k1)
+        n = len(self.passages)
+        self.postings = {
+            term: (np.asarray(ids), np.asarray(tfs, dtype=np.float64),
+                   math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5)))
+            for term, (ids, tfs) in postings.items()
+        }
+        self.passage_tokens = [count_tokens(p) for p in self.passages]
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.passages))
+        for term, qtf in Counter(tokenize(query)).items():
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            ids, tfs, idf = posting
+            scores[ids] += qtf * idf * tfs * (self.k1 + 1) / (tfs + self.norm[ids])
+        return scores
+
+    def context(self, query: str, max_tokens: int) -> str:
+        """Best-scoring passages that fit in max_tokens, returned in document order."""
+        scores = self.scores(query)
+        chosen, used = [], 0
+        for pid in np.argsort(-scores, kind="stable"):
+            if scores[pid] <= 0:
+                break
+            cost = self.passage_tokens[pid] + 1
+            if used + cost > max_tokens:
+                continue
+            chosen.append(int(pid))
+            used += cost
+        return "\n".join(self.passages[pid] for pid in sorted(chosen))
@@ -0,0 +1,163 @@
+"""
+Persistent client sessions with incremental re-analysis.
+
+A client's documents (by content hash), per-document deductions, form
+recommendations, trade summary and field mappings are stored in SQLite
+(db.py), so a refresh restores the session and a changed upload set only
+recomputes what depends on the change: new documents are extracted and
+analysed on their own, forms are re-recommended only when the merged
+deduction list changed, and a form is re-mapped only when its inputs did.
+
+The client id in the URL is the only key to a stored packet (names, SSNs),
+so it is a random 128-bit token rather than anything guessable.
+"""
+import hashlib
+import json
+import re
+import secrets
+
+import db
+from ai_engine import iter_document_deductions, iter_forms, merge_deductions
+from capital_gains import summarize_uploads
+from extraction_cache import content_hash, get_extraction_cache
+from ocr_utils import extract_texts
+
+
+_CLIENT_ID_RE = re.compile(r"[A-Za-z0-9_-]{22,64}")
+
+
+def _hash(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def new_client_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def client_alias(client_id: str) -> str:
+    """
+    The client as telemetry labels it: a one-way hash, since the id itself
+    opens the client's stored documents.
+    """
+    return "c-" + hashlib.sha256(client_id.encode("utf-8")).hexdigest()[:12]
+
+
+def valid_client_id(client_id) -> bool:
+    """Only ids shaped like new_client_id() open a stored session; short or hand-made ones are refused."""
+    return bool(client_id) and _CLIENT_ID_RE.fullmatch(client_id) is not None
+
+
+def packet_hash(documents: list[dict]) -> str:
+    """Identity of an upload set: its document digests in upload order."""
+    return _hash([d["digest"] for d in documents])
+
+
+def stored_documents(client_id: str) -> list[dict]:
+    """The client's documents as last uploaded: [{"digest", "name", "text", "deductions"}] in upload order."""
+    stored = db.client_documents(client_id)
+    return [{"digest": digest, **doc} for digest, doc in sorted(stored.items(), key=lambda d: d[1]["position"])]
+
+
+def extract_documents(client_id: str, uploaded_files) -> list[dict]:
+    """
+    Make the stored packet match the uploads and return it (see
+    stored_documents). Only documents the client has not stored before are
+    extracted; removed ones are forgotten together with their deductions and
+    their extraction cache entries.
+    """
+    stored = db.client_documents(client_id)
+    packet, new = {}, {}
+    for uploaded_file in uploaded_files:
+        digest = content_hash(uploaded_file.getvalue())
+        if digest not in packet:
+            packet[digest] = uploaded_file.name
+            if digest not in stored:
+                new[digest] = uploaded_file
+    texts = dict(zip(new, extract_texts(list(new.values())))) if new else {}
+    db.sync_client_documents(client_id, [
+        (digest, name, texts[digest] if digest in texts else stored[digest]["text"])
+        for digest, name in packet.items()
+    ])
+    # The stored packet keeps the text it needs; cached copies of removed documents go.
+    get_extraction_cache().forget(*(set(stored) - set(packet)))
+    return stored_documents(client_id)
+
+
+def iter_client_deductions(client_id: str, documents: list[dict]):
+    """
+    Deduction names for the packet, without duplicates. Documents analysed
+    before answer from the store at once; new ones stream through the model
+    concurrently (ai_engine.iter_document_deductions) and each is stored as
+    soon as it finishes.
+    """
+    merged = []
+
+    def add(names):
+        nonlocal merged
+        before = len(merged)
+        merged = merge_deductions([merged, names])
+        return merged[before:]
+
+    pending = []
+    for doc in documents:
+        if doc["deductions"] is None:
+            pending.append(doc)
+        else:
+            yield from add(doc["deductions"])
+    names = [[] for _ in pending]
+    for index, name in iter_document_deductions([doc["text"] for doc in pending]):
+        doc = pending[index]
+        if name is None:
+            db.save_document_deductions(client_id, doc["digest"], names[index])
+            doc["deductions"] = names[index]
+        else:
+            names[index].append(name)
+            yield from add([name])
+
+
+def iter_client_forms(client_id: str, deductions: list[str]):
+    """Form recommendations for a deduction list; reused as long as the list is unchanged."""
+    key = _hash(deductions)
+    stored = db.get_client_result(client_id, "forms", input_hash=key)
+    if stored is not None:
+        yield from stored
+        return
+    forms = []
+    for form in iter_forms(deductions):
+        forms.append(form)
+        yield form
+    db.save_client_result(client_id, "forms", forms, key)
+
+
+def client_trades(client_id: str, uploaded_files) -> dict | None:
+    """Capital gains summary of the uploaded trade CSVs; the stored one when nothing is uploaded."""
+    if not uploaded_files:
+        return db.get_client_result(client_id, "trades")
+    trades = summarize_uploads(uploaded_files)
+    db.save_client_result(client_id, "trades", trades,
+                          _hash(sorted(content_hash(f.getvalue()) for f in uploaded_files)))
+    return trades
+
+
+def save_mapping(client_id: str, form_code: str, documents: list[dict], form_fields: dict,
+                 semantic_fields: dict) -> None:
+    """Store a form's mapping as computed from ``documents`` (the packet, see stored_documents)."""
+    db.save_client_result(client_id, "mapping", {"form_fields": form_fields, "semantic_fields": semantic_fields},
+                          packet_hash(documents), item=form_code)
+
+
+def client_mappings(client_id: str, documents: list[dict]) -> dict:
+    """{form code: {"form_fields", "semantic_fields"}} for every form mapped from exactly this packet."""
+    return db.client_results(client_id, "mapping", input_hash=packet_hash(documents))
+
+
+def session_state(client_id: str) -> dict:
+    """What a fresh page load needs to pick the session back up."""
+    documents = stored_documents(client_id)
+    deductions = merge_deductions(d["deductions"] for d in documents if d["deductions"] is not None)
+    return {
+        "documents": documents,
+        "deductions": deductions if all(d["deductions"] is not None for d in documents) else [],
+        "forms": db.get_client_result(client_id, "forms", input_hash=_hash(deductions)) or [],
+        "mappings": client_mappings(client_id, documents),
+    }
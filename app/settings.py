@@ -0,0 +1,15 @@
+import os
+
+# Root directory for on-disk caches (LLM responses, IRS forms, field indexes).
+CACHE_DIR = os.getenv(
+    "WISECPA_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache"),
+)
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    """Read a boolean switch such as WISECPA_OFFLINE=1 from the environment."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
@@ -0,0 +1,229 @@
+"""
+Per-stage latency, token and cost instrumentation.
+
+Code under measurement opens a span:
+
+    with span("download", form=form_code) as s:
+        ...
+        s.set(bytes=len(pdf_bytes))
+
+Spans pick up the labels of their context (``client``, ``form``), set with
+``labels()``/``set_labels()``. Threads started through ``propagate()`` keep
+their caller's labels. Finished spans are kept in a bounded in-memory window
+for percentiles, added to running totals per (stage, client, form), and, with
+WISECPA_TELEMETRY_JSONL set, appended to that file as they finish.
+"""
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from openai_usage_tracker import usage_cost
+
+TELEMETRY_WINDOW = int(os.getenv("WISECPA_TELEMETRY_WINDOW", "10000"))
+TELEMETRY_JSONL = os.getenv("WISECPA_TELEMETRY_JSONL")
+LABELS = ("client", "form")
+
+_labels: contextvars.ContextVar[dict] = contextvars.ContextVar("wisecpa_labels", default={})
+
+
+class Span:
+    __slots__ = ("stage", "labels", "attrs", "start", "seconds", "error")
+
+    def __init__(self, stage: str, labels: dict, attrs: dict):
+        self.stage = stage
+        self.labels = labels
+        self.attrs = attrs
+        self.start = time.time()
+        self.seconds = 0.0
+        self.error = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def record_usage(self, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """Token counts as reported by the API's ``usage`` field, priced per model."""
+        self.attrs.update(model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                          cost=usage_cost(model, prompt_tokens, completion_tokens))
+
+    def to_dict(self) -> dict:
+        return {"stage": self.stage, **self.labels, "start": round(self.start, 3),
+                "seconds": round(self.seconds, 6), "error": self.error, **self.attrs}
+
+
+class Recorder:
+    """Thread-safe sink for finished spans: recent window plus cumulative totals."""
+
+    def __init__(self, window: int = TELEMETRY_WINDOW, jsonl_path: str | None = TELEMETRY_JSONL):
+        self.spans = deque(maxlen=window)
+        self.totals = defaultdict(lambda: {"count": 0, "errors": 0, "seconds": 0.0,
+                                           "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+
+    def add(self, s: Span) -> None:
+        record = s.to_dict()
+        key = (s.stage, s.labels.get("client", ""), s.labels.get("form", ""))
+        with self._lock:
+            self.spans.append(record)
+            total = self.totals[key]
+            total["count"] += 1
+            total["errors"] += s.error is not None
+            total["seconds"] += s.seconds
+            total["prompt_tokens"] += s.attrs.get("prompt_tokens", 0)
+            total["completion_tokens"] += s.attrs.get("completion_tokens", 0)
+            total["cost"] += s.attrs.get("cost", 0.0)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans.clear()
+            self.totals.clear()
+
+    def _window(self, client: str | None) -> list[dict]:
+        with self._lock:
+            return [r for r in self.spans if client is None or r.get("client") == client]
+
+    def aggregate(self, by=("stage",), client: str | None = None) -> list[dict]:
+        """
+        One row per distinct value of the ``by`` keys over the recent window,
+        or only ``client``'s spans: count, errors, p50/p95/max seconds, tokens
+        and cost. Slowest total first.
+        """
+        spans = self._window(client)
+        groups = defaultdict(list)
+        for record in spans:
+            groups[tuple(record.get(k, "") for k in by)].append(record)
+        rows = []
+        for key, records in groups.items():
+            seconds = sorted(r["seconds"] for r in records)
+            rows.append({
+                **dict(zip(by, key)),
+                "count": len(records),
+                "errors": sum(r["error"] is not None for r in records),
+                "p50_s": _quantile(seconds, 0.5),
+                "p95_s": _quantile(seconds, 0.95),
+                "max_s": seconds[-1],
+                "total_s": round(sum(seconds), 6),
+                "prompt_tokens": sum(r.get("prompt_tokens", 0) for r in records),
+                "completion_tokens": sum(r.get("completion_tokens", 0) for r in records),
+                "cost": round(sum(r.get("cost", 0.0) for r in records), 6),
+            })
+        return sorted(rows, key=lambda r: r["total_s"], reverse=True)
+
+    def to_jsonl(self, client: str | None = None) -> str:
+        return "".join(json.dumps(r, default=str) + "\n" for r in self._window(client))
+
+    def to_prometheus(self, client: str | None = None) -> str:
+        """
+        Cumulative totals plus windowed p50/p95 per stage, in Prometheus text
+        exposition format; with ``client``, only that client's.
+        """
+        with self._lock:
+            totals = {key: dict(total) for key, total in self.totals.items() if client is None or key[1] == client}
+        metrics = (
+            ("wisecpa_stage_seconds_total", "counter", "Time spent in each stage.", "seconds"),
+            ("wisecpa_stage_calls_total", "counter", "Finished spans per stage.", "count"),
+            ("wisecpa_stage_errors_total", "counter", "Spans that raised.", "errors"),
+            ("wisecpa_llm_prompt_tokens_total", "counter", "Prompt tokens reported by the API.", "prompt_tokens"),
+            ("wisecpa_llm_completion_tokens_total", "counter", "Completion tokens reported by the API.", "completion_tokens"),
+            ("wisecpa_llm_cost_usd_total", "counter", "Estimated LLM cost in USD.", "cost"),
+        )
+        lines = []
+        for name, kind, help_text, field in metrics:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (stage, client, form), total in sorted(totals.items()):
+                if field in ("prompt_tokens", "completion_tokens", "cost") and not total[field]:
+                    continue
+                lines.append(f"{name}{{{_prom_labels(stage=stage, client=client, form=form)}}} {total[field]:g}")
+        lines += ["# HELP wisecpa_stage_latency_seconds Stage latency quantiles over the recent window.",
+                  "# TYPE wisecpa_stage_latency_seconds gauge"]
+        for row in self.aggregate(("stage",), client):
+            for q, field in (("0.5", "p50_s"), ("0.95", "p95_s")):
+                lines.append(f"wisecpa_stage_latency_seconds{{{_prom_labels(stage=row['stage'], quantile=q)}}} {row[field]:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _quantile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank quantile of an already sorted list."""
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _prom_labels(**labels) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{k}="{escape(v)}"' for k, v in labels.items() if v != "")
+
+
+_recorder = Recorder()
+
+
+def get_recorder() -> Recorder:
+    return _recorder
+
+
+def current_labels() -> dict:
+    return _labels.get()
+
+
+def set_labels(**labels) -> contextvars.Token:
+    """Merge labels into the current context, e.g. once per Streamlit rerun."""
+    return _labels.set({**_labels.get(), **{k: v for k, v in labels.items() if v is not None}})
+
+
+@contextmanager
+def labels(**labels):
+    token = set_labels(**labels)
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    """Time a block as one span of ``stage``; ``client``/``form`` in attrs override context labels."""
+    context = dict(_labels.get())
+    for key in LABELS:
+        if key in attrs:
+            context[key] = attrs.pop(key)
+    s = Span(stage, context, attrs)
+    start = time.perf_counter()
+    try:
+        yield s
+    except GeneratorExit:
+        raise  # a consumer stopped reading a streaming span early; not a failure
+    except BaseException as e:
+        s.error = type(e).__name__
+        raise
+    finally:
+        s.seconds = time.perf_counter() - start
+        _recorder.add(s)
+
+
+def traced(stage: str, **attrs):
+    """Decorator form of span() for a whole function."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, **attrs):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def propagate(fn):
+    """Wrap fn so each call runs in a copy of the caller's context (thread pools drop contextvars)."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
@@ -0,0 +1,103 @@
+"""
+Time and memory of the capital_gains CSV path on synthetic brokerage/crypto exports.
+
+    python benchmarks/bench_capital_gains.py [--rows 1000000] [--max-seconds 60] [--max-mb 1000]
+
+Writes a brokerage CSV and a crypto CSV of ``--rows`` lots each to a temp
+directory, runs summarize_trades over both in a fresh process, and prints
+elapsed time, that process's peak RSS and the Schedule D totals. Exits
+non-zero when a budget is exceeded.
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+from capital_gains import summarize_trades  # noqa: E402
+
+SYMBOLS = np.array(["AAPL", "MSFT", "GOOG", "AMZN", "NVDA", "TSLA", "META", "VTI", "SPY", "QQQ"])
+ASSETS = np.array(["BTC", "ETH", "SOL", "ADA", "DOGE"])
+
+
+def _dates(rng, rows):
+    acquired = np.datetime64("2021-01-01") + rng.integers(0, 1200, rows).astype("timedelta64[D]")
+    sold = acquired + rng.integers(1, 900, rows).astype("timedelta64[D]")
+    return pd.Series(acquired).dt.strftime("%m/%d/%Y"), pd.Series(sold).dt.strftime("%m/%d/%Y")
+
+
+def write_brokerage(path, rows, seed=1):
+    rng = np.random.default_rng(seed)
+    shares = rng.integers(1, 200, rows)
+    acquired, sold = _dates(rng, rows)
+    cost = np.round(shares * rng.uniform(20, 500, rows), 2)
+    pd.DataFrame({
+        "Description": pd.Series(shares).astype(str) + " sh " + SYMBOLS[rng.integers(0, len(SYMBOLS), rows)],
+        "Date Acquired": acquired,
+        "Date Sold": sold,
+        "Proceeds": np.round(cost * rng.uniform(0.7, 1.4, rows), 2),
+        "Cost Basis": cost,
+    }).to_csv(path, index=False)
+
+
+def write_crypto(path, rows, seed=2):
+    rng = np.random.default_rng(seed)
+    acquired, sold = _dates(rng, rows)
+    cost = np.round(rng.uniform(10, 5000, rows), 2)
+    pd.DataFrame({
+        "Asset": ASSETS[rng.integers(0, len(ASSETS), rows)],
+        "Amount": np.round(rng.uniform(0.001, 3, rows), 6),
+        "Date Acquired": acquired,
+        "Date Sold": sold,
+        "Proceeds": np.round(cost * rng.uniform(0.5, 2.0, rows), 2),
+        "Cost Basis": cost,
+        "Fee": np.round(rng.uniform(0, 5, rows), 2),
+    }).to_csv(path, index=False)
+
+
+def _timed_summary(paths):
+    start = time.perf_counter()
+    summary = summarize_trades(paths)
+    return summary, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--max-seconds", type=float, default=60.0)
+    parser.add_argument("--max-mb", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        brokerage, crypto = os.path.join(tmp, "brokerage.csv"), os.path.join(tmp, "crypto.csv")
+        write_brokerage(brokerage, args.rows)
+        write_crypto(crypto, args.rows)
+        size_mb = (os.path.getsize(brokerage) + os.path.getsize(crypto)) / 1e6
+
+        # A spawned child starts clean, so its max RSS is the ingestion alone.
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            summary, elapsed = pool.apply(_timed_summary, ([brokerage, crypto],))
+        peak_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    print(f"{summary['lots']} lots from {size_mb:.0f} MB of CSV in {elapsed:.1f}s "
+          f"({summary['lots'] / elapsed:,.0f} lots/s), peak RSS {peak_mb:.0f} MB")
+    print(f"wash sales {summary['wash_sales']}, skipped rows {summary['skipped_rows']}")
+    for line, value in summary["schedule_d"].items():
+        print(f"  Schedule D line {line:>3}: {value['gain'] if isinstance(value, dict) else value:>18,.2f}")
+
+    ok = elapsed <= args.max_seconds and peak_mb <= args.max_mb
+    if not ok:
+        print(f"❌ over budget ({args.max_seconds:.0f}s / {args.max_mb:.0f} MB)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,81 @@
+"""
+Time filling a whole return: per-form fills vs the one-pass merged fill_return.
+
+    python benchmarks/bench_fill.py [--forms 6] [--values 30] [--repeat 10]
+
+Uses template.pdf as every form of a ``--forms`` form return, with
+``--values`` filled text fields per form (0 = all of them). Compares walking
+every widget per form (the old fill_pdf_form_simple path), index-driven
+fills, incremental saves to disk and the single merged return.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+from pdf_filler import (fill_pdf_file, fill_pdf_form_simple, fill_return, list_pdf_fields,  # noqa: E402
+                        load_field_index, open_pdf)
+
+
+def _per_form_walk(forms, _tmp):
+    """Every widget on every page visited for each form, one full deflate save each."""
+    out = []
+    for pdf_bytes, fields in forms:
+        doc, _ = open_pdf(pdf_bytes)
+        try:
+            out.append(fill_pdf_form_simple(doc, fields))
+        finally:
+            doc.close()
+    return sum(len(b) for b in out)
+
+
+def _per_form_index(forms, _tmp):
+    return sum(len(fill_pdf_form_simple(pdf_bytes, fields)) for pdf_bytes, fields in forms)
+
+
+def _per_form_incremental(forms, tmp):
+    total = 0
+    for n, (pdf_bytes, fields) in enumerate(forms):
+        path = os.path.join(tmp, f"form{n}.pdf")
+        fill_pdf_file(pdf_bytes, fields, path)
+        total += os.path.getsize(path)
+    return total
+
+
+def _merged(forms, _tmp):
+    return len(fill_return(forms))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--forms", type=int, default=6)
+    parser.add_argument("--values", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "template.pdf"), "rb") as f:
+        pdf_bytes = f.read()
+    load_field_index(pdf_bytes)  # warm, as after the first preview
+    text_fields = list_pdf_fields(pdf_bytes)
+    fields = {f["field_name"]: f"{n * 11:,}.00" for n, f in enumerate(text_fields[:args.values or None])}
+    forms = [(pdf_bytes, fields)] * args.forms
+
+    print(f"{args.forms} forms, {len(fields)} values each")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, fn in (("per form, walk widgets", _per_form_walk),
+                          ("per form, field index", _per_form_index),
+                          ("per form, incremental", _per_form_incremental),
+                          ("merged return", _merged)):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                size = fn(forms, tmp)
+            elapsed = (time.perf_counter() - start) / args.repeat
+            print(f"{label:<24} {elapsed * 1000:8.1f} ms  {size / 1e6:6.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
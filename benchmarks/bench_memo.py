@@ -0,0 +1,64 @@
+"""
+Measure how quickly the field-mapping memo takes a repeat form off the model.
+
+    python benchmarks/bench_memo.py [--clients 50]
+
+Walks synthetic W-2/1099-INT/1099-DIV clients through template.pdf in order.
+Each client is first filled from the memo (field_memo.apply_memo); the rest
+of the fields would go to the model, counted as batch prompt tokens. The
+reviewer then accepts the correct mapping, which the f1040 rule table stands
+in for here, and the memo learns from it. A temporary database is used, and
+nothing calls the model.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["WISECPA_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="wisecpa-memo-"), "memo.db")
+
+from ai_engine import build_fill_prompts  # noqa: E402
+from bench_rules import synthetic_client  # noqa: E402
+from chunking import count_tokens  # noqa: E402
+from field_memo import apply_memo, learn  # noqa: E402
+from form_rules import apply_rules  # noqa: E402
+from pdf_filler import list_filtered_pdf_fields, list_pdf_fields, load_field_index  # noqa: E402
+
+REVISION = "bench"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=50)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "template.pdf"), "rb") as f:
+        pdf_bytes = f.read()
+    fields = list_filtered_pdf_fields(pdf_bytes)
+    field_names = [f["field_name"] for f in list_pdf_fields(pdf_bytes)]
+    labels = {f["field_name"]: f["label"] for f in list_pdf_fields(pdf_bytes)}
+    lines = load_field_index(pdf_bytes)["lines"]
+    form_revision = hashlib.sha256(pdf_bytes).hexdigest()[:16]  # irs_forms' revision id for this copy
+
+    print(f"{'client':>6} {'memo':>5} {'wrong':>6} {'to model':>9} {'prompt tok':>11} {'memo ms':>8}")
+    for n in range(args.clients):
+        user_data = synthetic_client(n)
+        accepted = apply_rules("f1040", user_data, field_names, lines, form_revision)["form_fields"]
+        start = time.perf_counter()
+        memo = apply_memo("f1040", user_data, field_names, revision=REVISION)["form_fields"]
+        seconds = time.perf_counter() - start
+        wrong = sum(1 for name, value in memo.items() if accepted.get(name, value) != value)
+        pending = [f for f in fields if f["field_name"] not in memo]
+        tokens = sum(count_tokens(p) for p in build_fill_prompts(pending, user_data, "Form_1040"))
+        if n < 5 or n == args.clients - 1 or n & (n - 1) == 0:
+            print(f"{n + 1:>6} {len(memo):>5} {wrong:>6} {len(pending):>9} {tokens:>11} {seconds * 1000:>8.2f}")
+        learn("f1040", user_data, accepted, labels, revision=REVISION)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark the hybrid text-layer / OCR extractor on a mixed scanned + digital corpus.
+
+    python benchmarks/bench_ocr.py [--digital 40] [--scanned 10] [--workers N]
+
+Digital pages carry a real text layer; scanned pages are the same content
+rendered to an image and embedded without text. Each page goes through
+ocr_utils.extract_pdf_page twice (cold, then with a warm OCR cache) and the
+script reports pages per second plus the share of pages that skipped OCR.
+Requires the tesseract binary for the scanned pages.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+import fitz  # noqa: E402
+
+LINES = [
+    "Form W-2 Wage and Tax Statement 2024",
+    "a Employee's social security number 123-45-{n:04d}",
+    "1 Wages, tips, other compensation 5{n:04d}.00",
+    "2 Federal income tax withheld 6{n:03d}.00",
+    "c Employer's name, address, and ZIP code ACME PAYROLL INC",
+]
+
+
+def _text_page(doc, n):
+    page = doc.new_page(width=612, height=792)
+    for i, line in enumerate(LINES):
+        page.insert_text((54, 72 + i * 22), line.format(n=n), fontsize=11)
+    return page
+
+
+def build_corpus(digital: int, scanned: int) -> bytes:
+    out = fitz.open()
+    for n in range(digital + scanned):
+        if n < digital:
+            _text_page(out, n)
+            continue
+        src = fitz.open()
+        _text_page(src, n)
+        png = src[0].get_pixmap(dpi=200).tobytes("png")
+        src.close()
+        page = out.new_page(width=612, height=792)
+        page.insert_image(page.rect, stream=png)
+    data = out.tobytes()
+    out.close()
+    return data
+
+
+def _run(data, pages, workers):
+    from ocr_utils import extract_pdf_page
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        sources = list(pool.map(extract_pdf_page, [data] * pages, range(pages)))
+    return time.perf_counter() - start, Counter(source for _, source in sources)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--digital", type=int, default=40)
+    parser.add_argument("--scanned", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix="wisecpa-ocr-bench-")
+    os.environ["WISECPA_OCR_CACHE_DIR"] = cache_dir
+    os.environ["WISECPA_OCR_CACHE"] = "1"
+    try:
+        data = build_corpus(args.digital, args.scanned)
+        pages = args.digital + args.scanned
+        for label in ("cold cache", "warm cache"):
+            elapsed, sources = _run(data, pages, args.workers)
+            print(f"{label:<10} {pages / elapsed:7.1f} pages/s  "
+                  f"skipped OCR {sources['text'] / pages:6.1%}  "
+                  f"OCR {sources['ocr']}  cache hits {sources['ocr-cache']}")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
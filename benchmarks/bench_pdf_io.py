@@ -0,0 +1,99 @@
+"""
+Micro-benchmark: temp-file PDF handling vs in-memory streams.
+
+    python benchmarks/bench_pdf_io.py [--repeat 20] [--pages 30]
+
+Compares the old NamedTemporaryFile round trip against fitz.open(stream=...)
+for list + fill on template.pdf and on a synthetic multi-page form with
+``--pages`` pages of text widgets. Reports wall time and peak allocations.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+import fitz  # noqa: E402
+from pdf_filler import _extract_widgets, fill_pdf_form_simple, open_pdf  # noqa: E402
+
+
+def _via_tempfile(pdf_bytes, fields):
+    """The pre-change flow: write bytes to disk and reopen, once for listing and once for filling."""
+    for step in ("list", "fill"):
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+            tmp.write(pdf_bytes)
+            path = tmp.name
+        try:
+            doc = fitz.open(path)
+            if step == "list":
+                _extract_widgets(doc)
+            else:
+                fill_pdf_form_simple(doc, fields)
+            doc.close()
+        finally:
+            os.unlink(path)
+
+
+def _in_memory(pdf_bytes, fields):
+    doc, _ = open_pdf(pdf_bytes)
+    try:
+        _extract_widgets(doc)
+        fill_pdf_form_simple(doc, fields)
+    finally:
+        doc.close()
+
+
+def _measure(fn, pdf_bytes, fields, repeat):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(pdf_bytes, fields)
+    elapsed = (time.perf_counter() - start) / repeat
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def _multi_page(pages, fields_per_page=40):
+    """Synthetic large form: labelled text widgets laid out down every page."""
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        for i in range(fields_per_page):
+            y = 40 + i * 18
+            page.insert_text((40, y + 10), f"Line {i + 1} amount for item {p}-{i}", fontsize=8)
+            widget = fitz.Widget()
+            widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+            widget.field_name = f"form[0].Page{p + 1}[0].f{p + 1}_{i:02d}[0]"
+            widget.rect = fitz.Rect(300, y, 550, y + 14)
+            page.add_widget(widget)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=30)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "template.pdf"), "rb") as f:
+        template = f.read()
+    cases = {"template.pdf": template, f"synthetic {args.pages}p": _multi_page(args.pages)}
+
+    for name, pdf_bytes in cases.items():
+        fields = {w["field_name"]: "1" for w in _extract_widgets(pdf_bytes)[:20]}
+        t_old, m_old = _measure(_via_tempfile, pdf_bytes, fields, args.repeat)
+        t_new, m_new = _measure(_in_memory, pdf_bytes, fields, args.repeat)
+        print(f"{name:<18} tempfile {t_old * 1000:8.1f} ms  peak {m_old / 1024:8.0f} KiB | "
+              f"in-memory {t_new * 1000:8.1f} ms  peak {m_new / 1024:8.0f} KiB | "
+              f"saved {(1 - t_new / t_old) * 100:5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+End-to-end stage timings against a local fake model and a local IRS form server.
+
+    python benchmarks/bench_pipeline.py [--repeat 5] [--llm-latency 0.2] [--completion-tokens 300]
+        [--csv-rows 100000] [--out results.json] [--baseline baseline.json] [--save-baseline]
+
+Generates synthetic W-2/1099 PDFs, a receipt image, a scanned receipt PDF
+and a brokerage CSV, then times extract_text_from_file, list_pdf_fields,
+filter_pdf_fields, download_form_bytes, fill_pdf_form, fill_pdf_form_simple
+and a full batch.process_client run. The model is a local OpenAI-compatible
+server (OPENAI_BASE_URL) answering after ``--llm-latency`` seconds plus
+``--completion-tokens`` at ``--llm-tps`` tokens/second; IRS downloads come
+from a local server (WISECPA_IRS_BASE_URL) serving template.pdf for every
+code. All caches live in a temp dir and the LLM/OCR caches are off.
+
+Results are JSON (median/p95/min ms per stage). With ``--baseline``, stages
+whose median is more than ``--tolerance`` slower than the baseline (and at
+least ``--min-delta-ms`` slower) are reported and the exit status is 1.
+Image OCR stages are skipped when the tesseract binary is missing.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fitz
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+W2 = ("Form W-2 Wage and Tax Statement 2024\nEmployee's name JANE Q PUBLIC\n"
+      "a Employee's social security number 123-45-{n:04d}\n1 Wages, tips, other compensation 5{n:04d}.00\n"
+      "2 Federal income tax withheld 6{n:03d}.00\nc Employer's name ACME PAYROLL {n}, 100 MAIN ST, SPRINGFIELD IL")
+INT = ("Form 1099-INT Interest Income 2024\nPayer's name FIRST NATIONAL BANK {n}\n1 Interest income {n}.25\n"
+       "4 Federal income tax withheld 0.00")
+RECEIPT = "OFFICE SUPPLY DEPOT\nReceipt #{n}\nPrinter paper 24.99\nToner cartridge 89.00\nTotal 113.99"
+
+DEDUCTIONS = ["Wages", "Interest income", "Federal income tax withheld", "Home office expenses", "Capital gains"]
+FORMS = ["Form_1040|f1040 - U.S. Individual Income Tax Return",
+         "Schedule_B|f1040sb - Interest and Ordinary Dividends",
+         "Form_8949|f8949 - Sales and Other Dispositions of Capital Assets"]
+
+
+# === Synthetic documents ===
+
+def text_pdf(text: str) -> bytes:
+    doc = fitz.open()
+    page = doc.new_page(width=612, height=792)
+    for i, line in enumerate(text.splitlines()):
+        page.insert_text((54, 72 + i * 20), line, fontsize=11)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def text_image(text: str) -> bytes:
+    image = Image.new("L", (1275, 900), 255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(text.splitlines()):
+        draw.text((80, 80 + i * 60), line, fill=0, font_size=36)
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def scanned_pdf(text: str) -> bytes:
+    doc = fitz.open()
+    page = doc.new_page(width=612, height=792)
+    page.insert_image(fitz.Rect(36, 36, 576, 420), stream=text_image(text))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def write_client(client_dir: str, n: int, csv_rows: int, ocr: bool) -> None:
+    """One client packet; ``n`` varies every amount so content-hash caches miss."""
+    os.makedirs(client_dir, exist_ok=True)
+    files = {"w2.pdf": text_pdf(W2.format(n=n)), "1099int.pdf": text_pdf(INT.format(n=n))}
+    if ocr:
+        files["receipt.png"] = text_image(RECEIPT.format(n=n))
+    for name, data in files.items():
+        with open(os.path.join(client_dir, name), "wb") as f:
+            f.write(data)
+    if csv_rows:
+        from bench_capital_gains import write_brokerage
+        write_brokerage(os.path.join(client_dir, "brokerage.csv"), csv_rows, seed=n)
+
+
+class Upload(io.BytesIO):
+    """Stand-in for Streamlit's UploadedFile."""
+
+    def __init__(self, name: str, mime: str, data: bytes):
+        super().__init__(data)
+        self.name = name
+        self.type = mime
+
+
+# === Local servers ===
+
+class FakeOpenAI(BaseHTTPRequestHandler):
+    """OpenAI-compatible /v1/chat/completions answering by prompt type, streaming or not."""
+    latency = 0.2
+    completion_tokens = 300
+    tokens_per_second = 1000.0
+
+    def log_message(self, *args):
+        pass
+
+    def _answer(self, prompt: str) -> str:
+        if "PDF FIELDS" in prompt:
+            ids = re.findall(r"^(\d+): ", prompt.split("PDF FIELDS", 1)[1], re.MULTILINE)
+            return json.dumps({field_id: f"{i * 100:,}.00" for i, field_id in enumerate(ids[::3])})
+        if "Deduction/Income names" in prompt:
+            return "\n".join(DEDUCTIONS)
+        return "\n".join(FORMS)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = "\n".join(m.get("content") or "" for m in body["messages"])
+        content = self._answer(prompt)
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": self.completion_tokens,
+                 "total_tokens": len(prompt) // 4 + self.completion_tokens}
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": body["model"]}
+        time.sleep(self.latency)
+        generation = self.completion_tokens / self.tokens_per_second
+
+        if not body.get("stream"):
+            time.sleep(generation)
+            self._send(200, "application/json", json.dumps({
+                **base, "object": "chat.completion", "usage": usage,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+            }).encode())
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        pieces = content.splitlines(keepends=True) or [content]
+        for piece in pieces:
+            time.sleep(generation / len(pieces))
+            self._event({**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+        self._event({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _event(self, payload: dict):
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+        self.wfile.flush()
+
+    def _send(self, status: int, content_type: str, data: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeIRS(BaseHTTPRequestHandler):
+    """Serves one PDF for every /<code>.pdf with an ETag, answering 304 on a match."""
+    pdf = b""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        etag = '"' + hashlib.sha256(self.pdf).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(self.pdf)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(self.pdf)
+
+
+def serve(handler) -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# === Timing and comparison ===
+
+def timed(fn, repeat: int, setup=None) -> dict:
+    """Run fn ``repeat`` times (setup untimed before each run); milliseconds per run."""
+    runs = []
+    for i in range(repeat):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        fn(i)
+        runs.append((time.perf_counter() - start) * 1000)
+    ordered = sorted(runs)
+    return {"runs": len(runs), "median_ms": round(statistics.median(runs), 3),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 3),
+            "min_ms": round(ordered[0], 3)}
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list[str]:
+    """Stages whose median regressed beyond both the relative tolerance and the absolute floor."""
+    regressions = []
+    for stage, current in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before:
+            continue
+        delta = current["median_ms"] - before["median_ms"]
+        if delta > min_delta_ms and current["median_ms"] > before["median_ms"] * (1 + tolerance):
+            regressions.append(f"{stage}: {before['median_ms']:.1f} → {current['median_ms']:.1f} ms "
+                               f"(+{delta / before['median_ms']:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds before the fake model answers")
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    parser.add_argument("--llm-tps", type=float, default=1000.0, help="fake model output tokens per second")
+    parser.add_argument("--csv-rows", type=int, default=100_000)
+    parser.add_argument("--out", default=None, help="write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="results JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed median slowdown, as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "template.pdf"), "rb") as f:
+        template = f.read()
+    FakeOpenAI.latency, FakeOpenAI.completion_tokens = args.llm_latency, args.completion_tokens
+    FakeOpenAI.tokens_per_second = args.llm_tps
+    FakeIRS.pdf = template
+    ocr = shutil.which("tesseract") is not None
+
+    tmp = tempfile.mkdtemp(prefix="wisecpa-bench-")
+    try:
+        # The app reads these at import time, so they are set before the first app import below.
+        os.environ.update({
+            "WISECPA_CACHE_DIR": os.path.join(tmp, "cache"),
+            "WISECPA_IRS_BASE_URL": serve(FakeIRS),
+            "OPENAI_BASE_URL": serve(FakeOpenAI) + "/v1",
+            "OPENAI_API_KEY": "bench",
+            "WISECPA_LLM_CACHE": "0",
+            "WISECPA_OCR_CACHE": "0",
+            "WISECPA_EXTRACTION_DISK_CACHE": "0",
+            "WISECPA_LLM_RPM": "0",
+            "WISECPA_LLM_TPM": "0",
+        })
+        os.environ.pop("WISECPA_TELEMETRY_JSONL", None)
+        import ai_engine
+        import batch
+        import irs_forms
+        import ocr_utils
+        import pdf_filler
+        from bench_capital_gains import write_brokerage
+        from telemetry import get_recorder
+
+        stages = {}
+        uploads = {"w2_pdf": Upload("w2.pdf", "application/pdf", text_pdf(W2.format(n=1)))}
+        csv_path = os.path.join(tmp, "brokerage.csv")
+        write_brokerage(csv_path, args.csv_rows)
+        with open(csv_path, "rb") as f:
+            uploads["csv"] = Upload("brokerage.csv", "text/csv", f.read())
+        if ocr:
+            uploads["receipt_png"] = Upload("receipt.png", "image/png", text_image(RECEIPT.format(n=1)))
+            uploads["scanned_pdf"] = Upload("scan.pdf", "application/pdf", scanned_pdf(RECEIPT.format(n=1)))
+        for name, upload in uploads.items():
+            stages[f"extract_text_from_file[{name}]"] = timed(
+                lambda i, u=upload: ocr_utils.extract_text_from_file(u), args.repeat, lambda i, u=upload: u.seek(0))
+
+        def clear_forms(i):
+            shutil.rmtree(irs_forms.FORMS_DIR, ignore_errors=True)
+        stages["download_form_bytes[network]"] = timed(lambda i: irs_forms.download_form_bytes("f1040"),
+                                                       args.repeat, clear_forms)
+        max_age = irs_forms.FORMS_MAX_AGE
+        irs_forms.FORMS_MAX_AGE = -1
+        stages["download_form_bytes[revalidate]"] = timed(lambda i: irs_forms.download_form_bytes("f1040"),
+                                                          args.repeat)
+        irs_forms.FORMS_MAX_AGE = max_age
+        stages["download_form_bytes[store]"] = timed(lambda i: irs_forms.download_form_bytes("f1040"), args.repeat)
+
+        def clear_index(i):
+            pdf_filler._index_memo.clear()
+            pdf_filler._by_name_memo.clear()
+            shutil.rmtree(pdf_filler.FIELD_INDEX_DIR, ignore_errors=True)
+        stages["list_pdf_fields[build]"] = timed(lambda i: pdf_filler.list_pdf_fields(template), args.repeat, clear_index)
+        stages["list_pdf_fields[disk]"] = timed(lambda i: pdf_filler.list_pdf_fields(template), args.repeat,
+                                                lambda i: pdf_filler._index_memo.clear())
+        text_fields = pdf_filler.list_pdf_fields(template)
+        stages["filter_pdf_fields"] = timed(lambda i: ocr_utils.filter_pdf_fields(text_fields), args.repeat)
+
+        fields = pdf_filler.list_filtered_pdf_fields(template)
+        user_data = "\f\f".join([W2.format(n=1), INT.format(n=1), RECEIPT.format(n=1)])
+        mapping = {}
+        stages["fill_pdf_form"] = timed(
+            lambda i: mapping.update(ai_engine.fill_pdf_form(fields, user_data, "Form 1040", form_code="f1040",
+                                                             field_names=[f["field_name"] for f in text_fields],
+                                                             lines=pdf_filler.load_field_index(template)["lines"])),
+            args.repeat)
+        stages["fill_pdf_form_simple"] = timed(
+            lambda i: pdf_filler.fill_pdf_form_simple(template, mapping["form_fields"]), args.repeat)
+
+        clients = os.path.join(tmp, "clients")
+        get_recorder().clear()
+        stages["pipeline[process_client]"] = timed(
+            lambda i: batch.process_client(os.path.join(clients, f"client{i}"), os.path.join(tmp, "out")),
+            args.repeat,
+            lambda i: write_client(os.path.join(clients, f"client{i}"), i + 2, min(args.csv_rows, 20_000), ocr))
+        pipeline_spans = get_recorder().aggregate(("stage",))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    results = {
+        "meta": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+                 "repeat": args.repeat, "llm_latency": args.llm_latency,
+                 "completion_tokens": args.completion_tokens, "llm_tps": args.llm_tps,
+                 "csv_rows": args.csv_rows, "ocr": ocr},
+        "stages": stages,
+        "pipeline_spans": pipeline_spans,
+    }
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for stage, row in stages.items():
+        print(f"{stage:<40} {row['median_ms']:10.1f} ms  p95 {row['p95_ms']:10.1f} ms", file=sys.stderr)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        return 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for line in regressions:
+            print(f"❌ {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
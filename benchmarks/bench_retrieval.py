@@ -0,0 +1,54 @@
+"""
+Measure fill_pdf_form prompt tokens per preview with and without passage retrieval and structured records.
+
+    python benchmarks/bench_retrieval.py [--documents 40]
+
+Builds the Step 4 batch prompts for template.pdf against a synthetic client
+packet of ``--documents`` W-2/1099/receipt documents, without calling the
+model, and prints total prompt tokens for whole-text vs retrieved context, on
+the raw text and on file_parser.compact_user_data output.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+from ai_engine import build_fill_prompts  # noqa: E402
+from chunking import count_tokens, join_documents  # noqa: E402
+from file_parser import compact_user_data  # noqa: E402
+from pdf_filler import list_filtered_pdf_fields  # noqa: E402
+
+DOCUMENTS = [
+    "Form W-2 Wage and Tax Statement 2024\nEmployee's name JANE Q PUBLIC\n"
+    "a Employee's social security number 123-45-{n:04d}\n1 Wages, tips, other compensation 5{n:04d}.00\n"
+    "2 Federal income tax withheld 6{n:03d}.00\nEmployer ACME PAYROLL {n}, 100 MAIN ST, SPRINGFIELD IL 62701",
+    "Form 1099-INT Interest Income 2024\nPayer FIRST NATIONAL BANK {n}\n1 Interest income {n}.25\n"
+    "4 Federal income tax withheld 0.00",
+    "Receipt #{n}\nOFFICE SUPPLY DEPOT\nPrinter paper 24.99\nToner cartridge 89.00\nTotal 113.99\nPaid VISA",
+]
+
+
+def synthetic_packet(documents: int) -> str:
+    return join_documents([DOCUMENTS[n % len(DOCUMENTS)].format(n=n) for n in range(documents)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=40)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "template.pdf"), "rb") as f:
+        fields = list_filtered_pdf_fields(f.read())
+    user_data = synthetic_packet(args.documents)
+    compact = compact_user_data(user_data)
+    print(f"user data: {count_tokens(user_data)} tokens ({count_tokens(compact)} as records), {len(fields)} fields")
+    for label, data, use_retrieval in (("whole text", user_data, False), ("retrieval", user_data, True),
+                                       ("records", compact, False), ("records+retrieval", compact, True)):
+        prompts = build_fill_prompts(fields, data, "Form_1040", use_retrieval=use_retrieval)
+        print(f"{label:<18} {len(prompts)} batches, {sum(count_tokens(p) for p in prompts):>8} prompt tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Measure how much of a 1040 the rule tables fill before the model is called.
+
+    python benchmarks/bench_rules.py [--clients 200] [--llm-latency 8.0]
+
+Runs form_rules.apply_rules for template.pdf over synthetic W-2/1099-INT/1099-DIV
+clients and compares the Step 4 batch prompts with and without the fast path,
+without calling the model. Cost uses GPT-4 list prices; latency assumes
+``--llm-latency`` seconds per batch call with LLM_MAX_CONCURRENCY in flight.
+"""
+import argparse
+import hashlib
+import math
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+from ai_engine import LLM_MAX_CONCURRENCY, build_fill_prompts  # noqa: E402
+from chunking import count_tokens, join_documents  # noqa: E402
+from form_rules import apply_rules  # noqa: E402
+from pdf_filler import list_filtered_pdf_fields, list_pdf_fields, load_field_index  # noqa: E402
+
+# USD per 1K tokens (gpt-4, 8K context).
+INPUT_PRICE = 0.03
+OUTPUT_PRICE = 0.06
+# Rough completion size per mapped field in the compact {ID: value} answer.
+OUTPUT_TOKENS_PER_FIELD = 6
+
+DOCUMENTS = [
+    "Form W-2 Wage and Tax Statement 2024\nEmployee's name JANE Q PUBLIC\n"
+    "a Employee's social security number 123-45-6789\n1 Wages, tips, other compensation 5{n:04d}.00\n"
+    "2 Federal income tax withheld 6{n:03d}.00\nEmployer ACME PAYROLL {n}, 100 MAIN ST, SPRINGFIELD IL 62701",
+    "Form 1099-INT Interest Income 2024\nPayer FIRST NATIONAL BANK {n}\n1 Interest income {n}.25\n"
+    "4 Federal income tax withheld 0.00",
+    "Form 1099-DIV Dividends and Distributions 2024\nPayer BROKERAGE {n}\n"
+    "1a Total ordinary dividends 4{n:02d}.10\n1b Qualified dividends 3{n:02d}.00\n4 Federal income tax withheld 0.00",
+]
+
+
+def synthetic_client(n: int) -> str:
+    return join_documents([doc.format(n=n % 100) for doc in DOCUMENTS])
+
+
+def _cost(prompts: list[str], fields: int) -> tuple[int, float]:
+    tokens = sum(count_tokens(p) for p in prompts)
+    return tokens, tokens / 1000 * INPUT_PRICE + fields * OUTPUT_TOKENS_PER_FIELD / 1000 * OUTPUT_PRICE
+
+
+def _latency(calls: int, per_call: float) -> float:
+    return math.ceil(calls / max(1, LLM_MAX_CONCURRENCY)) * per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=8.0, help="assumed seconds per model call")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "template.pdf"), "rb") as f:
+        pdf_bytes = f.read()
+    fields = list_filtered_pdf_fields(pdf_bytes)
+    field_names = [f["field_name"] for f in list_pdf_fields(pdf_bytes)]
+    visible = {f["field_name"] for f in fields}
+    lines = load_field_index(pdf_bytes)["lines"]
+    form_revision = hashlib.sha256(pdf_bytes).hexdigest()[:16]  # irs_forms' revision id for this copy
+
+    resolved, hidden, sent, rule_seconds = 0, 0, 0, 0.0
+    base_tokens = base_cost = fast_tokens = fast_cost = 0.0
+    base_calls = fast_calls = 0
+    for n in range(args.clients):
+        user_data = synthetic_client(n)
+        start = time.perf_counter()
+        ruled = apply_rules("f1040", user_data, field_names, lines, form_revision)["form_fields"]
+        rule_seconds += time.perf_counter() - start
+        pending = [f for f in fields if f["field_name"] not in ruled]
+        resolved += len(ruled)
+        sent += len(pending)
+        hidden += sum(1 for name in ruled if name not in visible)
+
+        prompts = build_fill_prompts(fields, user_data, "Form_1040")
+        tokens, cost = _cost(prompts, len(fields))
+        base_tokens, base_cost, base_calls = base_tokens + tokens, base_cost + cost, base_calls + len(prompts)
+        prompts = build_fill_prompts(pending, user_data, "Form_1040")
+        tokens, cost = _cost(prompts, len(pending))
+        fast_tokens, fast_cost, fast_calls = fast_tokens + tokens, fast_cost + cost, fast_calls + len(prompts)
+
+    clients = args.clients
+    filled = resolved / clients
+    print(f"{clients} clients, {len(fields)} fields sent to the model without rules")
+    print(f"rules: {filled:.1f} fields/client without the model "
+          f"({resolved / (resolved + sent):.1%} of fields handled), "
+          f"{hidden / clients:.1f} of them not in the filtered field list, "
+          f"{rule_seconds / clients * 1000:.2f} ms/client")
+    print(f"{'':<10} {'calls':>6} {'prompt tok':>11} {'est. cost':>10} {'est. latency':>13}")
+    for label, calls, tokens, cost in (("model only", base_calls, base_tokens, base_cost),
+                                       ("fast path", fast_calls, fast_tokens, fast_cost)):
+        print(f"{label:<10} {calls / clients:>6.1f} {tokens / clients:>11.0f} ${cost / clients:>9.4f} "
+              f"{_latency(calls // clients, args.llm_latency):>12.1f}s")
+    print(f"saved per client: {(base_tokens - fast_tokens) / clients:.0f} prompt tokens, "
+          f"${(base_cost - fast_cost) / clients:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Time a cold start: module imports, server readiness and the first page.
+
+    python benchmarks/bench_startup.py [--repeat 5] [--no-server]
+
+Every sample runs in a fresh interpreter, so nothing is imported yet. The
+script reports the import time of the modules behind the Streamlit app, how
+long ``streamlit run app/main.py`` takes to answer its health check, and the
+first and second runs of app/main.py under streamlit.testing (the page a
+new visitor gets, then a rerun), when the background warm-up has finished
+(resources.warm_up), and a rerun after it. All runs use a temporary database.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "app")
+
+MODULES = ("llm_client", "ocr_utils", "pdf_filler", "capital_gains", "ai_engine", "sessions", "jobs")
+
+_IMPORT = """
+import sys, time
+sys.path.insert(0, {app!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+_FIRST_PAGE = """
+import json, sys, time
+sys.path.insert(0, {app!r})
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+app = AppTest.from_file({main!r}, default_timeout=120)
+app.run()
+first = time.perf_counter()
+app.run()
+rerun = time.perf_counter()
+import resources
+thread = resources.warm_up()
+if thread is not None:
+    thread.join()
+warm = time.perf_counter()
+app.run()
+warm_rerun = time.perf_counter()
+assert not app.exception, app.exception
+print(json.dumps({{"streamlit_import": imported - start, "first_page": first - imported, "rerun": rerun - first,
+                  "warm_up_done": warm - imported, "warm_rerun": warm_rerun - warm}}))
+"""
+
+
+def _python(code: str, env: dict) -> str:
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _server_ready(env: dict, timeout: float = 60.0) -> float:
+    """Seconds from launching ``streamlit run`` until /_stcore/health answers."""
+    port = _free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", os.path.join(APP, "main.py"), "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError("streamlit did not become healthy")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-server", action="store_true", help="skip the streamlit run readiness probe")
+    parser.add_argument("--out", help="write the medians as JSON")
+    args = parser.parse_args()
+
+    env = {**os.environ, "WISECPA_DB_PATH": os.path.join(tempfile.mkdtemp(prefix="wisecpa-startup-"), "taxwise.db"),
+           "WISECPA_JOB_WORKERS": "0", "PYTHONWARNINGS": "ignore"}
+    samples = {}
+    for _ in range(args.repeat):
+        for module in MODULES:
+            samples.setdefault(f"import {module}", []).append(float(_python(_IMPORT.format(app=APP, module=module), env)))
+        page = json.loads(_python(_FIRST_PAGE.format(app=APP, main=os.path.join(APP, "main.py")), env))
+        for name, seconds in page.items():
+            samples.setdefault(name, []).append(seconds)
+        if not args.no_server:
+            samples.setdefault("server_ready", []).append(_server_ready(env))
+
+    results = {name: statistics.median(values) for name, values in samples.items()}
+    for name, seconds in results.items():
+        print(f"{name:<24} {seconds * 1000:>9.1f} ms  (min {min(samples[name]) * 1000:.1f})")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"repeat": args.repeat, "median_s": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Shared setup for the test suite: app/ modules import by bare name, as they
+do under ``streamlit run app/main.py``, and every cache and database lives in
+a throwaway directory so tests never touch a developer's .cache/.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+# Read at import time by the app modules, so set before any test imports them.
+os.environ["WISECPA_CACHE_DIR"] = tempfile.mkdtemp(prefix="wisecpa-tests-")
+os.environ.setdefault("WISECPA_WARM_START", "0")
+os.environ.setdefault("WISECPA_JOB_WORKERS", "0")
+os.environ.pop("WISECPA_DB_PATH", None)
+
+from fakes import FakeIRS, FakeOpenAI, start  # noqa: E402
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """A local fake model behind the real OpenAI client; the LLM cache is off."""
+    import llm_client
+    server = start(FakeOpenAI())
+    monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("WISECPA_LLM_CACHE", "0")
+    llm_client.get_client.clear()
+    yield server
+    llm_client.get_client.clear()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake_irs(tmp_path, monkeypatch):
+    """Every IRS form download returns template.pdf from a local server into a fresh store."""
+    import irs_forms
+    with open(os.path.join(ROOT, "template.pdf"), "rb") as f:
+        server = start(FakeIRS(f.read()))
+    monkeypatch.setattr(irs_forms, "IRS_BASE_URL", server.url)
+    monkeypatch.setattr(irs_forms, "FORMS_DIR", str(tmp_path / "irs_forms"))
+    monkeypatch.delenv("WISECPA_OFFLINE", raising=False)
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,145 @@
+"""Local stand-ins for the OpenAI API and irs.gov, a fake clock, plus synthetic client documents."""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fitz
+
+W2 = ("Form W-2 Wage and Tax Statement 2024\nEmployee's name JANE Q PUBLIC\n"
+      "a Employee's social security number 123-45-6789\n1 Wages, tips, other compensation {wages}\n"
+      "2 Federal income tax withheld {withheld}\nc Employer's name ACME PAYROLL, 100 MAIN ST, SPRINGFIELD IL")
+INT = ("Form 1099-INT Interest Income 2024\nPayer's name FIRST NATIONAL BANK\n1 Interest income {interest}\n"
+       "4 Federal income tax withheld {withheld}")
+
+DEDUCTIONS = ["Wages", "Interest income", "Federal income tax withheld"]
+FORMS = ["Form_1040|f1040 - U.S. Individual Income Tax Return"]
+
+
+def text_pdf(*pages: str) -> bytes:
+    """A text-layer PDF with one page per argument."""
+    with fitz.open() as doc:
+        for text in pages:
+            page = doc.new_page(width=612, height=792)
+            for i, line in enumerate(text.splitlines()):
+                page.insert_text((54, 72 + i * 20), line, fontsize=11)
+        return doc.tobytes()
+
+
+class FakeClock:
+    """Replaces a module's ``time``: time()/monotonic() read a counter that only sleep() and advance() move."""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    monotonic = perf_counter = time
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class FakeOpenAI(ThreadingHTTPServer):
+    """
+    OpenAI-compatible /v1/chat/completions. Fill prompts get a value for
+    every field ID, deduction prompts DEDUCTIONS and form prompts FORMS;
+    ``answer`` overrides that with fn(prompt) -> text. Prompts are recorded.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), _OpenAIHandler)
+        self.latency = latency
+        self.answer = None
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/v1"
+
+    def respond(self, prompt: str) -> str:
+        with self._lock:
+            self.prompts.append(prompt)
+        if self.answer is not None:
+            return self.answer(prompt)
+        if "PDF FIELDS" in prompt:
+            ids = re.findall(r"^(\d+): ", prompt.split("PDF FIELDS", 1)[1], re.MULTILINE)
+            return json.dumps({i: f"value {i}" for i in ids})
+        if "Deduction/Income names" in prompt:
+            return "\n".join(DEDUCTIONS)
+        return "\n".join(FORMS)
+
+
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = "\n".join(m.get("content") or "" for m in body["messages"] if m["role"] == "user")
+        time.sleep(self.server.latency)
+        content = self.server.respond(prompt)
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                 "total_tokens": (len(prompt) + len(content)) // 4}
+        base = {"id": "chatcmpl-test", "created": int(time.time()), "model": body["model"]}
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for piece in content.splitlines(keepends=True) or [content]:
+                self._event({**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+            self._event({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+        data = json.dumps({**base, "object": "chat.completion", "usage": usage,
+                           "choices": [{"index": 0, "finish_reason": "stop",
+                                        "message": {"role": "assistant", "content": content}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _event(self, payload: dict):
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+        self.wfile.flush()
+
+
+class FakeIRS(ThreadingHTTPServer):
+    """Serves ``pdf`` for every /<code>.pdf."""
+    daemon_threads = True
+
+    def __init__(self, pdf: bytes):
+        super().__init__(("127.0.0.1", 0), _IRSHandler)
+        self.pdf = pdf
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class _IRSHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(self.server.pdf)))
+        self.end_headers()
+        self.wfile.write(self.server.pdf)
+
+
+def start(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
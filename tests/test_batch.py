@@ -0,0 +1,74 @@
+"""The headless batch CLI end to end, against a local fake model and IRS server."""
+import json
+import os
+
+import fitz
+import pytest
+
+import batch
+from fakes import INT, W2, text_pdf
+
+
+def write_client(clients_dir, name, wages="52,000.00", interest="125.25"):
+    client_dir = clients_dir / name
+    client_dir.mkdir(parents=True)
+    (client_dir / "w2.pdf").write_bytes(text_pdf(W2.format(wages=wages, withheld="6,000.00")))
+    (client_dir / "1099int.pdf").write_bytes(text_pdf(INT.format(interest=interest, withheld="0.00")))
+    return client_dir
+
+
+@pytest.fixture
+def clients(tmp_path, fake_openai, fake_irs):
+    write_client(tmp_path / "clients", "alice")
+    write_client(tmp_path / "clients", "bob", wages="61,500.00", interest="12.00")
+    return tmp_path / "clients"
+
+
+def test_batch_fills_every_client(clients, tmp_path):
+    out = tmp_path / "out"
+    assert batch.main([str(clients), str(out), "--workers", "2", "--metrics", str(tmp_path / "metrics.prom")]) == 0
+
+    for client in ("alice", "bob"):
+        files = set(os.listdir(out / client))
+        assert {"Form_1040_filled.pdf", "Form_1040_extracted_data.csv", batch.RETURN_FILE, batch.CHECKPOINT_FILE} <= files
+        checkpoint = json.loads((out / client / batch.CHECKPOINT_FILE).read_text())
+        assert checkpoint["filled"]["f1040"]["status"] == "done"
+        with fitz.open(out / client / batch.RETURN_FILE) as doc:
+            assert doc.page_count > 0
+    assert "wisecpa_stage_seconds" in (tmp_path / "metrics.prom").read_text()
+
+
+def test_rule_values_beat_the_model(clients, tmp_path):
+    batch.run_batch(str(clients), str(tmp_path / "out"), workers=1)
+    checkpoint = json.loads((tmp_path / "out" / "bob" / batch.CHECKPOINT_FILE).read_text())
+    values = set(checkpoint["filled"]["f1040"]["fields"].values())
+    assert "61,500.00" in values
+    assert "6,000.00" in values
+
+
+def test_interrupted_run_resumes_from_checkpoint(clients, tmp_path, fake_openai):
+    out = tmp_path / "out"
+    batch.run_batch(str(clients), str(out), workers=2)
+    calls = len(fake_openai.prompts)
+    assert calls > 0
+
+    # Pretend the run died before filling alice's form.
+    path = out / "alice" / batch.CHECKPOINT_FILE
+    checkpoint = json.loads(path.read_text())
+    del checkpoint["filled"]
+    path.write_text(json.dumps(checkpoint))
+
+    summary = batch.run_batch(str(clients), str(out), workers=2)
+    assert [c["filled"] for c in summary["clients"]] == [1, 1]
+    new_prompts = fake_openai.prompts[calls:]
+    assert new_prompts and all("PDF FIELDS" in p for p in new_prompts)
+
+
+def test_failing_client_does_not_stop_the_batch(clients, tmp_path):
+    broken = clients / "carol"
+    broken.mkdir()
+    (broken / "scan.pdf").write_bytes(b"%PDF-1.4 truncated")
+
+    summary = batch.run_batch(str(clients), str(tmp_path / "out"), workers=2)
+    assert sorted(c["client"] for c in summary["clients"]) == ["alice", "bob"]
+    assert [f["client"] for f in summary["failures"]] == ["carol"]
@@ -0,0 +1,126 @@
+"""Brokerage CSV ingestion: wash sales, files pandas cannot read and the Form 8949 fill."""
+import pytest
+
+import capital_gains
+from ocr_utils import extract_text_from_csv
+
+HEADER = "Description,Date Acquired,Date Sold,Proceeds,Cost Basis\n"
+
+
+def trades(*rows) -> bytes:
+    return (HEADER + "".join(f"{','.join(r)}\n" for r in rows)).encode()
+
+
+def summarize(*rows) -> dict:
+    return capital_gains.summarize_trades([trades(*rows)])
+
+
+def test_lots_of_one_purchase_sold_together_are_not_wash_sales():
+    summary = summarize(("10 AAPL", "01/02/2024", "01/20/2024", "900.00", "1000.00"),
+                        ("5 AAPL", "01/02/2024", "01/20/2024", "400.00", "500.00"))
+    assert summary["wash_sales"] == 0
+    assert summary["form_8949"]["A"]["adjustment"] == 0
+    assert summary["schedule_d"]["7"] == -200.0
+
+
+def test_replacement_held_past_the_window_is_a_wash_sale():
+    summary = summarize(("10 AAPL", "01/02/2024", "01/20/2024", "900.00", "1000.00"),
+                        ("10 AAPL", "02/01/2024", "06/03/2024", "1200.00", "950.00"))
+    assert summary["wash_sales"] == 1
+    assert summary["form_8949"]["A"]["adjustment"] == 100.0
+
+
+def test_replacement_sold_inside_the_window_does_not_count():
+    summary = summarize(("10 AAPL", "01/02/2024", "01/20/2024", "900.00", "1000.00"),
+                        ("10 AAPL", "01/25/2024", "02/10/2024", "1000.00", "950.00"))
+    assert summary["wash_sales"] == 0
+
+
+def test_purchase_before_the_window_is_not_a_replacement():
+    summary = summarize(("10 AAPL", "01/02/2024", "03/20/2024", "900.00", "1000.00"),
+                        ("10 AAPL", "01/05/2024", "09/03/2024", "1200.00", "950.00"))
+    assert summary["wash_sales"] == 0
+
+
+def test_other_securities_do_not_count():
+    summary = summarize(("10 AAPL", "01/02/2024", "01/20/2024", "900.00", "1000.00"),
+                        ("10 MSFT", "01/10/2024", "06/03/2024", "1200.00", "950.00"))
+    assert summary["wash_sales"] == 0
+
+
+@pytest.mark.parametrize("data", [b"", b'Description,Proceeds,Cost Basis\n"AAPL,100.00,90.00\n', b"\xff\xfe\x00D"])
+def test_unreadable_csv_is_not_a_trade_csv(data):
+    assert capital_gains.is_trade_csv(data) is False
+
+
+class Upload:
+    type, name = "text/csv", "trades.csv"
+
+    def __init__(self, data):
+        self.data = data
+
+    def getvalue(self):
+        return self.data
+
+
+def test_broken_trade_csv_falls_back_to_text():
+    # The header reads fine; the unbalanced quote only shows up further down.
+    data = trades(("10 AAPL", "01/02/2024", "03/04/2024", "900.00", "1000.00")) + b'"MSFT,01/02/2024\n'
+    summary = capital_gains.summarize_trades([data, trades(("1 IBM", "01/02/2023", "03/04/2024", "200.00", "100.00"))])
+    assert summary["unreadable_files"] == 1
+    assert summary["lots"] == 1
+    assert extract_text_from_csv(Upload(data)) == data.decode().strip()
+    assert extract_text_from_csv(Upload(b"")) == ""
+    assert capital_gains.summarize_uploads([Upload(b""), Upload(b"\xff\xfe\x00D")]) is None
+
+
+def test_matches_a_direct_count():
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(7)
+    n = 400
+    security = rng.integers(-1, 4, n)
+    acquired = rng.integers(19000, 19200, n)
+    acquired[rng.random(n) < 0.1] = -1
+    sold = acquired + rng.integers(0, 90, n)
+    sold[acquired < 0] = rng.integers(19000, 19300, int((acquired < 0).sum()))
+    sold[rng.random(n) < 0.1] = -1
+    gain = rng.normal(0, 100, n)
+
+    flagged = capital_gains.detect_wash_sales(security, acquired, sold, gain)
+    window = capital_gains.WASH_SALE_DAYS
+    for i in range(n):
+        expected = gain[i] < 0 and sold[i] >= 0 and security[i] >= 0 and any(
+            security[j] == security[i] and acquired[j] >= 0 and abs(acquired[j] - sold[i]) <= window
+            and not (0 <= sold[j] <= sold[i] + window)
+            for j in range(n))
+        assert flagged[i] == expected, i
+
+
+# A Form 8949 field index: a totals row (line 2) and the box checkboxes, top to bottom, on each page.
+LINES_8949 = {"2": [[0, ["p1_d", "p1_e", "p1_g", "p1_h"]], [1, ["p2_d", "p2_e", "p2_g", "p2_h"]]]}
+WIDGETS_8949 = [{"field_name": f"c{page + 1}_1[{i}]", "page": page, "widget_type": "checkbox",
+                 "rect": [40, 100 + 12 * i, 48, 108 + 12 * i], "on_state": str(i + 1)}
+                for page in (0, 1) for i in (2, 0, 1)]
+
+
+def box_totals(gain):
+    return {"lots": 1, "proceeds": 1000.0 + gain, "cost": 1000.0, "adjustment": 0.0, "gain": gain}
+
+
+def test_form_8949_fills_and_checks_the_only_box_of_each_part():
+    summary = {"form_8949": {"C": box_totals(-50.0), "D": box_totals(200.0)}}
+    values = capital_gains.capital_gains_fields("f8949", summary, LINES_8949, WIDGETS_8949)
+    assert values == {"p1_d": "950.00", "p1_e": "1,000.00", "p1_g": "0.00", "p1_h": "(50.00)", "c1_1[2]": "3",
+                      "p2_d": "1,200.00", "p2_e": "1,000.00", "p2_g": "0.00", "p2_h": "200.00", "c2_1[0]": "1"}
+    assert capital_gains.form_8949_warnings(summary) == []
+
+
+def test_form_8949_part_with_several_boxes_is_left_alone():
+    # Brokerage (A) and crypto (C) lots need a Part I page each; the long-term part still fills.
+    summary = {"form_8949": {"A": box_totals(10.0), "C": box_totals(-50.0), "F": box_totals(5.0)}}
+    values = capital_gains.capital_gains_fields("f8949", summary, LINES_8949, WIDGETS_8949)
+    assert not any(name.startswith(("p1_", "c1_")) for name in values)
+    assert values["p2_h"] == "5.00"
+    assert values["c2_1[2]"] == "3"
+    [warning] = capital_gains.form_8949_warnings(summary)
+    assert "Part I" in warning and "A, C" in warning
@@ -0,0 +1,52 @@
+"""suggest_deductions maps chunks concurrently and reduces them in document order."""
+import threading
+import time
+
+import pytest
+
+import ai_engine
+
+ANSWERS = {"w2": ["Wages", "Federal income tax withheld"], "int": ["Interest income", "wages"],
+           "div": ["Ordinary dividends", "Interest Income"], "receipt": ["Charitable contributions"]}
+
+
+@pytest.fixture
+def chunks(monkeypatch):
+    """One chunk per "|"-separated part; earlier chunks answer last, and in-flight calls are counted."""
+    state = {"active": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def deductions_for_chunk(chunk):
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        time.sleep(0.05 * (len(ANSWERS) - list(ANSWERS).index(chunk)))
+        with lock:
+            state["active"] -= 1
+        return ANSWERS[chunk]
+
+    monkeypatch.setattr(ai_engine, "chunk_text", lambda text, *args: text.split("|"))
+    monkeypatch.setattr(ai_engine, "_deductions_for_chunk", deductions_for_chunk)
+    return state
+
+
+def test_partials_merge_in_chunk_order_not_completion_order(chunks):
+    result = ai_engine.suggest_deductions("w2|int|div|receipt", max_concurrency=4)
+    assert result.splitlines() == ["Wages", "Federal income tax withheld", "Interest income",
+                                   "Ordinary dividends", "Charitable contributions"]
+    assert chunks["peak"] == 4
+
+
+def test_concurrency_is_bounded(chunks):
+    ai_engine.suggest_deductions("w2|int|div|receipt", max_concurrency=2)
+    assert chunks["peak"] == 2
+
+
+def test_map_keeps_input_order_serially_too():
+    assert ai_engine._map_concurrently(str.upper, ["b", "a", "c"], max_concurrency=1) == ["B", "A", "C"]
+    assert ai_engine._map_concurrently(str.upper, [], max_concurrency=3) == []
+
+
+def test_merge_drops_normalized_duplicates():
+    assert ai_engine.merge_deductions([["Travel & meals", "Wages"], ["travel and meals", "WAGES.", "Tips"]]) == [
+        "Travel & meals", "Wages", "Tips"]
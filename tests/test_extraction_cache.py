@@ -0,0 +1,48 @@
+"""The extraction cache's disk tier expires, stays within its size budget and forgets documents."""
+import os
+import time
+
+from extraction_cache import ExtractionCache, content_hash, prune_cache_dir
+
+
+def _age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_expired_disk_entry_is_a_miss_and_deleted(tmp_path):
+    cache = ExtractionCache(disk_dir=str(tmp_path), ttl_seconds=60)
+    cache.put("a" * 64, "Ann Lee 123-45-6789")
+    assert ExtractionCache(disk_dir=str(tmp_path), ttl_seconds=60).get("a" * 64) == "Ann Lee 123-45-6789"
+
+    _age(cache._path("a" * 64), 120)
+    assert ExtractionCache(disk_dir=str(tmp_path), ttl_seconds=60).get("a" * 64) is None
+    assert not os.path.exists(cache._path("a" * 64))
+
+
+def test_oldest_entries_go_past_the_size_budget(tmp_path):
+    cache = ExtractionCache(disk_dir=str(tmp_path), max_bytes=250)
+    digests = [content_hash(str(n).encode()) for n in range(3)]
+    for age, digest in zip((30, 20, 10), digests):
+        cache.put(digest, "x" * 100)
+        _age(cache._path(digest), age)
+    cache.put(content_hash(b"new"), "x" * 100)
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(cache._path(d))
+                                                  for d in (digests[2], content_hash(b"new")))
+
+
+def test_forget_drops_both_tiers(tmp_path):
+    cache = ExtractionCache(disk_dir=str(tmp_path))
+    cache.put("b" * 64, "text")
+    cache.forget("b" * 64, "c" * 64)
+    assert cache.get("b" * 64) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_prune_skips_files_being_written(tmp_path):
+    (tmp_path / ".tmp-partial").write_text("x" * 100)
+    old = tmp_path / "old.txt"
+    old.write_text("x")
+    _age(old, 120)
+    assert prune_cache_dir(str(tmp_path), 60, 10) == 1
+    assert os.listdir(tmp_path) == [".tmp-partial"]
@@ -0,0 +1,72 @@
+"""The field memo learns one unambiguous source per field, per set of record kinds."""
+import itertools
+
+import pytest
+
+from chunking import DOCUMENT_BREAK
+from fakes import INT, W2
+from field_memo import apply_memo, learn
+
+FIELDS = ("wages", "total_income", "agi", "withholding")
+_revisions = itertools.count()
+
+
+@pytest.fixture
+def revision():
+    """A form revision of its own, so tests share the database but not a memo."""
+    return f"test-{next(_revisions)}"
+
+
+def _w2_only(wages, withheld):
+    return W2.format(wages=wages, withheld=withheld)
+
+
+def _w2_and_int(wages, withheld, interest, int_withheld):
+    return DOCUMENT_BREAK.join([W2.format(wages=wages, withheld=withheld),
+                                INT.format(interest=interest, withheld=int_withheld)])
+
+
+def _model_filled(form_fields):
+    return {name: "model" for name in form_fields}
+
+
+def test_w2_only_mapping_does_not_fill_a_client_with_interest(revision):
+    first = _w2_only("50,000.00", "6,000.00")
+    accepted = {"wages": "50,000.00", "total_income": "50,000.00", "agi": "50,000.00", "withholding": "6,000.00"}
+    assert learn("f1040", first, accepted, revision=revision, filled_by=_model_filled(accepted)) == 4
+
+    second = _w2_and_int("30,000.00", "3,000.00", "500.00", "100.00")
+    # Totals learned from a W-2-only client would be 30,000 and 3,000 here; all go to the model.
+    assert apply_memo("f1040", second, FIELDS, revision=revision)["form_fields"] == {}
+    assert apply_memo("f1040", _w2_only("41,000.00", "4,000.00"), FIELDS, revision=revision)["form_fields"] == {
+        "wages": "41,000.00", "total_income": "41,000.00", "agi": "41,000.00", "withholding": "4,000.00"}
+
+
+def test_multi_source_client_learns_only_single_matches(revision):
+    client = _w2_and_int("30,000.00", "3,000.00", "500.00", "100.00")
+    accepted = {"wages": "30,000.00", "interest": "500.00", "total_income": "30,500.00", "withholding": "3,100.00"}
+    learn("f1040", client, accepted, revision=revision, filled_by=_model_filled(accepted))
+
+    memo = apply_memo("f1040", _w2_and_int("20,000.00", "2,000.00", "75.00", "0.00"), revision=revision)
+    assert memo["form_fields"] == {"wages": "20,000.00", "interest": "75.00"}
+
+
+def test_value_matching_several_sources_is_not_learned(revision):
+    client = _w2_and_int("1,000.00", "100.00", "1,000.00", "0.00")
+    accepted = {"line_1z": "1,000.00"}
+    assert learn("f1040", client, accepted, revision=revision, filled_by=_model_filled(accepted)) == 0
+
+
+def test_rule_and_memo_values_are_not_evidence(revision):
+    client = _w2_only("50,000.00", "6,000.00")
+    accepted = {"wages": "50,000.00", "withholding": "6,000.00", "agi": "50,000.00"}
+    filled_by = {"wages": "rules", "withholding": "memo", "agi": "reviewer"}
+    assert learn("f1040", client, accepted, revision=revision, filled_by=filled_by) == 1
+    assert apply_memo("f1040", _w2_only("9.00", "1.00"), revision=revision)["form_fields"] == {"agi": "9.00"}
+
+
+def test_contradicted_source_is_dropped(revision):
+    learn("f1040", _w2_only("50,000.00", "6,000.00"), {"line_1z": "50,000.00"}, revision=revision)
+    # The reviewer corrected the line to something no single box explains.
+    learn("f1040", _w2_only("40,000.00", "4,000.00"), {"line_1z": "44,000.00"}, revision=revision)
+    assert apply_memo("f1040", _w2_only("30,000.00", "3,000.00"), revision=revision)["form_fields"] == {}
@@ -0,0 +1,52 @@
+"""Typed records from document text and the compact prompt block built from them."""
+from chunking import DOCUMENT_BREAK, PAGE_BREAK
+from fakes import W2
+from file_parser import compact_user_data, parse_csv, parse_document
+
+w2 = W2.format(wages="50,000.00", withheld="6,000.00") + "\n12a D 5,000.00"
+interest = "Form 1099-INT Interest Income 2024\nPayer's name FIRST NATIONAL BANK\n1 Interest income 500.00"
+receipt = "OFFICE SUPPLY DEPOT\nReceipt #7\nPrinter paper 24.99\nTotal 24.99"
+
+
+def test_w2():
+    [record] = parse_document(w2)
+    assert record.kind == "W2"
+    assert record.employee_name == "JANE Q PUBLIC"
+    assert record.employee_ssn == "123-45-6789"
+    assert (record.wages, record.federal_withholding) == (50000.0, 6000.0)
+
+
+def test_pages_of_one_pdf_are_parsed_per_form():
+    w2_record, int_record = parse_document(PAGE_BREAK.join([w2, interest]))
+    assert w2_record.federal_withholding == 6000.0
+    assert int_record.kind == "1099-INT"
+    assert int_record.interest == 500.0
+    assert int_record.federal_withholding is None
+
+
+def test_compact_replaces_parsed_lines():
+    compact = compact_user_data(DOCUMENT_BREAK.join([w2, interest]))
+    assert compact.startswith("Structured tax documents (JSON, columnar):")
+    assert '"W2"' in compact and '"1099-INT"' in compact
+    assert "Wages, tips, other compensation" not in compact
+    assert "Interest income 500.00" not in compact
+
+
+def test_compact_keeps_unparsed_text():
+    # A receipt scanned into the W-2's PDF and the W-2's box 12 line are not
+    # part of any record, so they must reach the model as text.
+    compact = compact_user_data(DOCUMENT_BREAK.join([PAGE_BREAK.join([w2, receipt]), interest]))
+    assert "12a D 5,000.00" in compact
+    for line in receipt.splitlines():
+        assert line in compact
+    assert "Federal income tax withheld 6,000.00" not in compact
+
+
+def test_compact_without_records_is_unchanged():
+    assert compact_user_data(receipt) == receipt
+
+
+def test_brokerage_csv():
+    lots = parse_csv(b"Description,Date Acquired,Date Sold,Proceeds,Cost Basis\n"
+                     b"10 AAPL,01/02/2024,03/04/2024,\"1,900.00\",2000.00\n")
+    assert [(r.kind, r.date_sold, r.proceeds, r.cost_basis) for r in lots] == [("1099-B", "2024-03-04", 1900.0, 2000.0)]
@@ -0,0 +1,54 @@
+"""fill_pdf_form sends its batches to the model concurrently."""
+import json
+import re
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import ai_engine
+
+DELAY = 0.3
+
+
+def _fake_completion(messages, **kwargs):
+    """A local stand-in for the chat API: answers every listed field ID after DELAY seconds."""
+    time.sleep(DELAY)
+    ids = re.findall(r"^(\d+): ", messages[-1]["content"], re.M)
+    content = json.dumps({i: f"value {i}" for i in ids})
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    monkeypatch.setenv("WISECPA_LLM_CACHE", "0")
+    monkeypatch.setattr(ai_engine, "chat_completion", _fake_completion)
+
+
+def _fields(n):
+    return [{"field_name": f"f1_{i}[0]", "label": f"Line {i}"} for i in range(n)]
+
+
+def _fill(max_concurrency):
+    fields = _fields(4 * ai_engine.FILL_BATCH_SIZE)
+    start = time.perf_counter()
+    result = ai_engine.fill_pdf_form(fields, "Wages 1,000.00", "Form_1040", max_concurrency=max_concurrency,
+                                     use_retrieval=False, use_records=False)
+    return result, time.perf_counter() - start
+
+
+def test_batches_run_concurrently(fake_llm):
+    serial, serial_s = _fill(1)
+    concurrent, concurrent_s = _fill(4)
+
+    assert serial_s >= 4 * DELAY
+    assert concurrent_s < 2 * DELAY
+    # Merged in batch order, so the answer does not depend on scheduling.
+    assert concurrent == serial
+    assert len(concurrent["form_fields"]) == 4 * ai_engine.FILL_BATCH_SIZE
+    assert concurrent["form_fields"]["f1_0[0]"] == "value 1"
+
+
+def test_concurrency_is_bounded(fake_llm):
+    _, seconds = _fill(2)
+    assert 2 * DELAY <= seconds < 3 * DELAY
@@ -0,0 +1,132 @@
+"""The {ID: value} answer protocol of fill_pdf_form: parsing, schema checks and repair prompts."""
+import json
+import re
+from types import SimpleNamespace
+
+import pytest
+
+import ai_engine
+from llm_client import LLMUnavailableError
+from telemetry import get_recorder
+
+TABLE = {1: {"field_name": "f1_1[0]", "label": "First name"},
+         2: {"field_name": "f1_2[0]", "label": "Wages"},
+         3: {"field_name": "c1_1[0]", "label": "Single"}}
+
+
+@pytest.mark.parametrize("raw", [
+    '{"1": "Ann"}',
+    '```json\n{"1": "Ann"}\n```',
+    'Here is the mapping: {"1": "Ann"} Hope this helps.',
+])
+def test_parse_answer_finds_the_object(raw):
+    assert ai_engine._parse_answer(raw) == {"1": "Ann"}
+
+
+@pytest.mark.parametrize("raw", ["", "no fields apply", '{"1": "Ann"', "} nothing {"])
+def test_parse_answer_without_an_object(raw):
+    assert ai_engine._parse_answer(raw) is None
+
+
+def test_check_answer_converts_and_drops():
+    values, failed = ai_engine._check_answer({" 1 ": "Ann", "2": 52000.0, "3": True, "9": "stray"}, TABLE)
+    assert values == {1: "Ann", 2: "52000", 3: "Yes"}
+    assert failed == set()
+
+
+def test_check_answer_flags_wrong_types():
+    values, failed = ai_engine._check_answer({"1": ["Ann"], "2": {"amount": 1}, "3": None}, TABLE)
+    assert values == {}
+    assert failed == {1, 2}
+
+
+@pytest.mark.parametrize("answer", [None, ["Ann"], "Ann"])
+def test_check_answer_asks_again_for_non_objects(answer):
+    assert ai_engine._check_answer(answer, TABLE) == ({}, {1, 2, 3})
+
+
+class ScriptedModel:
+    """Answers each prompt with the next scripted reply; ``None`` answers every listed ID."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    def __call__(self, messages, **kwargs):
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        reply = self.replies.pop(0) if self.replies else None
+        if reply is None:
+            reply = json.dumps({i: f"value {i}" for i in re.findall(r"^(\d+): ", prompt, re.M)})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+
+@pytest.fixture
+def model(monkeypatch):
+    monkeypatch.setenv("WISECPA_LLM_CACHE", "0")
+
+    def install(*replies):
+        scripted = ScriptedModel(replies)
+        monkeypatch.setattr(ai_engine, "chat_completion", scripted)
+        return scripted
+    return install
+
+
+def _fill(fields):
+    return ai_engine.fill_pdf_form(fields, "Ann Lee, wages 52,000.00", "Form_1040",
+                                   use_retrieval=False, use_records=False)
+
+
+def test_repair_asks_only_for_the_failed_ids(model):
+    scripted = model('{"1": "Ann", "2": ["52,000"]}', '{"2": "52,000.00"}')
+    values, failed = ai_engine._run_fill_batch(ai_engine._fill_batches(list(TABLE.values()), "data", "Form_1040", False)[0])
+
+    assert values == {1: "Ann", 2: "52,000.00"}
+    assert failed == []
+    assert len(scripted.prompts) == 2
+    assert "not valid JSON" in scripted.prompts[1]
+    assert re.findall(r"^(\d+): ", scripted.prompts[1], re.M) == ["2"]
+
+
+def test_garbage_after_every_repair_is_unresolved(model):
+    get_recorder().clear()
+    scripted = model(*["sorry, I cannot help"] * (1 + ai_engine.FILL_REPAIR_ATTEMPTS))
+    result = _fill(list(TABLE.values()))
+
+    assert len(scripted.prompts) == 1 + ai_engine.FILL_REPAIR_ATTEMPTS
+    assert result["form_fields"] == {}
+    assert result["unresolved"] == {"f1_1[0]": "First name", "f1_2[0]": "Wages", "c1_1[0]": "Single"}
+    spans = [s for s in get_recorder().spans if s["stage"] == "fill_batch"]
+    assert spans[-1]["repairs"] == ai_engine.FILL_REPAIR_ATTEMPTS
+    assert spans[-1]["unresolved"] == 3
+
+
+def test_partial_answers_leave_only_the_rest_unresolved(model):
+    model('{"1": "Ann", "3": [7]}', *['{"3": [1]}'] * ai_engine.FILL_REPAIR_ATTEMPTS)
+    result = _fill(list(TABLE.values()))
+
+    # Omitted IDs mean "no data" and are not asked again; only the invalid one is.
+    assert result["form_fields"] == {"f1_1[0]": "Ann"}
+    assert result["unresolved"] == {"c1_1[0]": "Single"}
+
+
+def test_clean_answer_has_nothing_unresolved(model):
+    model()
+    result = _fill(list(TABLE.values()))
+    assert result["form_fields"]["f1_2[0]"] == "value 2"
+    assert result["unresolved"] == {}
+
+
+def test_failed_model_call_leaves_only_its_batch_unresolved(model, monkeypatch):
+    monkeypatch.setattr(ai_engine, "FILL_BATCH_SIZE", 2)
+    scripted = model()
+
+    def flaky(messages, **kwargs):
+        if re.search(r"^3: ", messages[-1]["content"], re.M):
+            raise LLMUnavailableError("model API unavailable")
+        return scripted(messages, **kwargs)
+
+    monkeypatch.setattr(ai_engine, "chat_completion", flaky)
+    result = _fill(list(TABLE.values()))
+    assert result["form_fields"] == {"f1_1[0]": "value 1", "f1_2[0]": "value 2"}
+    assert result["unresolved"] == {"c1_1[0]": "Single"}
@@ -0,0 +1,91 @@
+"""Rule-table fast path (models/rules/f1040.json)."""
+import os
+
+from chunking import DOCUMENT_BREAK, PAGE_BREAK
+from conftest import ROOT
+from fakes import INT, W2
+from form_rules import apply_rules
+from pdf_filler import load_field_index
+
+with open(os.path.join(ROOT, "template.pdf"), "rb") as f:
+    LINES = load_field_index(f.read())["lines"]
+
+WAGES = "topmostSubform[0].Page1[0].f1_32[0]"
+INTEREST = "topmostSubform[0].Page1[0].f1_43[0]"
+W2_WITHHELD = "topmostSubform[0].Page2[0].f2_11[0]"
+FORM1099_WITHHELD = "topmostSubform[0].Page2[0].f2_12[0]"
+
+w2 = W2.format(wages="50,000.00", withheld="6,000.00")
+interest = INT.format(interest="500.00", withheld="0.00")
+
+
+def fields(user_data):
+    return apply_rules("f1040", user_data, lines=LINES)["form_fields"]
+
+
+def test_separate_documents():
+    filled = fields(DOCUMENT_BREAK.join([w2, interest]))
+    assert filled[WAGES] == "50,000.00"
+    assert filled[INTEREST] == "500.00"
+    assert filled[W2_WITHHELD] == "6,000.00"
+    assert filled[FORM1099_WITHHELD] == "0.00"
+
+
+def test_forms_on_pages_of_one_pdf_stay_apart():
+    # One upload: a W-2 page, then a 1099-INT page. The 1099 withholding
+    # source must not read the W-2's box 2.
+    filled = fields(PAGE_BREAK.join([w2, interest]))
+    assert filled[W2_WITHHELD] == "6,000.00"
+    assert filled[FORM1099_WITHHELD] == "0.00"
+    assert filled[INTEREST] == "500.00"
+
+    filled = fields(PAGE_BREAK.join([interest, w2]))
+    assert filled[W2_WITHHELD] == "6,000.00"
+    assert filled[FORM1099_WITHHELD] == "0.00"
+
+
+def test_copies_on_consecutive_pages_count_once():
+    copies = PAGE_BREAK.join([w2, w2.replace("2024", "2024 Copy C"), "Notice to Employee"])
+    filled = fields(DOCUMENT_BREAK.join([copies, interest]))
+    assert filled[WAGES] == "50,000.00"
+    assert filled[W2_WITHHELD] == "6,000.00"
+
+
+def test_two_w2_documents_are_summed():
+    other = W2.format(wages="10,000.50", withheld="1,000.00")
+    filled = fields(DOCUMENT_BREAK.join([w2, other]))
+    assert filled[WAGES] == "60,000.50"
+    assert filled[W2_WITHHELD] == "7,000.00"
+
+
+def test_unknown_field_names_are_skipped():
+    assert WAGES not in apply_rules("f1040", w2, field_names=["renamed"], lines=LINES)["form_fields"]
+
+
+def test_savings_bond_interest_is_taxable_interest():
+    bonds = interest + "\n3 Interest on U.S. Savings Bonds and Treasury obligations 250.00"
+    assert fields(DOCUMENT_BREAK.join([w2, bonds]))[INTEREST] == "750.00"
+
+
+def test_other_1099_withholding_is_left_to_the_model():
+    pension = ("Form 1099-R Distributions From Pensions, Annuities, Retirement\n"
+               "1 Gross distribution 10,000.00\n4 Federal income tax withheld 1,000.00")
+    filled = fields(DOCUMENT_BREAK.join([w2, interest, pension]))
+    assert FORM1099_WITHHELD not in filled
+    assert filled[INTEREST] == "500.00"
+
+
+def test_fields_follow_the_printed_line():
+    # A later revision that puts line 1a in f1_33 gets wages there, not in the old f1_32.
+    moved = {**LINES, "1a": [[0, ["topmostSubform[0].Page1[0].f1_33[0]"]]]}
+    filled = apply_rules("f1040", w2, lines=moved)["form_fields"]
+    assert filled["topmostSubform[0].Page1[0].f1_33[0]"] == "50,000.00"
+    assert WAGES not in filled
+
+
+def test_field_names_are_only_trusted_for_listed_revisions():
+    SSN = "topmostSubform[0].Page1[0].f1_06[0]"
+    assert apply_rules("f1040", w2, revision="0a7a54354283044c")["form_fields"][SSN] == "123-45-6789"
+    assert apply_rules("f1040", w2, revision="2025-reissue")["form_fields"] == {}
+    # Rules without a printed line need a listed revision even when the line index is known.
+    assert SSN not in apply_rules("f1040", w2, lines=LINES, revision="2025-reissue")["form_fields"]
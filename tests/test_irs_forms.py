@@ -0,0 +1,92 @@
+"""The local form store against a stand-in for irs.gov."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import irs_forms
+
+PDF_V1 = b"%PDF-1.4 revision one"
+PDF_V2 = b"%PDF-1.4 revision two"
+
+
+class FakeIRS(ThreadingHTTPServer):
+    """Serves one form with an ETag; ``status`` forces an error response."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.body, self.etag, self.status = PDF_V1, '"v1"', None
+        self.requests = []
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if server.status:
+            self.send_response(server.status)
+            self.end_headers()
+        elif self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("ETag", server.etag)
+            self.send_header("Content-Length", str(len(server.body)))
+            self.end_headers()
+            self.wfile.write(server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def irs(tmp_path, monkeypatch):
+    server = FakeIRS()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(irs_forms, "IRS_BASE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(irs_forms, "FORMS_DIR", str(tmp_path))
+    monkeypatch.setattr(irs_forms, "FORMS_MAX_AGE", 0)  # every call revalidates
+    monkeypatch.delenv("WISECPA_OFFLINE", raising=False)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_then_revalidate_with_etag(irs):
+    assert irs_forms.download_form_bytes("f1040") == PDF_V1
+    revision = irs_forms.form_revision("f1040")
+
+    assert irs_forms.download_form_bytes("f1040") == PDF_V1
+    assert irs.requests[-1] == ("/f1040.pdf", '"v1"')
+    assert irs_forms.form_revision("f1040") == revision
+
+
+def test_changed_form_gets_new_revision(irs):
+    irs_forms.download_form_bytes("f1040")
+    first = irs_forms.form_revision("f1040")
+    irs.body, irs.etag = PDF_V2, '"v2"'
+
+    assert irs_forms.download_form_bytes("f1040") == PDF_V2
+    assert irs_forms.form_revision("f1040") != first
+
+
+@pytest.mark.parametrize("status", [404, 500])
+def test_error_response_serves_stale_copy(irs, status):
+    irs_forms.download_form_bytes("f1040")
+    irs.status = status
+    assert irs_forms.download_form_bytes("f1040") == PDF_V1
+
+
+def test_error_without_stored_copy(irs):
+    irs.status = 404
+    assert irs_forms.download_form_bytes("f1040") is None
+
+
+def test_offline_uses_disk_only(irs):
+    assert irs_forms.download_form_bytes("f1040", offline=True) is None
+    irs_forms.download_form_bytes("f1040")
+    seen = len(irs.requests)
+    assert irs_forms.download_form_bytes("f1040", offline=True) == PDF_V1
+    assert len(irs.requests) == seen
@@ -0,0 +1,96 @@
+"""The SQLite job queue: dedupe, expiry of finished work and purging of payloads."""
+import time
+
+import pytest
+
+import db
+import jobs
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+def finish(job_id, db_path, seconds_ago=0.0):
+    db.finish_job(job_id, {"ok": True}, db_path=db_path)
+    db.get_connection(db_path).execute("UPDATE jobs SET finished_at = ? WHERE id = ?",
+                                       (time.time() - seconds_ago, job_id))
+
+
+def test_live_job_is_reused(db_path):
+    first = db.enqueue_job("preview", {"n": 1}, key="k", db_path=db_path)
+    assert db.enqueue_job("preview", {"n": 1}, key="k", db_path=db_path) == first
+    assert db.find_job("k", db_path=db_path) == first
+    assert db.enqueue_job("preview", {"n": 2}, key="other", db_path=db_path) != first
+
+
+def test_finished_job_is_reused_only_within_max_age(db_path):
+    first = db.enqueue_job("preview", {}, key="k", max_age=60, db_path=db_path)
+    finish(first, db_path, seconds_ago=30)
+    assert db.enqueue_job("preview", {}, key="k", max_age=60, db_path=db_path) == first
+    assert db.find_job("k", max_age=10, db_path=db_path) is None
+    assert db.enqueue_job("preview", {}, key="k", max_age=10, db_path=db_path) != first
+
+
+def test_failed_job_is_not_reused(db_path):
+    first = db.enqueue_job("preview", {}, key="k", db_path=db_path)
+    db.fail_job(first, "boom", db_path=db_path)
+    assert db.enqueue_job("preview", {}, key="k", max_age=3600, db_path=db_path) != first
+
+
+def test_purge_deletes_old_finished_payloads(db_path):
+    old_done = db.enqueue_job("preview", {"user_data": "SSN 123-45-6789"}, key="a", db_path=db_path)
+    finish(old_done, db_path, seconds_ago=7200)
+    old_failed = db.enqueue_job("preview", {"user_data": "SSN 123-45-6789"}, key="b", db_path=db_path)
+    db.fail_job(old_failed, "boom", db_path=db_path)
+    db.get_connection(db_path).execute("UPDATE jobs SET finished_at = 0 WHERE id = ?", (old_failed,))
+    recent = db.enqueue_job("preview", {}, key="c", db_path=db_path)
+    finish(recent, db_path, seconds_ago=10)
+    queued = db.enqueue_job("preview", {}, key="d", db_path=db_path)
+
+    assert db.purge_jobs(3600, db_path=db_path) == 2
+    assert db.get_job(old_done, db_path=db_path) is None
+    assert db.get_job(old_failed, db_path=db_path) is None
+    assert db.get_job(recent, db_path=db_path)["status"] == "done"
+    assert db.get_job(queued, db_path=db_path)["status"] == "queued"
+
+
+def test_job_key_follows_form_revision_and_rules(monkeypatch):
+    payload = {"code": "f1040", "form": "Form_1040", "user_data": "W-2", "client": "a"}
+    monkeypatch.setattr(jobs, "form_revision", lambda code: "rev1")
+    key = jobs.job_key("preview", payload)
+    assert jobs.job_key("preview", {**payload, "client": "b"}) == key
+
+    monkeypatch.setattr(jobs, "form_revision", lambda code: "rev2")
+    new_revision = jobs.job_key("preview", payload)
+    assert new_revision != key
+
+    monkeypatch.setattr(jobs, "rules_version", lambda code: "edited")
+    assert jobs.job_key("preview", payload) not in (key, new_revision)
+
+
+@pytest.fixture
+def prefetch_run(monkeypatch):
+    """Run the prefetch handler on two forms without downloads; returns the forms it queued."""
+    monkeypatch.setattr(jobs, "prefetch_forms", lambda codes: {c: {"revision": "rev"} for c in codes})
+    monkeypatch.setattr(jobs, "_mapping_tokens", lambda payload: 1000)
+    monkeypatch.setattr(jobs.db, "enqueue_job", lambda kind, payload, **kwargs: payload["code"])
+
+    def run(**payload):
+        previews = [{"code": "f1040", "form": "Form_1040"}, {"code": "f1040s1", "form": "Schedule_1"}]
+        return jobs.prefetch({"previews": previews, **payload})[0]
+    return run
+
+
+def test_prefetch_maps_nothing_by_default(prefetch_run):
+    result = prefetch_run()
+    assert result["previews"] == {}
+    assert result["skipped"] == ["f1040", "f1040s1"]
+    assert result["estimated_tokens"] == 0
+
+
+def test_prefetch_maps_forms_within_its_budget(prefetch_run):
+    result = prefetch_run(token_budget=1500)
+    assert result["previews"] == {"f1040": "f1040"}
+    assert result["skipped"] == ["f1040s1"]
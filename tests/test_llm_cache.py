@@ -0,0 +1,67 @@
+"""The model response cache: TTL expiry and least-recently-used eviction, on a fake clock."""
+import pytest
+
+import llm_cache
+from fakes import FakeClock
+from llm_cache import LLMCache, cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_cache, "time", clock)
+    return clock
+
+
+def test_key_covers_everything_that_shapes_the_answer():
+    key = cache_key("gpt-4o", 0.1, "system", "prompt")
+    assert key == cache_key("gpt-4o", 0.1, "system", "prompt")
+    assert len({key, cache_key("gpt-4o-mini", 0.1, "system", "prompt"), cache_key("gpt-4o", 0.2, "system", "prompt"),
+                cache_key("gpt-4o", 0.1, "other", "prompt"), cache_key("gpt-4o", 0.1, "system", "other")}) == 5
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = LLMCache(":memory:", ttl_seconds=60)
+    cache.put("k", "Wages")
+    clock.advance(59)
+    assert cache.get("k") == "Wages"
+    clock.advance(2)
+    assert cache.get("k") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 0, "bytes": 0}
+
+
+def test_expiry_counts_from_the_write_not_the_last_read(clock):
+    cache = LLMCache(":memory:", ttl_seconds=60)
+    cache.put("k", "Wages")
+    for _ in range(3):
+        clock.advance(30)
+        cache.get("k")
+    assert cache.get("k") is None
+
+
+def test_writes_drop_expired_entries(clock):
+    cache = LLMCache(":memory:", ttl_seconds=60)
+    cache.put("old", "Wages")
+    clock.advance(61)
+    cache.put("new", "Interest")
+    assert cache.stats()["entries"] == 1
+
+
+def test_least_recently_used_entries_go_past_the_size_budget(clock):
+    cache = LLMCache(":memory:", ttl_seconds=0, max_bytes=10)
+    cache.put("a", "aaaa")
+    clock.advance(1)
+    cache.put("b", "bbbb")
+    clock.advance(1)
+    assert cache.get("a") == "aaaa"  # a is now more recent than b
+    clock.advance(1)
+    cache.put("c", "cccc")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("aaaa", "cccc")
+    assert cache.stats()["bytes"] == 8
+
+
+def test_entries_survive_a_reopen(tmp_path, clock):
+    path = str(tmp_path / "llm.sqlite3")
+    LLMCache(path).put("k", "Wages")
+    assert LLMCache(path).get("k") == "Wages"
@@ -0,0 +1,115 @@
+"""Retries and error mapping of llm_client, against a fake client and without real sleeps."""
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import llm_client
+from llm_client import LLMError, LLMRateLimitError, LLMUnavailableError, RateLimiter
+
+REQUEST = httpx.Request("POST", "https://api.openai.test/v1/chat/completions")
+MESSAGES = [{"role": "user", "content": "Wages?"}]
+
+
+def status_error(cls, status):
+    return cls(f"HTTP {status}", response=httpx.Response(status, request=REQUEST), body=None)
+
+
+def reply(content="52,000.00"):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                           usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15))
+
+
+class FakeClient:
+    """chat.completions.create raises the scripted errors in turn, then answers."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else reply()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff waits tenacity asked for, instead of sleeping them."""
+    waited = []
+    monkeypatch.setattr(llm_client._create.retry, "sleep", waited.append)
+    monkeypatch.setattr(llm_client._open_stream.retry, "sleep", waited.append)
+    monkeypatch.setattr(llm_client, "_limiter", RateLimiter(rpm=0, tpm=0))
+    return waited
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def install(*outcomes):
+        fake = FakeClient(*outcomes)
+        monkeypatch.setattr(llm_client, "get_client", lambda: fake)
+        return fake
+    return install
+
+
+def test_retries_rate_limits_with_growing_backoff(client, sleeps):
+    fake = client(*[status_error(openai.RateLimitError, 429)] * 3)
+    response = llm_client.chat_completion(MESSAGES, model="gpt-4o")
+    assert response.choices[0].message.content == "52,000.00"
+    assert fake.calls == 4
+    assert len(sleeps) == 3
+    # Full jitter: each wait is drawn below an exponentially growing cap.
+    assert all(0 <= s <= 2 ** n for n, s in enumerate(sleeps))
+
+
+def test_persistent_rate_limit_gives_up_after_max_attempts(client, sleeps):
+    fake = client(*[status_error(openai.RateLimitError, 429)] * 99)
+    with pytest.raises(LLMRateLimitError):
+        llm_client.chat_completion(MESSAGES, model="gpt-4o")
+    assert fake.calls == llm_client.LLM_MAX_ATTEMPTS
+    assert len(sleeps) == llm_client.LLM_MAX_ATTEMPTS - 1
+    assert all(s <= 60 for s in sleeps)
+
+
+@pytest.mark.parametrize("error", [status_error(openai.InternalServerError, 503),
+                                   openai.APIConnectionError(request=REQUEST),
+                                   openai.APITimeoutError(request=REQUEST)])
+def test_outages_are_retried_then_reported_as_unavailable(client, sleeps, error):
+    fake = client(*[error] * 99)
+    with pytest.raises(LLMUnavailableError):
+        llm_client.chat_completion(MESSAGES, model="gpt-4o")
+    assert fake.calls == llm_client.LLM_MAX_ATTEMPTS
+
+
+def test_client_errors_are_not_retried(client, sleeps):
+    fake = client(status_error(openai.BadRequestError, 400))
+    with pytest.raises(LLMError) as raised:
+        llm_client.chat_completion(MESSAGES, model="gpt-4o")
+    assert type(raised.value) is LLMError
+    assert fake.calls == 1
+    assert sleeps == []
+
+
+def test_usage_settles_the_token_bucket(client, sleeps, monkeypatch):
+    settled = []
+    limiter = RateLimiter(rpm=0, tpm=100_000)
+    monkeypatch.setattr(limiter, "settle", lambda estimated, actual: settled.append((estimated, actual)))
+    monkeypatch.setattr(llm_client, "_limiter", limiter)
+    client()
+    llm_client.chat_completion(MESSAGES, model="gpt-4o")
+    [(estimated, actual)] = settled
+    assert actual == 15
+    assert estimated > llm_client.EXPECTED_COMPLETION_TOKENS
+
+
+def test_stream_retries_opening_only(client, sleeps):
+    chunks = [SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=c))])
+              for c in ("52,", "000.00")]
+    fake = client(status_error(openai.RateLimitError, 429), iter(chunks))
+    assert "".join(llm_client.chat_completion_stream(MESSAGES, model="gpt-4o")) == "52,000.00"
+    assert fake.calls == 2
+    assert len(sleeps) == 1
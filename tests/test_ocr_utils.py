@@ -0,0 +1,92 @@
+"""Text extraction across the shared process pool (text-layer PDFs only; no Tesseract needed)."""
+import io
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz
+import pdfplumber
+import pytest
+
+import ocr_utils
+
+
+class Upload:
+    """Minimal stand-in for a Streamlit UploadedFile."""
+
+    def __init__(self, data: bytes, type: str = "application/pdf", name: str = "doc.pdf"):
+        self.data, self.type, self.name = data, type, name
+
+    def getvalue(self):
+        return self.data
+
+
+def make_pdf(pages: int, tag: str) -> bytes:
+    with fitz.open() as doc:
+        for n in range(pages):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"{tag} page {n + 1}: Wages, tips, other compensation 52,000.00")
+        return doc.tobytes()
+
+
+def page_texts(data: bytes) -> list[str]:
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        return [p.extract_text() for p in pdf.pages]
+
+
+def test_split_pages_keeps_each_page_text():
+    data = make_pdf(5, "A")
+    pages = ocr_utils.split_pdf_pages(data)
+    assert len(pages) == 5
+    assert [page_texts(p) for p in pages] == [[t] for t in page_texts(data)]
+
+
+def test_extract_texts_keeps_upload_and_page_order():
+    docs = [make_pdf(3, "A"), make_pdf(1, "B"), make_pdf(4, "C")]
+    texts = ocr_utils.extract_texts([Upload(d) for d in docs], max_workers=3, use_cache=False)
+    assert texts == [ocr_utils._join_pages(page_texts(d)) for d in docs]
+
+
+def test_concurrent_callers_share_the_pool():
+    # Different batch sizes used to resize (and cancel) the pool under each other.
+    docs = {tag: make_pdf(n, tag) for tag, n in (("A", 1), ("B", 6), ("C", 2), ("D", 9))}
+    results, errors = {}, []
+
+    def run(tag):
+        try:
+            results[tag] = ocr_utils.extract_texts([Upload(docs[tag])], max_workers=2, use_cache=False)[0]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(tag,)) for tag in docs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert results == {tag: ocr_utils._join_pages(page_texts(d)) for tag, d in docs.items()}
+    assert ocr_utils._get_pool.status()["instances"] == 1
+
+
+def _crash(*args):
+    os._exit(1)
+
+
+def test_broken_pool_is_shut_down_and_rebuilt(monkeypatch):
+    docs = [Upload(make_pdf(3, "A"))]
+    monkeypatch.setattr(ocr_utils, "_extract_pdf_page", _crash)
+    pool = ocr_utils._get_pool(2)
+    with pytest.raises(BrokenProcessPool):
+        ocr_utils.extract_texts(docs, max_workers=2, use_cache=False)
+    assert pool._shutdown_thread
+    assert ocr_utils._get_pool.status()["instances"] == 0
+
+    monkeypatch.undo()
+    assert ocr_utils.extract_texts(docs, max_workers=2, use_cache=False) == [ocr_utils._join_pages(page_texts(docs[0].data))]
+
+
+@pytest.fixture(autouse=True)
+def _fresh_pool():
+    ocr_utils._get_pool.clear()
+    yield
+    ocr_utils._get_pool.clear()
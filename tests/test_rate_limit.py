@@ -0,0 +1,54 @@
+"""The token bucket behind the model rate limits, on a fake clock."""
+import pytest
+
+import rate_limit
+from fakes import FakeClock
+from llm_client import RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def test_full_bucket_serves_a_burst_then_waits_for_the_refill(clock):
+    bucket = rate_limit.TokenBucket(60)
+    assert [bucket.acquire() for _ in range(60)] == [0.0] * 60
+    assert bucket.acquire() == pytest.approx(1.0)
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_tokens_refill_with_time_up_to_capacity(clock):
+    bucket = rate_limit.TokenBucket(120, capacity=10)
+    bucket.acquire(10)
+    clock.advance(2.5)  # 2 tokens per second
+    assert bucket.acquire(5) == 0.0
+    clock.advance(3600)
+    assert bucket.acquire(10) == 0.0
+    assert bucket.acquire(1) == pytest.approx(0.5)
+
+
+def test_request_larger_than_the_bucket_waits_for_a_full_bucket(clock):
+    bucket = rate_limit.TokenBucket(60, capacity=30)
+    bucket.acquire(30)
+    assert bucket.acquire(500) == pytest.approx(30.0)
+
+
+def test_adjust_credits_and_debits(clock):
+    bucket = rate_limit.TokenBucket(60, capacity=100)
+    bucket.acquire(100)
+    bucket.adjust(40)
+    assert bucket.acquire(40) == 0.0
+    bucket.adjust(-30)
+    assert bucket.acquire(10) == pytest.approx(40.0)
+
+
+def test_limiter_refunds_an_overestimate(clock):
+    limiter = RateLimiter(rpm=0, tpm=1000)
+    limiter.acquire(1000)
+    limiter.settle(estimated_tokens=1000, actual_tokens=400)
+    limiter.acquire(600)
+    assert clock.sleeps == []
+    assert limiter.requests is None
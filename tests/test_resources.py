@@ -0,0 +1,105 @@
+"""Lazy imports and the pool of long-lived resources: health checks, rebuilds and warm-up."""
+import sys
+
+import pytest
+
+import resources
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Resources defined by a test register here instead of next to the app's."""
+    monkeypatch.setattr(resources, "_resources", {})
+    monkeypatch.setattr(resources, "_warm_thread", None)
+
+
+class Conn:
+    def __init__(self, n):
+        self.n, self.open = n, True
+
+    def close(self):
+        self.open = False
+
+
+def pooled(name="connect", **kwargs):
+    """A resource registered as ``name`` that builds Conn objects; returns it and the list of builds."""
+    built = []
+
+    def connect(n=0):
+        built.append(Conn(n))
+        return built[-1]
+    connect.__name__ = name
+    return resources.resource(check=lambda c: c.open, close=Conn.close, **kwargs)(connect), built
+
+
+def test_lazy_module_imports_on_first_use(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    colorsys = resources.lazy_module("colorsys")
+    assert "colorsys" not in sys.modules
+    assert "not loaded" in repr(colorsys)
+    assert colorsys.rgb_to_hsv(1, 0, 0) == (0.0, 1.0, 1)
+    assert "colorsys" in sys.modules
+    assert "(loaded)" in repr(colorsys)
+
+
+def test_one_instance_per_argument_tuple():
+    connect, built = pooled()
+    assert connect() is connect()
+    assert connect(n=1) is connect(n=1) is not connect()
+    assert len(built) == 2
+    assert connect.status()["builds"] == 2
+
+
+def test_unhealthy_instance_is_closed_and_rebuilt():
+    connect, built = pooled()
+    first = connect()
+    first.open = False
+    second = connect()
+    assert second is not first and second.open
+    assert connect.status()["rebuilds"] == 1
+
+
+def test_check_that_raises_counts_as_unhealthy():
+    built = []
+
+    @resources.resource(check=lambda c: c.missing_attribute)
+    def connect():
+        built.append(Conn(0))
+        return built[-1]
+
+    connect()
+    connect()
+    assert len(built) == 2
+
+
+def test_discard_and_clear_close_instances():
+    connect, built = pooled()
+    first, other = connect(), connect(n=1)
+    connect.discard()
+    assert not first.open and other.open
+    assert connect() is not first
+    connect.clear()
+    assert not any(c.open for c in built)
+    assert connect.status()["instances"] == 0
+
+
+def test_warm_up_builds_warm_resources_once(monkeypatch):
+    monkeypatch.setenv("WISECPA_WARM_START", "1")
+    warm, warm_built = pooled("warm", warm=())
+    cold, cold_built = pooled("cold")
+
+    @resources.resource(warm=())
+    def broken():
+        raise RuntimeError("no network")
+
+    thread = resources.warm_up(modules=("json", "no_such_module_wisecpa"), background=False)
+    assert resources.warm_up(background=False) is thread
+    assert len(warm_built) == 1 and cold_built == []
+    assert [row["builds"] for row in resources.health()] == [1, 0, 0]
+
+
+def test_warm_up_can_be_turned_off(monkeypatch):
+    monkeypatch.setenv("WISECPA_WARM_START", "0")
+    warm, built = pooled(warm=())
+    assert resources.warm_up(background=False) is None
+    assert built == []
@@ -0,0 +1,158 @@
+"""Persistent client sessions: only what a changed upload set affects is recomputed."""
+import time
+
+import pytest
+
+import sessions
+
+
+class Upload:
+    type = "application/pdf"
+
+    def __init__(self, name, data: bytes):
+        self.name, self.data = name, data
+
+    def getvalue(self):
+        return self.data
+
+
+W2, INT, RECEIPT = Upload("w2.pdf", b"w2"), Upload("int.pdf", b"int"), Upload("receipt.pdf", b"receipt")
+DELAY = 0.3
+DEDUCTIONS = {"text of w2.pdf": ["Wages"], "text of int.pdf": ["Interest income", "wages"],
+              "text of receipt.pdf": ["Office supplies"]}
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """Fake extraction and model calls that record what they were asked to do."""
+    calls = {"extracted": [], "deductions": [], "forms": 0}
+
+    def extract_texts(files):
+        calls["extracted"] += [f.name for f in files]
+        return [f"text of {f.name}" for f in files]
+
+    def iter_document_deductions(texts):
+        for i, text in enumerate(texts):
+            calls["deductions"].append(text)
+            for name in DEDUCTIONS[text]:
+                yield i, name
+            yield i, None
+
+    def iter_forms(deductions):
+        calls["forms"] += 1
+        yield {"form": "Form_1040", "code": "f1040", "desc": "U.S. Individual Income Tax Return"}
+
+    monkeypatch.setattr(sessions, "extract_texts", extract_texts)
+    monkeypatch.setattr(sessions, "iter_document_deductions", iter_document_deductions)
+    monkeypatch.setattr(sessions, "iter_forms", iter_forms)
+    return calls
+
+
+@pytest.fixture
+def client_id():
+    return sessions.new_client_id()
+
+
+def analyse(client_id, uploads):
+    documents = sessions.extract_documents(client_id, uploads)
+    deductions = list(sessions.iter_client_deductions(client_id, documents))
+    forms = list(sessions.iter_client_forms(client_id, deductions))
+    return documents, deductions, forms
+
+
+def test_new_document_is_the_only_one_reanalysed(model, client_id):
+    analyse(client_id, [W2])
+    documents, deductions, forms = analyse(client_id, [W2, INT])
+    assert model["extracted"] == ["w2.pdf", "int.pdf"]
+    assert model["deductions"] == ["text of w2.pdf", "text of int.pdf"]
+    assert deductions == ["Wages", "Interest income"]
+    assert [d["name"] for d in documents] == ["w2.pdf", "int.pdf"]
+    assert model["forms"] == 2  # the merged deduction list changed
+
+
+def test_unchanged_packet_is_served_from_the_store(model, client_id):
+    analyse(client_id, [W2, INT])
+    _, deductions, forms = analyse(client_id, [W2, INT, W2])
+    assert model["extracted"] == ["w2.pdf", "int.pdf"]
+    assert len(model["deductions"]) == 2
+    assert model["forms"] == 1
+    assert forms[0]["code"] == "f1040"
+
+
+def test_document_without_new_deductions_keeps_forms(model, client_id, monkeypatch):
+    analyse(client_id, [W2])
+    monkeypatch.setitem(DEDUCTIONS, "text of dup.pdf", ["WAGES"])
+    analyse(client_id, [W2, Upload("dup.pdf", b"dup")])
+    assert model["forms"] == 1
+
+
+def test_removed_document_is_forgotten(model, client_id):
+    analyse(client_id, [W2, RECEIPT])
+    documents, deductions, _ = analyse(client_id, [W2])
+    assert [d["name"] for d in documents] == ["w2.pdf"]
+    assert deductions == ["Wages"]
+    state = sessions.session_state(client_id)
+    assert state["deductions"] == ["Wages"]
+    assert state["forms"][0]["code"] == "f1040"
+
+
+def test_removed_document_leaves_the_extraction_cache(model, client_id):
+    from extraction_cache import content_hash, get_extraction_cache
+    analyse(client_id, [W2, RECEIPT])
+    cache = get_extraction_cache()
+    for upload in (W2, RECEIPT):
+        cache.put(content_hash(upload.data), f"text of {upload.name}")
+    analyse(client_id, [W2])
+    assert cache.get(content_hash(RECEIPT.data)) is None
+    assert cache.get(content_hash(W2.data)) == "text of w2.pdf"
+
+
+def test_session_restores_the_mapping_of_the_same_packet(model, client_id):
+    documents, _, _ = analyse(client_id, [W2])
+    sessions.save_mapping(client_id, "f1040", documents, {"f1_32": "50,000.00"}, {"Wages": "50,000.00"})
+    assert sessions.session_state(client_id)["mappings"] == {
+        "f1040": {"form_fields": {"f1_32": "50,000.00"}, "semantic_fields": {"Wages": "50,000.00"}}}
+
+
+@pytest.mark.parametrize("packet", [[W2, INT], [INT], [INT, W2]])
+def test_changed_packet_drops_stored_mappings(model, client_id, packet):
+    analyse(client_id, [W2, INT] if packet == [INT, W2] else [W2])
+    documents = sessions.stored_documents(client_id)
+    sessions.save_mapping(client_id, "f1040", documents, {"f1_32": "50,000.00"}, {})
+
+    analyse(client_id, packet)
+    assert sessions.session_state(client_id)["mappings"] == {}
+    assert sessions.client_mappings(client_id, documents) == {}
+
+
+def test_mapping_saved_for_an_older_packet_is_not_restored(model, client_id):
+    old = sessions.extract_documents(client_id, [W2])
+    sessions.extract_documents(client_id, [W2, INT])
+    sessions.save_mapping(client_id, "f1040", old, {"f1_32": "50,000.00"}, {})
+    assert sessions.session_state(client_id)["mappings"] == {}
+
+
+def test_client_ids_are_unguessable():
+    ids = {sessions.new_client_id() for _ in range(100)}
+    assert len(ids) == 100
+    assert all(sessions.valid_client_id(i) and len(i) >= 22 for i in ids)
+    for guessable in ("", None, "1a2b3c4d", "../../etc", "x" * 200):
+        assert not sessions.valid_client_id(guessable)
+
+
+def test_new_documents_reach_the_model_concurrently(model, client_id, monkeypatch):
+    import ai_engine
+
+    def stream_openai(prompt):
+        time.sleep(DELAY)
+        yield DEDUCTIONS[next(t for t in DEDUCTIONS if t in prompt)][0] + "\n"
+
+    monkeypatch.setattr(ai_engine, "stream_openai", stream_openai)
+    monkeypatch.setattr(sessions, "iter_document_deductions", ai_engine.iter_document_deductions)
+    documents = sessions.extract_documents(client_id, [W2, INT, RECEIPT])
+    start = time.perf_counter()
+    deductions = list(sessions.iter_client_deductions(client_id, documents))
+    assert time.perf_counter() - start < 2 * DELAY
+    assert sorted(deductions) == ["Interest income", "Office supplies", "Wages"]
+    assert [d["deductions"] for d in sessions.stored_documents(client_id)] == [["Wages"], ["Interest income"],
+                                                                                ["Office supplies"]]
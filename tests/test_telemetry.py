@@ -0,0 +1,21 @@
+"""Spans name clients by alias, and a client's view of the metrics holds only its own spans."""
+import json
+
+import sessions
+from telemetry import Recorder, span
+
+
+def test_client_metrics_are_filtered_to_the_alias(monkeypatch):
+    recorder = Recorder(jsonl_path=None)
+    monkeypatch.setattr("telemetry._recorder", recorder)
+    mine, other = sessions.new_client_id(), sessions.new_client_id()
+    for client_id in (mine, other):
+        with span("ocr", client=sessions.client_alias(client_id)):
+            pass
+
+    alias = sessions.client_alias(mine)
+    assert mine not in alias
+    assert [r["client"] for r in recorder.aggregate(("client", "stage"), client=alias)] == [alias]
+    assert [json.loads(line)["client"] for line in recorder.to_jsonl(alias).splitlines()] == [alias]
+    prometheus = recorder.to_prometheus(alias)
+    assert alias in prometheus and sessions.client_alias(other) not in prometheus